@@ -25,6 +25,8 @@ import glob
 # from data_loading.gen_masks_kitti import MaskGenerator
 # from struct2depth.alignment import align
 from data_loading.gen_train_txt_kinect import generate_train_txt_kinect
+from data_loading.triplet_builder import TripletBuilder
+from struct2depth.shards import ShardWriter
 
 SEQ_LENGTH = 3
 WIDTH = 416
@@ -33,6 +35,7 @@ STEPSIZE = 1
 INPUT_DIR = '/mnt/kinect_images/warehouse_8_15/color'
 OUTPUT_DIR = '/mnt/train_data/warehouse_8_15'
 KINECT_CALIBRATION_FILE = 'kinect_camera_intrinsics.csv'
+OUTPUT_FORMAT = 'png'  # 'png' or 'shards', see struct2depth/shards.py
 
 
 def crop(img, segimg, fx, fy, cx, cy):
@@ -87,55 +90,33 @@ with open(calib_file) as file:
         camera_mat[1, 2] = float(row[5])
         camera_mat[2, 2] = 1
 
+shard_writer = ShardWriter(OUTPUT_DIR) if OUTPUT_FORMAT == 'shards' else None
+
 ct = 0
 for d in glob.glob(INPUT_DIR + '/*/'):
     files = sorted(glob.glob(d + '/*.png'))
     print('Processing sequence: {}'.format(d))
-    for i in range(SEQ_LENGTH, len(files) + 1, STEPSIZE):
-        imgnum = str(ct).zfill(10)
-
-        big_img = np.zeros(shape=(HEIGHT, WIDTH * SEQ_LENGTH, 3))
-        wct = 0
-
-        # Define list of seg_mask images
-        seg_list = []
-
-        for j in range(i - SEQ_LENGTH, i):  # Collect frames for this sample.
-            img = cv2.imread(files[j])
-            ORIGINAL_HEIGHT, ORIGINAL_WIDTH, _ = img.shape
-
-            zoom_x = WIDTH / ORIGINAL_WIDTH
-            zoom_y = HEIGHT / ORIGINAL_HEIGHT
 
-            # Adjust intrinsics.
-            calib_current = camera_mat.copy()
-            calib_current[0, 0] *= zoom_x
-            calib_current[0, 2] *= zoom_x
-            calib_current[1, 1] *= zoom_y
-            calib_current[1, 2] *= zoom_y
-
-            calib_representation = ','.join([str(c) for c in calib_current.flatten()])
-
-            img = cv2.resize(img, (WIDTH, HEIGHT))
-            big_img[:, wct * WIDTH:(wct + 1) * WIDTH] = img
-            wct += 1
-
-            # Generate seg_mask and add to list
-            # seg_list.append(mask_generator.generate_seg_img(img))
-            # mask_generator.visualize()
+    # Each frame is decoded and resized once and reused by the triplets it belongs to
+    builder = TripletBuilder(camera_mat, seq_length=SEQ_LENGTH, stepsize=STEPSIZE, width=WIDTH, height=HEIGHT)
+    for triplet in builder.build(files):
+        imgnum = str(ct).zfill(10)
 
-        # Align seg_masks
-        # seg_list[0], seg_list[1], seg_list[2] = align(seg_list[0], seg_list[1], seg_list[2])
-        big_seg_img = np.zeros(shape=(HEIGHT, WIDTH * SEQ_LENGTH, 3))
+        # Generate seg_mask and align seg_masks
+        # See gen_data_kitti.py, seg masks are passed to builder.add with align_fn=align
 
-        # Create seg_mask triplet
-        # for k in range(0, 3):
-        #     big_seg_img[:, k * WIDTH:(k + 1) * WIDTH] = seg_list[k]
+        if shard_writer is not None:
+            shard_writer.write(triplet.image, triplet.seg_image, triplet.intrinsics, bgr=True)
+            ct += 1
+            continue
 
         # Write triplet, seg_mask triplet, and camera intrinsics to files
-        cv2.imwrite(OUTPUT_DIR + imgnum + '.png', big_img)
-        cv2.imwrite(OUTPUT_DIR + imgnum + '-fseg.png', big_seg_img)
+        cv2.imwrite(OUTPUT_DIR + imgnum + '.png', triplet.image)
+        cv2.imwrite(OUTPUT_DIR + imgnum + '-fseg.png', triplet.seg_image)
         f = open(OUTPUT_DIR + imgnum + '_cam.csv', 'w')
-        f.write(calib_representation)
+        f.write(triplet.calib_representation)
         f.close()
         ct += 1
+
+if shard_writer is not None:
+    shard_writer.close()
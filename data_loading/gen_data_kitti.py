@@ -15,8 +15,11 @@
 
 """ Offline data generation for the KITTI dataset."""
 
+import multiprocessing
 import os
 from absl import app
+from absl import flags
+from absl import logging
 import numpy as np
 import cv2
 import glob
@@ -25,6 +28,8 @@ import glob
 from data_loading.gen_masks_kitti import MaskGenerator
 from struct2depth.alignment import align
 from data_loading.gen_train_txt_kitti import generate_train_txt
+from data_loading.triplet_builder import TripletBuilder
+from struct2depth.shards import ShardWriter
 
 SEQ_LENGTH = 3
 WIDTH = 416
@@ -33,6 +38,22 @@ STEPSIZE = 1
 INPUT_DIR = '/mnt/isaac/apps/carter_sim_struct2depth/synth_images/'
 OUTPUT_DIR = '/mnt/isaac/apps/carter_sim_struct2depth/synth_images/'
 
+# Output formats: a png triplet, png seg mask and intrinsics text file per sample, or one shard directory
+# per sequence, see struct2depth/shards.py
+OUTPUT_FORMATS = ['png', 'shards']
+
+# Sequences finished so far, one name per line. Used to resume interrupted runs.
+MANIFEST_NAME = 'manifest.txt'
+
+flags.DEFINE_string('input_dir', INPUT_DIR, 'Raw KITTI directory with one folder per date.')
+flags.DEFINE_string('output_dir', OUTPUT_DIR, 'Directory to write triplets, seg masks, and intrinsics to.')
+flags.DEFINE_integer('num_workers', 1, 'Number of worker processes, each with its own Mask R-CNN.')
+flags.DEFINE_integer('mask_batch_size', SEQ_LENGTH, 'Number of frames per Mask R-CNN forward pass.')
+flags.DEFINE_enum('output_format', 'png', OUTPUT_FORMATS, 'Write png files or binary shards.')
+flags.DEFINE_bool('cpu_only', False, 'Run Mask R-CNN on the CPU, splitting the cores between the workers.')
+
+FLAGS = flags.FLAGS
+
 
 def get_line(file, start):
     file = open(file, 'r')
@@ -81,92 +102,120 @@ def crop(img, segimg, fx, fy, cx, cy):
     return c, cseg, fx, fy, cx, cy
 
 
-def run_all():
-    ct = 0
-
-
-# Create a segmentation mask generator
-mask_generator = MaskGenerator()
-
-if not OUTPUT_DIR.endswith('/'):
-    OUTPUT_DIR = OUTPUT_DIR + '/'
-
-for d in glob.glob(INPUT_DIR + '/*/'):
-    date = d.split('/')[-2]
-    file_calibration = d + 'calib_cam_to_cam.txt'
-    calib_raw = [get_line(file_calibration, 'P_rect_02'), get_line(file_calibration, 'P_rect_03')]
-
-    for d2 in glob.glob(d + '*/'):
-        seqname = d2.split('/')[-2]
-        print('Processing sequence', seqname)
-        for subfolder in ['image_02/data', 'image_03/data']:
-            ct = 1
-            seqname = d2.split('/')[-2] + subfolder.replace('image', '').replace('/data', '')
-            if not os.path.exists(OUTPUT_DIR + seqname):
-                os.mkdir(OUTPUT_DIR + seqname)
-
-            calib_camera = calib_raw[0] if subfolder == 'image_02/data' else calib_raw[1]
-            folder = d2 + subfolder
-            files = glob.glob(folder + '/*.png')
-            files = [file for file in files if not 'disp' in file and not 'flip' in file and not 'seg' in file]
-            files = sorted(files)
-            for i in range(SEQ_LENGTH, len(files) + 1, STEPSIZE):
-                imgnum = str(ct).zfill(10)
-                if os.path.exists(OUTPUT_DIR + seqname + '/' + imgnum + '.png'):
-                    ct += 1
-                    continue
-                big_img = np.zeros(shape=(HEIGHT, WIDTH * SEQ_LENGTH, 3))
-                wct = 0
-
-                # Define list of seg_mask images
-                seg_list = []
-
-                for j in range(i - SEQ_LENGTH, i):  # Collect frames for this sample.
-                    img = cv2.imread(files[j])
-                    ORIGINAL_HEIGHT, ORIGINAL_WIDTH, _ = img.shape
-
-                    zoom_x = WIDTH / ORIGINAL_WIDTH
-                    zoom_y = HEIGHT / ORIGINAL_HEIGHT
-
-                    # Adjust intrinsics.
-                    calib_current = calib_camera.copy()
-                    calib_current[0, 0] *= zoom_x
-                    calib_current[0, 2] *= zoom_x
-                    calib_current[1, 1] *= zoom_y
-                    calib_current[1, 2] *= zoom_y
-
-                    calib_representation = ','.join([str(c) for c in calib_current.flatten()])
-
-                    img = cv2.resize(img, (WIDTH, HEIGHT))
-                    big_img[:, wct * WIDTH:(wct + 1) * WIDTH] = img
-                    wct += 1
-
-                    # Generate seg_mask and add to list
-                    seg_list.append(mask_generator.generate_seg_img(img))
-                    # mask_generator.visualize()
-
-                # Align seg_masks
-                seg_list[0], seg_list[1], seg_list[2] = align(seg_list[0], seg_list[1], seg_list[2])
-                big_seg_img = np.zeros(shape=(HEIGHT, WIDTH * SEQ_LENGTH, 3))
-
-                # Create seg_mask triplet
-                for k in range(0, 3):
-                    big_seg_img[:, k * WIDTH:(k + 1) * WIDTH] = seg_list[k]
-
-                # Write triplet, seg_mask triplet, and camera intrinsics to files
-                cv2.imwrite(OUTPUT_DIR + seqname + '/' + imgnum + '.png', big_img)
-                cv2.imwrite(OUTPUT_DIR + seqname + '/' + imgnum + '-fseg.png', big_seg_img)
-                f = open(OUTPUT_DIR + seqname + '/' + imgnum + '_cam.txt', 'w')
-                f.write(calib_representation)
-                f.close()
-                ct += 1
-
-# Generate train txt file
-generate_train_txt()
+# Returns one job per sequence and camera: (seqname, sorted frame files, camera matrix).
+def list_sequences(input_dir):
+    jobs = []
+    for d in sorted(glob.glob(input_dir + '/*/')):
+        file_calibration = d + 'calib_cam_to_cam.txt'
+        calib_raw = [get_line(file_calibration, 'P_rect_02'), get_line(file_calibration, 'P_rect_03')]
+
+        for d2 in sorted(glob.glob(d + '*/')):
+            for subfolder in ['image_02/data', 'image_03/data']:
+                seqname = d2.split('/')[-2] + subfolder.replace('image', '').replace('/data', '')
+                calib_camera = calib_raw[0] if subfolder == 'image_02/data' else calib_raw[1]
+                files = glob.glob(d2 + subfolder + '/*.png')
+                files = [file for file in files if not 'disp' in file and not 'flip' in file and not 'seg' in file]
+                jobs.append((seqname, sorted(files), calib_camera))
+    return jobs
+
+
+def read_manifest(output_dir):
+    manifest = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest):
+        return set()
+    with open(manifest) as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+# Mask R-CNN of the current worker process
+mask_generator = None
+
+
+def init_worker(mask_batch_size, cpu_only, num_threads):
+    global mask_generator
+    mask_generator = MaskGenerator(batch_size=mask_batch_size, cpu_only=cpu_only, num_threads=num_threads)
+
+
+# Writes all triplets of one sequence. Every frame is decoded, resized, and segmented once, see
+# TripletBuilder. Seg masks are generated for mask_batch_size frames at a time.
+def process_sequence(job, output_dir, output_format='png'):
+    seqname, files, calib_camera = job
+    seq_dir = os.path.join(output_dir, seqname)
+    if not os.path.exists(seq_dir):
+        os.mkdir(seq_dir)
+    # Replaces the shards of an interrupted run of this sequence
+    shard_writer = ShardWriter(seq_dir) if output_format == 'shards' else None
+
+    builder = TripletBuilder(calib_camera, align_fn=align, seq_length=SEQ_LENGTH, stepsize=STEPSIZE,
+                             width=WIDTH, height=HEIGHT)
+    for start in range(0, len(files), mask_generator.batch_size):
+        imgs = [builder.load(file) for file in files[start:start + mask_generator.batch_size]]
+        seg_imgs = mask_generator.generate_seg_imgs(imgs)
+
+        for img, seg_img in zip(imgs, seg_imgs):
+            triplet = builder.add(img, seg_img)
+            if triplet is None:
+                continue
+            if shard_writer is not None:
+                shard_writer.write(triplet.image, triplet.seg_image, triplet.intrinsics, bgr=True)
+                continue
+            imgnum = str(triplet.index + 1).zfill(10)
+
+            # Write triplet, seg_mask triplet, and camera intrinsics to files
+            cv2.imwrite(os.path.join(seq_dir, imgnum + '.png'), triplet.image)
+            cv2.imwrite(os.path.join(seq_dir, imgnum + '-fseg.png'), triplet.seg_image)
+            with open(os.path.join(seq_dir, imgnum + '_cam.txt'), 'w') as f:
+                f.write(triplet.calib_representation)
+
+    if shard_writer is not None:
+        shard_writer.close()
+    return seqname, len(files), mask_generator.images_per_second()
+
+
+def _process_sequence(args):
+    return process_sequence(*args)
+
+
+# Generates all sequences not yet listed in the manifest, one sequence per worker at a time.
+def run_all(input_dir, output_dir, num_workers=1, mask_batch_size=SEQ_LENGTH, cpu_only=False,
+            output_format='png'):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    done = read_manifest(output_dir)
+    jobs = [job for job in list_sequences(input_dir) if job[0] not in done]
+    logging.info('%d sequences done, %d to go.', len(done), len(jobs))
+
+    # Split the cores between the Mask R-CNN instances when running on the CPU
+    num_threads = max(multiprocessing.cpu_count() // num_workers, 1) if cpu_only else None
+
+    # Spawned workers start with a clean TensorFlow state
+    pool = multiprocessing.get_context('spawn').Pool(num_workers, initializer=init_worker,
+                                                     initargs=(mask_batch_size, cpu_only, num_threads))
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'a') as manifest:
+            results = pool.imap_unordered(_process_sequence, [(job, output_dir, output_format) for job in jobs])
+            for seqname, num_frames, images_per_second in results:
+                manifest.write(seqname + '\n')
+                manifest.flush()
+                logging.info('Processed sequence %s, %d frames, seg masks at %.2f images/sec.',
+                             seqname, num_frames, images_per_second)
+    except BaseException:
+        # Stop the workers instead of waiting for the queued sequences
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    # Generate train txt file. Shards are listed by their index files.
+    if output_format == 'png':
+        generate_train_txt()
 
 
 def main(_):
-    run_all()
+    run_all(FLAGS.input_dir, FLAGS.output_dir, FLAGS.num_workers, FLAGS.mask_batch_size, FLAGS.cpu_only,
+            FLAGS.output_format)
 
 
 if __name__ == '__main__':
@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import numpy as np
 import tensorflow as tf
 
@@ -21,11 +22,30 @@ COCO_MODEL_PATH = "/usr/local/lib/isaac/apps/carter_sim_struct2depth/struct2dept
 IMAGE_DIR = os.path.join(ROOT_DIR, "images")
 
 
+# Composes an instance ID image from Mask R-CNN masks of shape [H, W, N], sorted by descending score.
+# Each pixel gets the ID (index + 1) of the highest scoring instance covering it; background is 0.
+# All channels hold the same ID.
+def compose_seg_img(masks, shape):
+    seg_img = np.zeros(shape=shape[:2], dtype=np.uint8)
+    if masks.shape[2] > 0:
+        covered = masks.any(axis=2)
+        seg_img[covered] = np.argmax(masks, axis=2)[covered] + 1
+    return np.repeat(seg_img[:, :, None], shape[2], axis=2)
+
+
 class MaskGenerator:
-    def __init__(self):
+    # batch_size: number of images per Mask R-CNN forward pass.
+    # cpu_only: hide GPUs, e.g. to run one generator per core group in offline data generation.
+    # num_threads: TensorFlow intra and inter op threads, None for the default.
+    def __init__(self, batch_size=1, cpu_only=False, num_threads=None):
         # Fix GPU memory issue
         config = tf.ConfigProto()
         config.gpu_options.allow_growth = True
+        if cpu_only:
+            config.device_count['GPU'] = 0
+        if num_threads is not None:
+            config.intra_op_parallelism_threads = num_threads
+            config.inter_op_parallelism_threads = num_threads
         session = tf.InteractiveSession(config=config)
         # self.graph = tf.Graph()
 
@@ -34,10 +54,9 @@ class MaskGenerator:
             utils.download_trained_weights(COCO_MODEL_PATH)
 
         class InferenceConfig(coco.CocoConfig):
-            # Set batch size to 1 since we'll be running inference on
-            # one image at a time. Batch size = GPU_COUNT * IMAGES_PER_GPU
+            # Run inference on batch_size images at a time. Batch size = GPU_COUNT * IMAGES_PER_GPU
             GPU_COUNT = 1
-            IMAGES_PER_GPU = 1
+            IMAGES_PER_GPU = batch_size
 
         self.config = InferenceConfig()
         self.config.display()
@@ -69,10 +88,15 @@ class MaskGenerator:
                             'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors',
                             'teddy bear', 'hair drier', 'toothbrush']
 
+        self.batch_size = batch_size
         self.image = None
         self.results = None
         self.color_code_scale = 15
 
+        # Throughput statistics
+        self.images_processed = 0
+        self.seconds = 0.0
+
     # # Load a random image from the images folder
     # file_names = next(os.walk(IMAGE_DIR))[2]
     # image = skimage.io.imread(os.path.join(IMAGE_DIR, random.choice(file_names)))
@@ -80,34 +104,46 @@ class MaskGenerator:
     # Run detection
     def detect(self, image):
         self.image = image
-        # with self.graph.as_default():
-        self.results = self.model.detect([image], verbose=1)
-        self.results = self.results[0]
+        self.results = self.detect_batch([image])[0]
         return self.results
 
+    # Runs detection on a list of images, batch_size images per forward pass. The last batch is padded
+    # with copies of its last image, since Mask R-CNN expects full batches.
+    def detect_batch(self, images):
+        results = []
+        for start in range(0, len(images), self.batch_size):
+            batch = list(images[start:start + self.batch_size])
+            num_images = len(batch)
+            batch += [batch[-1]] * (self.batch_size - num_images)
+            # with self.graph.as_default():
+            results += self.model.detect(batch, verbose=0)[:num_images]
+        return results
+
     # Generate a segmented image
     # Each instance has a different color ID; background is 0
     # Three channels all with same color code
     def generate_seg_img(self, image):
-        self.results = self.detect(image)
-
-        # Generate instance masks with all channel values equal to the instance ID
-        masks = self.results['masks']
-        class_ids = self.results['class_ids']
-        seg_img = np.zeros(shape=image.shape, dtype=np.uint8)
+        return self.generate_seg_imgs([image])[0]
 
-        # seg_img = np.copy(masks[:, :, 0]) * 0
+    # Generates segmented images for a list of images, see generate_seg_img.
+    def generate_seg_imgs(self, images):
+        start = time.time()
+        results = self.detect_batch(images)
+        seg_imgs = [compose_seg_img(r['masks'], image.shape) for r, image in zip(results, images)]
 
-        for i in range(0, masks.shape[2]):
-            mask = masks[:, :, i]
-            class_id = class_ids[i]
-            for j in range(0, seg_img.shape[2]):
-                seg_img[:, :, j] += np.uint8(mask * class_id)
+        self.image = images[-1]
+        self.results = results[-1]
+        self.images_processed += len(images)
+        self.seconds += time.time() - start
 
         # Visualize seg img
         # imgplot = plt.imshow(seg_img)
 
-        return seg_img
+        return seg_imgs
+
+    # Average throughput of generate_seg_imgs so far.
+    def images_per_second(self):
+        return self.images_processed / self.seconds if self.seconds > 0 else 0.0
 
     def visualize(self):
         if self.results is not None:
@@ -0,0 +1,105 @@
+""" Streaming triplet builder shared by the offline data generators."""
+
+import collections
+import numpy as np
+import cv2
+
+SEQ_LENGTH = 3
+WIDTH = 416
+HEIGHT = 128
+STEPSIZE = 1
+
+# index counts the triplets of the sequence from 0. image and seg_image are [HEIGHT, WIDTH * SEQ_LENGTH, 3]
+# uint8 images in the BGR channel order of cv2, intrinsics the float32 camera matrix scaled to the network
+# size and calib_representation the same matrix comma separated.
+Triplet = collections.namedtuple('Triplet', ['index', 'image', 'seg_image', 'intrinsics',
+                                             'calib_representation'])
+
+
+class TripletBuilder(object):
+    """Builds the overlapping triplets of one sequence from a stream of frames.
+
+    Every frame is decoded and resized once into a ring of seq_length slots, and the scaled camera matrix is
+    computed once per source resolution. The returned image arrays are reused for the next triplet, so
+    callers must write or copy a triplet before adding more frames.
+    """
+
+    def __init__(self, camera_mat, align_fn=None, seq_length=SEQ_LENGTH, stepsize=STEPSIZE,
+                 width=WIDTH, height=HEIGHT):
+        self.camera_mat = camera_mat
+        self.align_fn = align_fn
+        self.seq_length = seq_length
+        self.stepsize = stepsize
+        self.width = width
+        self.height = height
+        self.frames = np.zeros(shape=(seq_length, height, width, 3), dtype=np.uint8)
+        self.seg_frames = [None] * seq_length
+        self.image = np.zeros(shape=(height, width * seq_length, 3), dtype=np.uint8)
+        self.seg_image = np.zeros(shape=(height, width * seq_length, 3), dtype=np.uint8)
+        self.calib_representations = {}  # Source (height, width) -> (scaled camera matrix, representation)
+        self.intrinsics = None
+        self.calib_representation = None
+        self.num_frames = 0
+
+    # Returns the scaled camera matrix and its comma separated representation for frames of the given
+    # source size.
+    def get_calib_representation(self, original_height, original_width):
+        key = (original_height, original_width)
+        if key not in self.calib_representations:
+            zoom_x = self.width / original_width
+            zoom_y = self.height / original_height
+
+            # Adjust intrinsics.
+            calib_current = self.camera_mat.copy()
+            calib_current[0, 0] *= zoom_x
+            calib_current[0, 2] *= zoom_x
+            calib_current[1, 1] *= zoom_y
+            calib_current[1, 2] *= zoom_y
+
+            self.calib_representations[key] = (calib_current.astype(np.float32),
+                                               ','.join([str(c) for c in calib_current.flatten()]))
+        return self.calib_representations[key]
+
+    # Decodes and resizes a frame. Sets the camera matrix of the next triplet.
+    def load(self, file):
+        img = cv2.imread(file)
+        self.intrinsics, self.calib_representation = self.get_calib_representation(img.shape[0], img.shape[1])
+        if img.shape[:2] != (self.height, self.width):
+            img = cv2.resize(img, (self.width, self.height))
+        return img
+
+    # Adds the next frame of the sequence, and optionally its seg mask. Returns a Triplet once the last
+    # seq_length frames form one, otherwise None. Seg masks are aligned with align_fn if given.
+    def add(self, img, seg_img=None):
+        slot = self.num_frames % self.seq_length
+        self.frames[slot] = img
+        self.seg_frames[slot] = seg_img
+        self.num_frames += 1
+
+        start = self.num_frames - self.seq_length
+        if start < 0 or start % self.stepsize != 0:
+            return None
+
+        # Oldest frame first
+        order = [(start + k) % self.seq_length for k in range(self.seq_length)]
+        for k, slot in enumerate(order):
+            self.image[:, k * self.width:(k + 1) * self.width] = self.frames[slot]
+
+        seg_list = [self.seg_frames[slot] for slot in order]
+        if any(seg is None for seg in seg_list):
+            self.seg_image[...] = 0
+        else:
+            if self.align_fn is not None:
+                seg_list = self.align_fn(*seg_list)
+            for k, seg in enumerate(seg_list):
+                self.seg_image[:, k * self.width:(k + 1) * self.width] = seg
+
+        return Triplet(start // self.stepsize, self.image, self.seg_image, self.intrinsics,
+                       self.calib_representation)
+
+    # Yields the triplets of a sorted list of frame files, reading each file once.
+    def build(self, files):
+        for file in files:
+            triplet = self.add(self.load(file))
+            if triplet is not None:
+                yield triplet
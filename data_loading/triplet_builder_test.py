@@ -0,0 +1,84 @@
+""" Tests for the streaming triplet builder."""
+
+import os
+import shutil
+import tempfile
+
+from absl.testing import absltest
+import numpy as np
+import cv2
+
+from data_loading.triplet_builder import TripletBuilder
+
+WIDTH = 8
+HEIGHT = 4
+CAMERA_MAT = np.array([[16., 0., 8.], [0., 16., 4.], [0., 0., 1.]])
+
+
+# Frame k is filled with the value k, so the frames of a triplet can be told apart
+def frame(k):
+    return np.full((HEIGHT, WIDTH, 3), k, dtype=np.uint8)
+
+
+class TripletBuilderTest(absltest.TestCase):
+
+    def test_triplets_overlap(self):
+        builder = TripletBuilder(CAMERA_MAT, width=WIDTH, height=HEIGHT)
+        triplets = []
+        for k in range(5):
+            triplet = builder.add(frame(k))
+            if triplet is not None:
+                triplets.append((triplet.index, triplet.image[0, ::WIDTH, 0].tolist()))
+        self.assertEqual(triplets, [(0, [0, 1, 2]), (1, [1, 2, 3]), (2, [2, 3, 4])])
+
+    def test_stepsize(self):
+        builder = TripletBuilder(CAMERA_MAT, stepsize=2, width=WIDTH, height=HEIGHT)
+        triplets = []
+        for k in range(7):
+            triplet = builder.add(frame(k))
+            if triplet is not None:
+                triplets.append((triplet.index, triplet.image[0, ::WIDTH, 0].tolist()))
+        self.assertEqual(triplets, [(0, [0, 1, 2]), (1, [2, 3, 4]), (2, [4, 5, 6])])
+
+    def test_seg_masks_are_aligned(self):
+        calls = []
+
+        def align_fn(*seg_list):
+            calls.append([seg[0, 0, 0] for seg in seg_list])
+            return [seg + 10 for seg in seg_list]
+
+        builder = TripletBuilder(CAMERA_MAT, align_fn=align_fn, width=WIDTH, height=HEIGHT)
+        for k in range(3):
+            triplet = builder.add(frame(k), frame(k))
+        self.assertEqual(calls, [[0, 1, 2]])
+        self.assertEqual(triplet.seg_image[0, ::WIDTH, 0].tolist(), [10, 11, 12])
+
+    def test_missing_seg_masks_are_zero(self):
+        builder = TripletBuilder(CAMERA_MAT, width=WIDTH, height=HEIGHT)
+        builder.add(frame(1), frame(1))
+        builder.add(frame(2), frame(2))
+        triplet = builder.add(frame(3))
+        self.assertFalse(triplet.seg_image.any())
+
+    def test_build_scales_intrinsics(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        files = []
+        for k in range(3):
+            files.append(os.path.join(data_dir, '{}.png'.format(k)))
+            cv2.imwrite(files[-1], np.full((2 * HEIGHT, 4 * WIDTH, 3), k, dtype=np.uint8))
+
+        builder = TripletBuilder(CAMERA_MAT, width=WIDTH, height=HEIGHT)
+        triplets = list(builder.build(files))
+        self.assertLen(triplets, 1)
+        self.assertEqual(triplets[0].image.shape, (HEIGHT, 3 * WIDTH, 3))
+        self.assertEqual(triplets[0].image[0, ::WIDTH, 0].tolist(), [0, 1, 2])
+        expected = np.array([[4., 0., 2.], [0., 8., 2.], [0., 0., 1.]])
+        np.testing.assert_allclose(triplets[0].intrinsics, expected)
+        self.assertEqual(triplets[0].intrinsics.dtype, np.float32)
+        np.testing.assert_allclose(np.array(triplets[0].calib_representation.split(','), dtype=float),
+                                   expected.ravel())
+
+
+if __name__ == '__main__':
+    absltest.main()
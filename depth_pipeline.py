@@ -0,0 +1,226 @@
+from __future__ import absolute_import, division, print_function
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+from absl import logging
+
+''' Staged pipeline for live depth inference. The Isaac tick thread only ingests frames into a bounded queue,
+    a dedicated worker runs the network, and a writer thread handles visualization and files on disk. '''
+
+# Policies applied when a bounded queue is full
+DROP_OLDEST = 'drop_oldest'  # Evict the oldest queued item so the newest frame is always processed
+DROP_NEWEST = 'drop_newest'  # Reject the incoming item
+BLOCK = 'block'  # Block the producer until there is space
+QUEUE_POLICIES = [DROP_OLDEST, DROP_NEWEST, BLOCK]
+
+
+# A camera frame handed from the tick thread to the inference worker
+class Frame(object):
+    def __init__(self, index, image, focal, center, timestamp=None, pool=None, camera=0):
+        self.index = index
+        self.camera = camera  # Index of the camera channel the frame arrived on
+        self.image = image
+        self.focal = focal
+        self.center = center
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.pool = pool
+        self.preview = None  # Optional network-size copy of the image for visualization
+        self.egomotion = None  # Optional egomotion over the window ending at this frame
+
+    # Hands the image array back to the pool it came from. The frame must not use it afterwards.
+    def release(self):
+        if self.pool is not None and self.image is not None:
+            self.pool.release(self.image)
+        self.image = None
+
+
+# Fixed set of preallocated uint8 frame arrays that are reused across ticks, so ingesting a frame
+# is a single copy into an existing array. Arrays are only allocated for the first frame, when the
+# camera resolution changes, or if every array is still in flight.
+class FramePool(object):
+    def __init__(self, size):
+        self.size = size
+        self.shape = None
+        self.free = []
+        self.allocations = 0  # Total number of frame arrays allocated
+        # The tick thread acquires and the worker releases, the lock keeps the shape and free list in step
+        self.lock = threading.Lock()
+
+    def acquire(self, shape):
+        with self.lock:
+            if shape != self.shape:
+                self.shape = shape
+                self.free = [np.empty(shape, dtype=np.uint8) for _ in range(self.size)]
+                self.allocations += self.size
+            if self.free:
+                return self.free.pop()
+            self.allocations += 1
+        return np.empty(shape, dtype=np.uint8)
+
+    def release(self, array):
+        with self.lock:
+            if array.shape == self.shape and len(self.free) < self.size:
+                self.free.append(array)
+
+
+# Network output for one frame
+class DepthResult(object):
+    def __init__(self, frame, depth):
+        self.frame = frame
+        self.depth = depth
+
+
+# Bounded FIFO queue with a configurable policy for when it is full.
+class FrameQueue(object):
+    def __init__(self, maxsize, policy=DROP_OLDEST):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError('Unknown queue policy: {}'.format(policy))
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    # Adds an item. Returns the list of items that were dropped to make room, so the caller can
+    # release them. Under DROP_OLDEST a producer racing the consumer may evict several items.
+    def put(self, item):
+        if self.policy == BLOCK:
+            self.queue.put(item)
+            return []
+        dropped = []
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return dropped
+            except queue.Full:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return [item]
+            try:
+                dropped.append(self.queue.get_nowait())
+                self.dropped += 1
+            except queue.Empty:
+                pass  # Consumer drained the queue in between, retry
+
+    # Returns the next item, or None if nothing arrived within timeout seconds.
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def qsize(self):
+        return self.queue.qsize()
+
+
+# Background thread that runs the network on queued frames and keeps the freshest result per
+# camera for the tick thread to publish. Frames are collected into micro-batches of up to
+# batch_size frames, at most one per camera: after the first frame of a batch arrives the worker
+# waits at most batch_window seconds for the other cameras. infer_fn takes a list of frames and
+# returns one depth map per frame. Finished results are handed to every output sink.
+class InferenceWorker(threading.Thread):
+    def __init__(self, frames, infer_fn, sinks=(), poll_timeout=0.1, batch_size=1,
+                 batch_window=0.0):
+        super(InferenceWorker, self).__init__(name='depth_inference_worker')
+        self.daemon = True
+        self.frames = frames
+        self.infer_fn = infer_fn
+        self.sinks = sinks
+        self.poll_timeout = poll_timeout
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.pending = None  # Frame that could not join the previous batch
+        self.batch_sizes = collections.Counter()  # Number of batches run per batch size
+        self.latest = {}
+        self.latest_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    # Collects the next batch of frames, or returns an empty list if nothing arrived.
+    def next_batch(self):
+        first = self.pending
+        self.pending = None
+        if first is None:
+            first = self.frames.get(timeout=self.poll_timeout)
+            if first is None:
+                return []
+        batch = {first.camera: first}
+        deadline = time.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            frame = self.frames.get(timeout=remaining)
+            if frame is None:
+                break
+            if frame.camera in batch:
+                # A second frame from the same camera closes the batch and starts the next one
+                self.pending = frame
+                break
+            batch[frame.camera] = frame
+        return sorted(batch.values(), key=lambda f: f.camera)
+
+    def run(self):
+        while not self.stopped.is_set():
+            batch = self.next_batch()
+            if not batch:
+                continue
+            try:
+                results = [DepthResult(frame, depth) for frame, depth in zip(batch, self.infer_fn(batch))]
+            except Exception:
+                logging.exception('Depth inference failed for frames %s', [frame.index for frame in batch])
+                continue
+            finally:
+                for frame in batch:
+                    frame.release()
+            self.batch_sizes[len(batch)] += 1
+            with self.latest_lock:
+                for result in results:
+                    # Results can only move forward in time, even if frames finish out of order
+                    latest = self.latest.get(result.frame.camera)
+                    if latest is None or latest.frame.index < result.frame.index:
+                        self.latest[result.frame.camera] = result
+            for sink in self.sinks:
+                for result in results:
+                    sink.put(result)
+        if self.pending is not None:
+            self.pending.release()
+            self.pending = None
+
+    # Returns the newest result of every camera and clears them. The list is empty if nothing new
+    # finished since the last call.
+    def take_latest(self):
+        with self.latest_lock:
+            results = [self.latest[camera] for camera in sorted(self.latest)]
+            self.latest = {}
+        return results
+
+    def stop(self):
+        self.stopped.set()
+
+
+# Background thread that consumes depth results, e.g. to save visualizations to disk, without
+# holding up inference.
+class OutputWriter(threading.Thread):
+    def __init__(self, results, write_fn, poll_timeout=0.1):
+        super(OutputWriter, self).__init__(name='depth_output_writer')
+        self.daemon = True
+        self.results = results
+        self.write_fn = write_fn
+        self.poll_timeout = poll_timeout
+        self.stopped = threading.Event()
+
+    def run(self):
+        while True:
+            result = self.results.get(timeout=self.poll_timeout)
+            if result is None:
+                if self.stopped.is_set():
+                    break  # Backlog drained
+                continue
+            try:
+                self.write_fn(result)
+            except Exception:
+                logging.exception('Writing depth output failed for frame %d', result.frame.index)
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,144 @@
+from __future__ import absolute_import, division, print_function
+
+from absl.testing import absltest
+import numpy as np
+
+import depth_pipeline
+
+''' Tests for the queues, frame pool and micro-batching of the live depth pipeline. '''
+
+
+def make_frame(index, camera=0, pool=None):
+    image = np.zeros((2, 2, 3), dtype=np.uint8) if pool is None else pool.acquire((2, 2, 3))
+    return depth_pipeline.Frame(index, image, focal=(1., 1.), center=(1., 1.), pool=pool, camera=camera)
+
+
+# Queue that never waits, so tests of the worker do not depend on timing. Calls on_empty once drained.
+class ListQueue(object):
+    def __init__(self, items):
+        self.items = list(items)
+        self.on_empty = None
+
+    def get(self, timeout=None):
+        if self.items:
+            return self.items.pop(0)
+        if self.on_empty is not None:
+            self.on_empty()
+        return None
+
+
+class FrameQueueTest(absltest.TestCase):
+
+    def drain(self, frames):
+        items = []
+        while frames.qsize():
+            items.append(frames.get())
+        return items
+
+    def test_drop_oldest(self):
+        frames = depth_pipeline.FrameQueue(2, depth_pipeline.DROP_OLDEST)
+        self.assertEqual(frames.put(1), [])
+        self.assertEqual(frames.put(2), [])
+        self.assertEqual(frames.put(3), [1])
+        self.assertEqual(frames.dropped, 1)
+        self.assertEqual(self.drain(frames), [2, 3])
+
+    def test_drop_newest(self):
+        frames = depth_pipeline.FrameQueue(2, depth_pipeline.DROP_NEWEST)
+        frames.put(1)
+        frames.put(2)
+        self.assertEqual(frames.put(3), [3])
+        self.assertEqual(frames.dropped, 1)
+        self.assertEqual(self.drain(frames), [1, 2])
+
+    def test_block(self):
+        frames = depth_pipeline.FrameQueue(2, depth_pipeline.BLOCK)
+        self.assertEqual(frames.put(1), [])
+        self.assertEqual(frames.put(2), [])
+        self.assertEqual(frames.dropped, 0)
+        self.assertEqual(self.drain(frames), [1, 2])
+
+    def test_get_times_out(self):
+        self.assertIsNone(depth_pipeline.FrameQueue(2).get(timeout=0.01))
+
+    def test_unknown_policy_raises(self):
+        with self.assertRaises(ValueError):
+            depth_pipeline.FrameQueue(2, 'drop_random')
+
+
+class FramePoolTest(absltest.TestCase):
+
+    def test_arrays_are_reused(self):
+        pool = depth_pipeline.FramePool(2)
+        first = pool.acquire((2, 2, 3))
+        pool.release(first)
+        self.assertIs(pool.acquire((2, 2, 3)), first)
+        self.assertEqual(pool.allocations, 2)
+
+    def test_allocates_when_exhausted(self):
+        pool = depth_pipeline.FramePool(1)
+        pool.acquire((2, 2, 3))
+        pool.acquire((2, 2, 3))
+        self.assertEqual(pool.allocations, 2)
+
+    def test_shape_change_drops_old_arrays(self):
+        pool = depth_pipeline.FramePool(2)
+        old = pool.acquire((2, 2, 3))
+        new = pool.acquire((4, 4, 3))
+        self.assertEqual(new.shape, (4, 4, 3))
+        pool.release(old)
+        self.assertLen(pool.free, 1)
+        self.assertTrue(all(array.shape == (4, 4, 3) for array in pool.free))
+
+    def test_frame_release_returns_array(self):
+        pool = depth_pipeline.FramePool(1)
+        frame = make_frame(0, pool=pool)
+        self.assertEmpty(pool.free)
+        frame.release()
+        self.assertIsNone(frame.image)
+        self.assertLen(pool.free, 1)
+
+
+class InferenceWorkerTest(absltest.TestCase):
+
+    def next_batches(self, frames, batch_size):
+        worker = depth_pipeline.InferenceWorker(ListQueue(frames), infer_fn=None, batch_size=batch_size,
+                                                batch_window=1.0)
+        batches = []
+        while True:
+            batch = worker.next_batch()
+            if not batch:
+                return batches
+            batches.append([(frame.index, frame.camera) for frame in batch])
+
+    def test_single_frames(self):
+        frames = [make_frame(i) for i in range(3)]
+        self.assertEqual(self.next_batches(frames, 1), [[(0, 0)], [(1, 0)], [(2, 0)]])
+
+    def test_one_frame_per_camera(self):
+        frames = [make_frame(0, 1), make_frame(1, 0), make_frame(2, 2), make_frame(3, 0)]
+        self.assertEqual(self.next_batches(frames, 3), [[(1, 0), (0, 1), (2, 2)], [(3, 0)]])
+
+    def test_repeated_camera_starts_next_batch(self):
+        frames = [make_frame(0, 0), make_frame(1, 0), make_frame(2, 1)]
+        self.assertEqual(self.next_batches(frames, 2), [[(0, 0)], [(1, 0), (2, 1)]])
+
+    def test_batch_size_limits_batch(self):
+        frames = [make_frame(i, i) for i in range(3)]
+        self.assertEqual(self.next_batches(frames, 2), [[(0, 0), (1, 1)], [(2, 2)]])
+
+    def test_run_keeps_newest_result_per_camera(self):
+        frames = ListQueue([make_frame(2, 0), make_frame(1, 0), make_frame(3, 1)])
+        sink = depth_pipeline.FrameQueue(8)
+        worker = depth_pipeline.InferenceWorker(frames, lambda batch: [frame.index for frame in batch],
+                                                sinks=[sink])
+        frames.on_empty = worker.stop
+        worker.run()
+        self.assertEqual([(result.frame.index, result.depth) for result in worker.take_latest()],
+                         [(2, 2), (3, 3)])
+        self.assertEqual(worker.take_latest(), [])
+        self.assertEqual(sink.qsize(), 3)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,209 @@
+from __future__ import absolute_import, division, print_function
+import abc
+import collections
+import os
+import struct
+import threading
+
+import numpy as np
+from absl import logging
+import tensorflow as tf
+from struct2depth import util
+import depth_pipeline
+
+gfile = tf.gfile
+
+''' Output sinks for live depth predictions. Every sink owns a bounded backlog and its own writer thread,
+    so a slow sink only drops its own outputs and never holds up inference or the other sinks. '''
+
+SINK_NONE = 'none'  # Discard all predictions
+SINK_EVERY_NTH = 'every_nth'  # .npy prediction and color visualization for every Nth frame
+SINK_RING = 'ring'  # Rolling in-memory buffer of the latest predictions
+SINK_LOG = 'log'  # Append-only chunked binary log with an index
+SINKS = [SINK_NONE, SINK_EVERY_NTH, SINK_RING, SINK_LOG]
+
+
+# Base class of all sinks. Subclasses implement write(), which runs in the sink's writer thread.
+class DepthSink(abc.ABC):
+    needs_preview = False  # Whether write() uses the network-size preview image of the frame
+
+    def __init__(self, name, backlog=8, policy=depth_pipeline.DROP_OLDEST):
+        self.name = name
+        self.results = depth_pipeline.FrameQueue(backlog, policy)
+        self.writer = depth_pipeline.OutputWriter(self.results, self.write_timed)
+        self.writer.name = 'depth_sink_' + name
+        self.latency = util.LatencyHistogram('sink_' + name)
+
+    # Whether the sink wants the result of this frame at all. Called before inference, so frames
+    # that are skipped cost nothing.
+    def accepts(self, frame):
+        return True
+
+    def start(self):
+        self.writer.start()
+
+    # Queues a result for the writer thread. Never blocks unless the sink uses the BLOCK policy.
+    def put(self, result):
+        if self.accepts(result.frame):
+            self.results.put(result)
+
+    def write_timed(self, result):
+        with self.latency.measure():
+            self.write(result)
+
+    @abc.abstractmethod
+    def write(self, result):
+        pass
+
+    # Stops the writer thread after the backlog has been written
+    def stop(self):
+        self.writer.stop()
+        self.writer.join()
+        self.close()
+
+    def close(self):
+        pass
+
+    @property
+    def dropped(self):
+        return self.results.dropped
+
+
+# Sink that discards everything, without a thread
+class NullSink(DepthSink):
+    def __init__(self):
+        super(NullSink, self).__init__(SINK_NONE)
+
+    def accepts(self, frame):
+        return False
+
+    def write(self, result):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+# Saves the raw prediction as .npy and a colormapped visualization for every Nth frame
+class EveryNthSink(DepthSink):
+    needs_preview = True
+
+    def __init__(self, output_dir, every_n=1, file_ext='png', prefix='image', camera_names=None, **kwargs):
+        super(EveryNthSink, self).__init__(SINK_EVERY_NTH, **kwargs)
+        self.output_dir = output_dir
+        self.every_n = every_n
+        self.file_ext = file_ext
+        self.prefix = prefix
+        self.camera_names = camera_names  # Appended to the file names when there are several cameras
+        self.counts = collections.Counter()  # Frames offered per camera
+        self.decisions = {}  # Camera -> (frame index, accepted) of its latest frame
+        if not gfile.Exists(output_dir):
+            gfile.MakeDirs(output_dir)
+        logging.info('Every %d-th prediction will be saved in %s.', every_n, output_dir)
+
+    # Keeps every Nth frame of each camera. Frame indices count the frames of all cameras, so they
+    # are not used for this. accepts() may be asked about the same frame more than once.
+    def accepts(self, frame):
+        decision = self.decisions.get(frame.camera)
+        if decision is not None and decision[0] == frame.index:
+            return decision[1]
+        accepted = self.counts[frame.camera] % self.every_n == 0
+        self.counts[frame.camera] += 1
+        self.decisions[frame.camera] = (frame.index, accepted)
+        return accepted
+
+    def write(self, result):
+        image = result.frame.preview / 255.
+
+        # Create color map for visualization
+        color_map = util.normalize_depth_for_display(np.squeeze(result.depth))
+        visualization = np.concatenate((image, color_map), axis=0)
+
+        pref = self.prefix
+        if self.camera_names is not None and len(self.camera_names) > 1:
+            pref += '_' + self.camera_names[result.frame.camera]
+        output_raw = os.path.join(self.output_dir, pref + '{}'.format(result.frame.index) + '.npy')
+        output_vis = os.path.join(self.output_dir, pref + '{}'.format(result.frame.index) + '.' + self.file_ext)
+
+        with gfile.Open(output_raw, 'wb') as f:
+            np.save(f, result.depth)
+        util.save_image(output_vis, visualization, self.file_ext)
+
+
+# Keeps the latest predictions in memory, e.g. for debugging or for other codelets to look at
+class RingBufferSink(DepthSink):
+    def __init__(self, size=100, **kwargs):
+        super(RingBufferSink, self).__init__(SINK_RING, **kwargs)
+        self.ring = collections.deque(maxlen=size)
+        self.ring_lock = threading.Lock()
+
+    def write(self, result):
+        # Only keep the depth and frame metadata; the frame image is recycled by the pipeline
+        entry = (result.frame.index, result.frame.camera, result.frame.timestamp, result.depth)
+        with self.ring_lock:
+            self.ring.append(entry)
+
+    # Returns the buffered predictions as a list of (index, camera, timestamp, depth), oldest first
+    def snapshot(self):
+        with self.ring_lock:
+            return list(self.ring)
+
+
+# Appends raw float32 depth maps to chunk files of at most chunk_bytes each. A text index with one
+# line per frame, "index camera timestamp chunk offset rows cols", allows random access without
+# scanning the chunks. Use read_log_entry() to load a frame back.
+class ChunkedLogSink(DepthSink):
+    INDEX_FILE = 'index.txt'
+    CHUNK_FILE = 'chunk_{:05d}.bin'
+    HEADER = struct.Struct('<qqdii')  # index, camera, timestamp, rows, cols
+
+    def __init__(self, log_dir, chunk_bytes=256 * 1024 * 1024, **kwargs):
+        super(ChunkedLogSink, self).__init__(SINK_LOG, **kwargs)
+        self.log_dir = log_dir
+        self.chunk_bytes = chunk_bytes
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        # Continue after the chunks of a previous run instead of overwriting them
+        self.chunk = len([name for name in os.listdir(log_dir) if name.endswith('.bin')])
+        self.chunk_file = None
+        self.index_file = open(os.path.join(log_dir, self.INDEX_FILE), 'a')
+        logging.info('Predictions will be logged to %s.', log_dir)
+
+    def next_chunk(self):
+        if self.chunk_file is not None:
+            self.chunk_file.close()
+        self.chunk_file = open(os.path.join(self.log_dir, self.CHUNK_FILE.format(self.chunk)), 'ab')
+        self.chunk += 1
+
+    def write(self, result):
+        depth = np.ascontiguousarray(result.depth, dtype=np.float32).reshape(result.depth.shape[1:3])
+        record_bytes = self.HEADER.size + depth.nbytes
+        if self.chunk_file is None or self.chunk_file.tell() + record_bytes > self.chunk_bytes:
+            self.next_chunk()
+        offset = self.chunk_file.tell()
+        rows, cols = depth.shape
+        self.chunk_file.write(self.HEADER.pack(result.frame.index, result.frame.camera,
+                                               result.frame.timestamp, rows, cols))
+        self.chunk_file.write(memoryview(depth).cast('B'))
+        self.chunk_file.flush()
+        self.index_file.write('{} {} {} {} {} {} {}\n'.format(result.frame.index, result.frame.camera,
+                                                             result.frame.timestamp, self.chunk - 1,
+                                                             offset, rows, cols))
+        self.index_file.flush()
+
+    def close(self):
+        if self.chunk_file is not None:
+            self.chunk_file.close()
+        self.index_file.close()
+
+
+# Reads one frame written by ChunkedLogSink. Returns (index, camera, timestamp, depth).
+def read_log_entry(log_dir, chunk, offset):
+    with open(os.path.join(log_dir, ChunkedLogSink.CHUNK_FILE.format(chunk)), 'rb') as f:
+        f.seek(offset)
+        index, camera, timestamp, rows, cols = ChunkedLogSink.HEADER.unpack(f.read(ChunkedLogSink.HEADER.size))
+        depth = np.frombuffer(f.read(rows * cols * 4), dtype=np.float32).reshape(rows, cols)
+    return index, camera, timestamp, depth
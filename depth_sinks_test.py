@@ -0,0 +1,94 @@
+from __future__ import absolute_import, division, print_function
+import os
+import shutil
+import tempfile
+
+from absl.testing import absltest
+import numpy as np
+
+import depth_pipeline
+import depth_sinks
+
+''' Tests for the frame selection of EveryNthSink and the on-disk format of ChunkedLogSink. '''
+
+
+def make_result(index, camera=0, rows=2, cols=3):
+    frame = depth_pipeline.Frame(index, None, focal=(1., 1.), center=(1., 1.), timestamp=index / 10.,
+                                 camera=camera)
+    depth = np.arange(rows * cols, dtype=np.float32).reshape(1, rows, cols, 1) + index
+    return depth_pipeline.DepthResult(frame, depth)
+
+
+class DepthSinksTest(absltest.TestCase):
+
+    def setUp(self):
+        super(DepthSinksTest, self).setUp()
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def test_every_nth_counts_frames_per_camera(self):
+        sink = depth_sinks.EveryNthSink(self.output_dir, every_n=2)
+        # Frame indices count the frames of both cameras
+        accepted = [sink.accepts(make_result(index, index % 2).frame) for index in range(8)]
+        self.assertEqual(accepted, [True, True, False, False, True, True, False, False])
+
+    def test_every_nth_repeated_question_has_same_answer(self):
+        sink = depth_sinks.EveryNthSink(self.output_dir, every_n=3)
+        frame = make_result(0).frame
+        self.assertTrue(sink.accepts(frame))
+        self.assertTrue(sink.accepts(frame))
+        self.assertFalse(sink.accepts(make_result(1).frame))
+        self.assertFalse(sink.accepts(make_result(2).frame))
+        self.assertTrue(sink.accepts(make_result(3).frame))
+
+    def test_null_sink_accepts_nothing(self):
+        self.assertFalse(depth_sinks.NullSink().accepts(make_result(0).frame))
+
+    # Returns the rows of the index as (index, camera, timestamp, chunk, offset, rows, cols)
+    def read_index(self):
+        with open(os.path.join(self.output_dir, depth_sinks.ChunkedLogSink.INDEX_FILE)) as f:
+            return [line.split() for line in f]
+
+    def assertLogEqual(self, results):
+        entries = self.read_index()
+        self.assertLen(entries, len(results))
+        for entry, result in zip(entries, results):
+            index, camera, timestamp, depth = depth_sinks.read_log_entry(self.output_dir, int(entry[3]),
+                                                                         int(entry[4]))
+            self.assertEqual((index, camera), (result.frame.index, result.frame.camera))
+            self.assertEqual((int(entry[0]), int(entry[1])), (index, camera))
+            self.assertEqual(timestamp, result.frame.timestamp)
+            self.assertEqual((int(entry[5]), int(entry[6])), depth.shape)
+            np.testing.assert_array_equal(depth, result.depth[0, :, :, 0])
+
+    def test_chunked_log_round_trip(self):
+        results = [make_result(index, index % 2) for index in range(5)]
+        sink = depth_sinks.ChunkedLogSink(self.output_dir)
+        for result in results:
+            sink.write(result)
+        sink.close()
+        self.assertLogEqual(results)
+
+    def test_chunked_log_splits_chunks(self):
+        results = [make_result(index, rows=4, cols=4) for index in range(5)]
+        record_bytes = depth_sinks.ChunkedLogSink.HEADER.size + 4 * 4 * 4
+        sink = depth_sinks.ChunkedLogSink(self.output_dir, chunk_bytes=2 * record_bytes)
+        for result in results:
+            sink.write(result)
+        sink.close()
+        self.assertEqual([int(entry[3]) for entry in self.read_index()], [0, 0, 1, 1, 2])
+        self.assertLogEqual(results)
+
+    def test_chunked_log_continues_previous_run(self):
+        results = [make_result(index) for index in range(4)]
+        for run in [results[:2], results[2:]]:
+            sink = depth_sinks.ChunkedLogSink(self.output_dir)
+            for result in run:
+                sink.write(result)
+            sink.close()
+        self.assertEqual([int(entry[3]) for entry in self.read_index()], [0, 0, 1, 1])
+        self.assertLogEqual(results)
+
+
+if __name__ == '__main__':
+    absltest.main()
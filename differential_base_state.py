@@ -1,12 +1,14 @@
 from __future__ import absolute_import, division, print_function
 import os
 import sys
+import time
 
 # Root directory of the Isaac
 ROOT_DIR = os.path.abspath("/mnt/isaac_2019_2")
 sys.path.append(ROOT_DIR)
 
 from engine.pyalice import *
+from struct2depth.odometry import OdometryWriter
 
 
 class DifferentialBaseState(Codelet):
@@ -20,6 +22,9 @@ class DifferentialBaseState(Codelet):
         # Tick every time we receive a differential base state
         self.tick_on_message(self.rx)
 
+        # Shared memory slot read by the data readers
+        self.odometry = OdometryWriter()
+
     def tick(self):
 
         # Extract speed from differential base
@@ -37,10 +42,5 @@ class DifferentialBaseState(Codelet):
         except ValueError:
             angular_speed = 0
 
-        # Combine into a string format
-        combined_speed = "{}, {}".format(speed, angular_speed)
-
-        # Write to a file. Overwritten for each new speed change
-        f = open('/mnt/isaac_2019_2/apps/carter_sim_struct2depth/differential_base_speed/speed.csv', 'w')
-        f.write(combined_speed)
-        f.close()
+        # Append to the odometry history ring, where the data readers look up the motion at a timestamp
+        self.odometry.write(time.time(), speed, angular_speed)
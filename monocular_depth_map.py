@@ -1,16 +1,20 @@
 from __future__ import absolute_import, division, print_function
+import collections
 import os
 import sys
+import time
 import numpy as np
 from absl import logging
 # import matplotlib.pyplot as plt
+from struct2depth import frozen_model
 from struct2depth import model
-import numpy as np
 import fnmatch
 import tensorflow as tf
 from struct2depth import nets
 from struct2depth import util
 import cv2
+import depth_pipeline
+import depth_sinks
 
 gfile = tf.gfile
 
@@ -21,9 +25,19 @@ sys.path.append(ROOT_DIR)
 OUTPUT_DIR = "/mnt/isaac/apps/carter_sim_struct2depth/results_actual"
 FILE_EXT = "png"
 DEPTH = True
-EGOMOTION = False
+EGOMOTION = False  # Publish egomotion over the last SEQ_LENGTH frames of EGOMOTION_CAMERA
+EGOMOTION_CAMERA = 0
 MODEL_CKPT = "/mnt/isaac/apps/carter_sim_struct2depth/struct2depth/ckpts_saved_images/model-2772"
-BATCH_SIZE = 1
+# Frozen graph written by struct2depth/export_graph.py with --batch_size len(CAMERA_CHANNELS). If
+# set, it replaces MODEL_CKPT and the network is not rebuilt at startup.
+FROZEN_GRAPH = None
+# Camera channels as (name, rx channel, tx channel). Every camera gets its own depth output, a
+# [IMG_HEIGHT, IMG_WIDTH] float32 TensorProto with the depth map. With
+# more than one camera, frames arriving within BATCH_WINDOW seconds are run as one batch, e.g.
+#   [('left', 'left_rgb_image', 'left_depth_map'), ('right', 'right_rgb_image', 'right_depth_map')]
+CAMERA_CHANNELS = [('left', 'rgb_image', 'depth_map')]
+BATCH_WINDOW = 0.01  # Seconds to wait for the other cameras once the first frame of a batch arrived
+BATCH_SIZE = len(CAMERA_CHANNELS)
 IMG_HEIGHT = 128
 IMG_WIDTH = 416
 SEQ_LENGTH = 3
@@ -31,6 +45,7 @@ ARCHITECTURE = nets.RESNET
 IMAGENET_NORM = True
 USE_SKIP = True
 JOINT_ENCODER = False
+INFERENCE_BATCH_NORM = True  # Use the moving batch norm statistics of the checkpoint
 SHUFFLE = False
 FLIP = False
 INFERENCE_MODE_SINGLE = 'single'
@@ -39,302 +54,321 @@ INFERENCE_CROP_NONE = 'none'
 INFERENCE_MODE = INFERENCE_MODE_SINGLE
 INFERENCE_CROP = INFERENCE_CROP_NONE
 USE_MASKS = False
+LATENCY_REPORT_EVERY = 100  # Ticks between latency summaries in the log
+LATENCY_STAGES = ['ingest', 'preprocess', 'inference', 'egomotion', 'publish', 'tick']
+FRAME_QUEUE_SIZE = 2 * len(CAMERA_CHANNELS)  # Frames waiting for the inference worker
+FRAME_QUEUE_POLICY = depth_pipeline.DROP_OLDEST  # Keep the published depth as fresh as possible
+OUTPUT_SINKS = [depth_sinks.SINK_EVERY_NTH]  # Any of depth_sinks.SINKS, each runs in its own thread
+SINK_BACKLOG = 8  # Results waiting in each sink
+SINK_POLICY = depth_pipeline.DROP_OLDEST
+SAVE_EVERY_N = 30  # Frames between saved .npy predictions and visualizations in OUTPUT_DIR
+RING_BUFFER_SIZE = 100  # Predictions kept in memory by the ring buffer sink
+LOG_DIR = os.path.join(OUTPUT_DIR, "depth_log")
+LOG_CHUNK_BYTES = 256 * 1024 * 1024
 
 # Root directory of the Isaac
 ROOT_DIR = os.path.abspath("/mnt/isaac/apps/carter_sim_struct2depth")
 sys.path.append(ROOT_DIR)
 from engine.pyalice import *
 
+# Input channel, output channel and frame pool of one camera
+Camera = collections.namedtuple('Camera', ['index', 'name', 'rx', 'tx', 'pool'])
+
 
 class MonocularDepthMap(Codelet):
     def start(self):
         # This part will be run once in the beginning of the program
         logging.info("Running MonocularDepthMap initialization")
 
-        # Input and output messages for the Codelet
-        self.rx = self.isaac_proto_rx("ColorCameraProto", "rgb_image")
-        self.tx = self.isaac_proto_tx("DepthCameraProto", "depth_listener")
-        self.depth_image_proto = self.isaac_proto_tx("ImageProto", "rgb_image")
-        self.depth_pinhole_proto = self.isaac_proto_tx("PinholeProto", "pinhole")
+        # Input and output messages for the Codelet, one pair per camera. Every camera owns a pool
+        # with one array per queued frame of that camera, plus the one in the worker and the one
+        # being ingested.
+        self.cameras = []
+        for index, (name, rx_channel, tx_channel) in enumerate(CAMERA_CHANNELS):
+            self.cameras.append(Camera(index, name,
+                                       self.isaac_proto_rx("ColorCameraProto", rx_channel),
+                                       self.isaac_proto_tx("TensorProto", tx_channel),
+                                       depth_pipeline.FramePool(FRAME_QUEUE_SIZE // len(CAMERA_CHANNELS) + 2)))
+        self.last_message = [None] * len(self.cameras)  # Acquisition time or proto of the last ingested message
+        if EGOMOTION:
+            if FLIP:
+                raise ValueError('Egomotion can not be estimated on flipped frames')
+            self.egomotion_tx = self.isaac_proto_tx("Pose3dProto", "egomotion")
         logging.info("RX and TX protos have been created")
 
         self.count = 0  # Count how many images taken
 
-        # Create inference model
-        self.inference_model = model.Model(is_training=False,
-                                           batch_size=BATCH_SIZE,
-                                           img_height=IMG_HEIGHT,
-                                           img_width=IMG_WIDTH,
-                                           seq_length=SEQ_LENGTH,
-                                           architecture=ARCHITECTURE,
-                                           imagenet_norm=IMAGENET_NORM,
-                                           use_skip=USE_SKIP,
-                                           joint_encoder=JOINT_ENCODER)
-        logging.info("Inference model created")
-
-        # Restore model ckpt and configuration settings
-        vars_to_restore = util.get_vars_to_save_and_restore(MODEL_CKPT)
-        self.saver = tf.train.Saver(vars_to_restore)
-        self.sv = tf.train.Supervisor(logdir='/tmp/', saver=None)
+        # Create inference model in a session that lives as long as the codelet
         self.config = tf.ConfigProto()
         self.config.gpu_options.allow_growth = True
-
-        if not gfile.Exists(OUTPUT_DIR):
-            gfile.MakeDirs(OUTPUT_DIR)
-        logging.info('Predictions will be saved in %s.', OUTPUT_DIR)
+        if FROZEN_GRAPH is not None:
+            self.inference_model = frozen_model.FrozenModel(FROZEN_GRAPH)
+            if self.inference_model.batch_size != BATCH_SIZE:
+                raise ValueError('Frozen graph has batch size {}, but there are {} cameras'.format(
+                    self.inference_model.batch_size, BATCH_SIZE))
+            self.sess = self.inference_model.session(config=self.config)
+            logging.info("Frozen inference graph loaded")
+        else:
+            self.inference_model = model.Model(is_training=False,
+                                               batch_size=BATCH_SIZE,
+                                               img_height=IMG_HEIGHT,
+                                               img_width=IMG_WIDTH,
+                                               seq_length=SEQ_LENGTH,
+                                               architecture=ARCHITECTURE,
+                                               imagenet_norm=IMAGENET_NORM,
+                                               use_skip=USE_SKIP,
+                                               joint_encoder=JOINT_ENCODER,
+                                               inference_batch_norm=INFERENCE_BATCH_NORM)
+            logging.info("Inference model created")
+
+            # Restore model ckpt once
+            vars_to_restore = util.get_vars_to_save_and_restore(MODEL_CKPT)
+            self.saver = tf.train.Saver(vars_to_restore)
+            self.sess = tf.Session(config=self.config)
+            self.sess.run(tf.global_variables_initializer())
+            self.saver.restore(self.sess, MODEL_CKPT)
+            logging.info("Model ckpt restored")
+
+        # Per-stage latency histograms. Steady state should be dominated by 'inference'.
+        self.latency = {name: util.LatencyHistogram(name) for name in LATENCY_STAGES}
+
+        # Tick thread -> frame queue -> inference worker -> output sinks, each with its own thread.
+        # The tick thread publishes whatever result the worker finished most recently.
+        self.frames = depth_pipeline.FrameQueue(FRAME_QUEUE_SIZE, FRAME_QUEUE_POLICY)
+        self.batch_buffer = None  # Reused uint8 network input, only touched by the worker
+        # Normalized frames of the egomotion camera, reused from the depth network input. With a
+        # joint encoder, the bottleneck embeddings of the previous frames are cached instead.
+        if JOINT_ENCODER:
+            self.egomotion_window = util.FrameWindow(SEQ_LENGTH - 1)
+        else:
+            self.egomotion_window = util.FrameWindow(SEQ_LENGTH)
+        self.frame_allocations = collections.deque(maxlen=LATENCY_REPORT_EVERY)
+        self.sinks = [self.create_sink(name) for name in OUTPUT_SINKS]
+        for sink in self.sinks:
+            sink.start()
+        self.worker = depth_pipeline.InferenceWorker(self.frames, self.infer_batch, self.sinks,
+                                                     batch_size=BATCH_SIZE, batch_window=BATCH_WINDOW)
+        self.worker.start()
         logging.info("Initialization successful")
 
-        # Tick every time we receive an image
-        self.tick_on_message(self.rx)
-
+        # Tick every time we receive an image on any camera
+        for camera in self.cameras:
+            self.tick_on_message(camera.rx)
+
+    def stop(self):
+        self.worker.stop()
+        self.worker.join()
+        for sink in self.sinks:
+            sink.stop()
+        self.log_latency()
+        self.sess.close()
+
+    def create_sink(self, name):
+        kwargs = dict(backlog=SINK_BACKLOG, policy=SINK_POLICY)
+        if name == depth_sinks.SINK_NONE:
+            return depth_sinks.NullSink()
+        elif name == depth_sinks.SINK_EVERY_NTH:
+            return depth_sinks.EveryNthSink(OUTPUT_DIR, SAVE_EVERY_N, FILE_EXT,
+                                            prefix='image_flip' if FLIP else 'image',
+                                            camera_names=[camera.name for camera in self.cameras], **kwargs)
+        elif name == depth_sinks.SINK_RING:
+            return depth_sinks.RingBufferSink(RING_BUFFER_SIZE, **kwargs)
+        elif name == depth_sinks.SINK_LOG:
+            return depth_sinks.ChunkedLogSink(LOG_DIR, LOG_CHUNK_BYTES, **kwargs)
+        raise ValueError('Unknown output sink: {}'.format(name))
+
+    # Logs a summary line for every latency histogram and the number of dropped items per queue
+    def log_latency(self):
+        for name in LATENCY_STAGES:
+            logging.info(self.latency[name].summary())
+        logging.info("Dropped frames: %d", self.frames.dropped)
+        logging.info("Frame allocations: %d total, %d over the last %d ticks",
+                     sum(camera.pool.allocations for camera in self.cameras),
+                     sum(self.frame_allocations), len(self.frame_allocations))
+        logging.info("Batches run per batch size: %s", dict(self.worker.batch_sizes))
+        for sink in self.sinks:
+            logging.info(sink.latency.summary())
+            logging.info("Dropped outputs in %s sink: %d", sink.name, sink.dropped)
+
+    # Runs in the Isaac tick thread. Only hands new frames over to the worker and publishes the
+    # freshest finished depth maps, so slow inference never stalls the message queue.
     def tick(self):
-        logging.info("Ticking")
-
+        tick_start = time.time()
+
+        with self.latency['ingest'].measure():
+            tick_allocations = 0
+            for camera in self.cameras:
+                if self.has_new_message(camera):
+                    tick_allocations += self.ingest(camera)
+            self.frame_allocations.append(tick_allocations)
+            logging.debug("Frame allocations this tick: %d", tick_allocations)
+
+        for result in self.worker.take_latest():
+            with self.latency['publish'].measure():
+                self.publish_depth(result)
+                if result.frame.egomotion is not None:
+                    self.publish_egomotion(result)
+
+        self.latency['tick'].record(time.time() - tick_start)
+        if self.latency['tick'].count % LATENCY_REPORT_EVERY == 0:
+            self.log_latency()
+
+    # The tick is triggered by any camera, so with several cameras the ones whose message was
+    # already ingested are skipped. Messages are told apart by their acquisition time where the rx
+    # exposes one, otherwise by the identity of the received proto. The last proto is kept
+    # referenced, so its identity can not be reused by a newer message.
+    def has_new_message(self, camera):
+        if len(self.cameras) == 1:
+            return True
+        acqtime = getattr(camera.rx, 'acqtime', None)
+        if acqtime is not None:
+            if acqtime == self.last_message[camera.index]:
+                return False
+            self.last_message[camera.index] = acqtime
+            return True
+        proto = camera.rx.get_proto()
+        if proto is None or proto is self.last_message[camera.index]:
+            return False
+        self.last_message[camera.index] = proto
+        return True
+
+    # Queues the current message of a camera for inference. Returns the number of frame arrays
+    # that had to be allocated.
+    def ingest(self, camera):
         # Extract image proto
-        rgb_image_proto = self.rx.get_proto().image
+        rgb_image_proto = camera.rx.get_proto().image
 
         # Extract image attributes
-        element_type = rgb_image_proto.elementType
         rows = rgb_image_proto.rows
         cols = rgb_image_proto.cols
         channels = rgb_image_proto.channels
         image_buffer_id = rgb_image_proto.dataBufferIndex
-
-        print("Element type: {}".format(element_type))
-        print("Rows: {}".format(rows))
-        print("Cols: {}".format(cols))
-        print("Channels: {}".format(channels))
-        print("Image buffer id: {}\n".format(image_buffer_id))
-
-        # Read image buffer
-        image_buffer = self.rx.get_buffer_content(image_buffer_id)
-
-        # Transform into image
-        image = np.frombuffer(image_buffer, dtype=np.uint8)
-        image = np.reshape(image, (rows, cols, channels)) / 255.
-        # print(image)
-        print("Image initial shape: {}".format(np.shape(image)))
-        # cv2.imshow('image',image)
-        # k = cv2.waitKey(0)
-        # if k == 27:         # wait for ESC key to exit
-        #     cv2.destroyAllWindows()
-
-        # Reshape to inference network size and homogeneous coordinates
-        image = cv2.resize(image, (IMG_WIDTH, IMG_HEIGHT))
-        print("Image resized shape: {}".format(np.shape(image)))
-
-        # cv2.imshow('image',image)
-        # k = cv2.waitKey(0)
-        # if k == 27:         # wait for ESC key to exit
-        #     cv2.destroyAllWindows()
-        image_tensor = np.reshape(image, (1, IMG_HEIGHT, IMG_WIDTH, channels))
-        print("Image reshaped shape: {}".format(np.shape(image)))
-
-        # Extract camera attributes
-        pinhole_proto = self.rx.get_proto().pinhole
-
-        # Run inference
-        est_depth, visualization = self.run_inference(image_tensor,
-                                                      output_dir=OUTPUT_DIR,
-                                                      file_extension=FILE_EXT,
-                                                      depth=DEPTH,
-                                                      egomotion=EGOMOTION,
-                                                      flip_for_depth=FLIP,
-                                                      inference_crop=INFERENCE_CROP,
-                                                      use_masks=USE_MASKS
-                                                      )
-
-        # cv2.imshow('Depth Map', visualization)
-        # k = cv2.waitKey(0)
-        # if k == 27:
-        #     cv2.destroyAllWindows()
-
-        print("Depth map shape: {}".format(np.shape(est_depth)))
-        print("Depth min: {}".format(np.min(est_depth)))
-        print("Depth max: {}".format(np.max(est_depth)))
-
-        # Initialize tx protos
-        depth_camera_viewer = self.tx.init_proto()
-        depth_image_proto = self.depth_image_proto.init_proto()
-        depth_pinhole_proto = self.depth_pinhole_proto.init_proto()
-
-        # Set image proto attributes
-        depth_image_proto.elementType = 'float32'
-        depth_image_proto.rows = IMG_HEIGHT
-        depth_image_proto.cols = IMG_WIDTH
-        depth_image_proto.channels = 1
-
-        # Serialize image
-        depth_buffer = est_depth.tobytes()
-        depth_image_proto.dataBufferIndex = 0  # TODO: Figure out how to store image data as buffer
-
-        # Set pinhole intrinsics
-        depth_pinhole_proto.rows = IMG_HEIGHT
-        depth_pinhole_proto.cols = IMG_WIDTH
-        depth_pinhole_proto.focal = pinhole_proto.focal  # TODO: Check that these values are correct
-        depth_pinhole_proto.center = pinhole_proto.center
-        print("Pinhole focal: {}".format(depth_pinhole_proto.focal))
-        print("Pinhole center: {}".format(depth_pinhole_proto.center))
-
-        # Set depth camera proto
-        depth_camera_viewer.depthImage = depth_image_proto
-        depth_camera_viewer.minDepth = 0
-        depth_camera_viewer.maxDepth = 1  # TODO: Find min and maxes
-        depth_camera_viewer.pinhole = depth_pinhole_proto
-
-        # Publish DepthCameraProto
-        self.tx.publish()
-        logging.info("Published!")
-
-    # Run inference. Expects input image with values from 0-1.
-    def run_inference(self,
-                      image=None,
-                      output_dir=None,
-                      file_extension='png',
-                      depth=True,
-                      egomotion=False,
-                      flip_for_depth=False,
-                      inference_crop=INFERENCE_CROP_NONE,
-                      use_masks=False
-                      ):
-
-        est_depth = None
-        visualization = None
-
-        logging.info('Running inference:')
-        # Run depth prediction network.
-        if depth:
-
-            # Flip
-            if flip_for_depth:
-                image = np.flip(image, axis=1)
-
-            with self.sv.managed_session(config=self.config) as sess:
-                self.saver.restore(sess, MODEL_CKPT)
-                logging.info("Model ckpt restored")
-
-                est_depth = self.inference_model.inference_depth(image, sess)
-
-            # Flip back
-            if flip_for_depth:
-                est_depth = np.flip(est_depth, axis=2)
-                image = np.flip(image, axis=2)
-
-            # Reshape image from homogeneous coordinates to standard
-            image = np.reshape(image, (IMG_HEIGHT, IMG_WIDTH, 3))
-
-            # cv2.imshow('image',image)
-            # k = cv2.waitKey(0)
-            # if k == 27:         # wait for ESC key to exit
-            #     cv2.destroyAllWindows()
-
-            # Create color map for visualization
-            color_map = util.normalize_depth_for_display(np.squeeze(est_depth))
-            visualization = np.concatenate((image, color_map), axis=0)
-
-            # Save images
-            # Save raw prediction and color visualization. Extract filename
-            # without extension from full path: e.g. path/to/input_dir/folder1/
-            # file1.png -> file1
-
-            pref = '_flip' if flip_for_depth else ''
-            output_raw = os.path.join(output_dir, 'image' + pref + '{}'.format(self.count) + '.npy')
-            output_vis = os.path.join(output_dir, 'image' + pref + '{}'.format(self.count) + '.png')
-
-            with gfile.Open(output_raw, 'wb') as f:
-                np.save(f, est_depth)
-            util.save_image(output_vis, visualization, file_extension)
-            self.count += 1
-            logging.info("Inference successful")
-        return est_depth, visualization
-
-    # Run egomotion network.
-    # if egomotion:
-    #     if inference_mode == INFERENCE_MODE_SINGLE:
-    #         # Run regular egomotion inference loop.
-    #         input_image_seq = []
-    #         input_seg_seq = []
-    #         current_sequence_dir = None
-    #         current_output_handle = None
-    #         for i in range(len(im_files)):
-    #             sequence_dir = os.path.dirname(im_files[i])
-    #             if sequence_dir != current_sequence_dir:
-    #                 # Assume start of a new sequence, since this image lies in a
-    #                 # different directory than the previous ones.
-    #                 # Clear egomotion input buffer.
-    #                 output_filepath = os.path.join(output_dirs[i], 'egomotion.txt')
-    #                 if current_output_handle is not None:
-    #                     current_output_handle.close()
-    #                 current_sequence_dir = sequence_dir
-    #                 logging.info('Writing egomotion sequence to %s.', output_filepath)
-    #                 current_output_handle = gfile.Open(output_filepath, 'w')
-    #                 input_image_seq = []
-    #             im = util.load_image(im_files[i], resize=(img_width, img_height))
-    #             input_image_seq.append(im)
-    #             if use_masks:
-    #                 im_seg_path = im_files[i].replace('.%s' % file_extension,
-    #                                                   '-seg.%s' % file_extension)
-    #                 if not gfile.Exists(im_seg_path):
-    #                     raise ValueError('No segmentation mask %s has been found for '
-    #                                      'image %s. If none are available, disable '
-    #                                      'use_masks.' % (im_seg_path, im_files[i]))
-    #                 input_seg_seq.append(util.load_image(im_seg_path,
-    #                                                      resize=(img_width, img_height),
-    #                                                      interpolation='nn'))
-    #
-    #             if len(input_image_seq) < seq_length:  # Buffer not filled yet.
-    #                 continue
-    #             if len(input_image_seq) > seq_length:  # Remove oldest entry.
-    #                 del input_image_seq[0]
-    #                 if use_masks:
-    #                     del input_seg_seq[0]
-    #
-    #             input_image_stack = np.concatenate(input_image_seq, axis=2)
-    #             input_image_stack = np.expand_dims(input_image_stack, axis=0)
-    #             if use_masks:
-    #                 input_image_stack = mask_image_stack(input_image_stack,
-    #                                                      input_seg_seq)
-    #             est_egomotion = np.squeeze(inference_model.inference_egomotion(
-    #                 input_image_stack, sess))
-    #             egomotion_str = []
-    #             for j in range(seq_length - 1):
-    #                 egomotion_str.append(','.join([str(d) for d in est_egomotion[j]]))
-    #             current_output_handle.write(
-    #                 str(i) + ' ' + ' '.join(egomotion_str) + '\n')
-    #         if current_output_handle is not None:
-    #             current_output_handle.close()
-    #     elif inference_mode == INFERENCE_MODE_TRIPLETS:
-    #         written_before = []
-    #         for i in range(len(im_files)):
-    #             im = util.load_image(im_files[i], resize=(img_width * 3, img_height))
-    #             input_image_stack = np.concatenate(
-    #                 [im[:, :img_width], im[:, img_width:img_width * 2],
-    #                  im[:, img_width * 2:]], axis=2)
-    #             input_image_stack = np.expand_dims(input_image_stack, axis=0)
-    #             if use_masks:
-    #                 im_seg_path = im_files[i].replace('.%s' % file_extension,
-    #                                                   '-seg.%s' % file_extension)
-    #                 if not gfile.Exists(im_seg_path):
-    #                     raise ValueError('No segmentation mask %s has been found for '
-    #                                      'image %s. If none are available, disable '
-    #                                      'use_masks.' % (im_seg_path, im_files[i]))
-    #                 seg = util.load_image(im_seg_path,
-    #                                       resize=(img_width * 3, img_height),
-    #                                       interpolation='nn')
-    #                 input_seg_seq = [seg[:, :img_width], seg[:, img_width:img_width * 2],
-    #                                  seg[:, img_width * 2:]]
-    #                 input_image_stack = mask_image_stack(input_image_stack,
-    #                                                      input_seg_seq)
-    #             est_egomotion = inference_model.inference_egomotion(
-    #                 input_image_stack, sess)
-    #             est_egomotion = np.squeeze(est_egomotion)
-    #             egomotion_1_2 = ','.join([str(d) for d in est_egomotion[0]])
-    #             egomotion_2_3 = ','.join([str(d) for d in est_egomotion[1]])
-    #
-    #             output_filepath = os.path.join(output_dirs[i], 'egomotion.txt')
-    #             file_mode = 'w' if output_filepath not in written_before else 'a'
-    #             with gfile.Open(output_filepath, file_mode) as current_output_handle:
-    #                 current_output_handle.write(str(i) + ' ' + egomotion_1_2 + ' ' +
-    #                                             egomotion_2_3 + '\n')
-    #             written_before.append(output_filepath)
-    #     logging.info('Done.')
+        logging.debug("Received %s image %dx%dx%d in buffer %d from %s", rgb_image_proto.elementType,
+                      rows, cols, channels, image_buffer_id, camera.name)
+
+        # Copy the image buffer straight into a reused uint8 array. np.frombuffer is only a
+        # view; normalization and resizing to the network size happen in-graph.
+        image_buffer = camera.rx.get_buffer_content(image_buffer_id)
+        allocations_before = camera.pool.allocations
+        image = camera.pool.acquire((1, rows, cols, channels))
+        np.copyto(image, np.frombuffer(image_buffer, dtype=np.uint8).reshape(image.shape))
+
+        # Extract camera attributes, scaled from the camera resolution to the depth map resolution
+        pinhole_proto = camera.rx.get_proto().pinhole
+        scale_x = IMG_WIDTH / cols
+        scale_y = IMG_HEIGHT / rows
+        focal = (pinhole_proto.focal.x * scale_x, pinhole_proto.focal.y * scale_y)
+        center = (pinhole_proto.center.x * scale_x, pinhole_proto.center.y * scale_y)
+
+        dropped = self.frames.put(depth_pipeline.Frame(self.count, image, focal, center,
+                                                       pool=camera.pool, camera=camera.index))
+        for frame in dropped:
+            frame.release()
+        self.count += 1
+        return camera.pool.allocations - allocations_before
+
+    # Publishes the depth map of a finished result as a TensorProto. The depth values are stored
+    # inline in the proto, the same way pinhole_to_tensor.py publishes its camera matrix; a
+    # DepthCameraProto would need a message buffer, which this codelet has no way to attach.
+    def publish_depth(self, result):
+        est_depth = np.ascontiguousarray(result.depth[0, :, :, 0], dtype=np.float32)
+
+        tx = self.cameras[result.frame.camera].tx
+        tensor = tx.init_proto()
+
+        # Set element type and dimensions
+        tensor.elementType = 'float32'
+        sizes = tensor.init('sizes', 2)
+        sizes[0] = IMG_HEIGHT
+        sizes[1] = IMG_WIDTH
+
+        # Add the depth map to the TensorProto
+        tensor.data = est_depth.tobytes()
+
+        # Publish TensorProto
+        tx.publish()
+
+    # Publishes the egomotion from the previous to the current frame as a Pose3dProto
+    def publish_egomotion(self, result):
+        translation = result.frame.egomotion[-1, :3]
+        rotation = result.frame.egomotion[-1, 3:]
+        pose = self.egomotion_tx.init_proto()
+        pose.rotation.q.w, pose.rotation.q.x, pose.rotation.q.y, pose.rotation.q.z = \
+            util.euler_to_quaternion(*rotation)
+        pose.translation.x, pose.translation.y, pose.translation.z = [float(t) for t in translation]
+        self.egomotion_tx.publish()
+
+    # Runs in the inference worker. Stacks the raw uint8 frames of all cameras into one batch;
+    # scaling, resizing and ImageNet normalization all run inside the graph. Cameras without a
+    # frame in this batch are zero padded. Returns one depth map per frame.
+    def infer_batch(self, frames):
+        with self.latency['preprocess'].measure():
+            # Cameras with different resolutions are resized to the network size, which the graph
+            # resizes to anyway; otherwise frames are stacked at their own resolution
+            frame_shapes = set(frame.image.shape[1:] for frame in frames)
+            if len(frame_shapes) == 1:
+                frame_shape = frame_shapes.pop()
+            else:
+                frame_shape = (IMG_HEIGHT, IMG_WIDTH, frames[0].image.shape[3])
+            shape = (BATCH_SIZE,) + frame_shape
+            if self.batch_buffer is None or self.batch_buffer.shape != shape:
+                self.batch_buffer = np.zeros(shape, dtype=np.uint8)
+            elif len(frames) < BATCH_SIZE:
+                self.batch_buffer.fill(0)
+            for i, frame in enumerate(frames):
+                image = frame.image[0]
+                if image.shape != frame_shape:
+                    image = cv2.resize(image, (IMG_WIDTH, IMG_HEIGHT))
+                if FLIP:
+                    image = np.flip(image, axis=1)
+                self.batch_buffer[i] = image
+                if any(sink.needs_preview and sink.accepts(frame) for sink in self.sinks):
+                    # The pooled frame is recycled after inference, keep a small copy for the sink
+                    frame.preview = cv2.resize(frame.image[0], (IMG_WIDTH, IMG_HEIGHT))
+
+        # Position of the egomotion camera in this batch, if it has a frame
+        ego_index = None
+        if EGOMOTION:
+            ego_index = next((i for i, frame in enumerate(frames) if frame.camera == EGOMOTION_CAMERA), None)
+
+        # Only the forward pass runs here; the session and weights live for the whole codelet.
+        with self.latency['inference'].measure():
+            if ego_index is None:
+                est_depth = self.inference_model.inference_depth_uint8(self.batch_buffer, self.sess)
+            elif JOINT_ENCODER:
+                est_depth, frames[ego_index].egomotion = self.infer_joint(ego_index)
+            else:
+                est_depth, net_input = self.inference_model.inference_depth_uint8_normalized(
+                    self.batch_buffer, self.sess)
+
+        if ego_index is not None and not JOINT_ENCODER:
+            with self.latency['egomotion'].measure():
+                frames[ego_index].egomotion = self.infer_egomotion(net_input[ego_index])
+
+        # Flip back
+        if FLIP:
+            est_depth = np.flip(est_depth, axis=2)
+        return [est_depth[i:i + 1] for i in range(len(frames))]
+
+    # Runs in the inference worker. Shifts the already normalized frame into the window and runs
+    # egomotion once the window is full. Returns None until then.
+    def infer_egomotion(self, normalized_frame):
+        self.egomotion_window.push(normalized_frame)
+        if not self.egomotion_window.full():
+            return None
+        return self.inference_model.inference_egomotion_normalized(self.egomotion_window.stack, self.sess)[0]
+
+    # Runs in the inference worker. Depth and egomotion in a single pass that encodes the frame
+    # once; the embeddings of the previous frames come from the window. Returns the depth of the
+    # batch and the egomotion of frame ego_index, or None until the window is full.
+    def infer_joint(self, ego_index):
+        if self.egomotion_window.full():
+            est_depth, egomotion, bottleneck = self.inference_model.inference_depth_egomotion_live(
+                self.batch_buffer, self.egomotion_window.stack, ego_index, self.sess)
+            egomotion = egomotion[0]
+        else:
+            est_depth, bottleneck = self.inference_model.inference_depth_uint8_bottleneck(
+                self.batch_buffer, ego_index, self.sess)
+            egomotion = None
+        self.egomotion_window.push(bottleneck[0])
+        return est_depth, egomotion
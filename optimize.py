@@ -86,7 +86,8 @@ def load_training_parameters():
            config["egomotion_threshold"], \
            config["num_steps"], \
            config["handle_motion"], \
-           config["flip"]
+           config["flip"], \
+           config.get("cache_dir")
 
 
 def load_isaac_parameters():
@@ -199,7 +200,8 @@ def main(_):
     egomotion_threshold, \
     num_steps, \
     handle_motion, \
-    flip = load_training_parameters()
+    flip, \
+    cache_dir = load_training_parameters()
 
     isaac_app_filename, \
     time_delay, \
@@ -256,7 +258,8 @@ def main(_):
                               train_global_scale_var=False,
                               isaac_app=isaac_app,
                               optimize=True,
-                              num_steps=num_steps)
+                              num_steps=num_steps,
+                              cache_dir=cache_dir)
 
     finetune_inference(train_model, model_ckpt, output_dir, isaac_app, using_saved_images, num_steps, batch_size, flip,
                        save_every, save_previews, file_extension)
@@ -22,6 +22,9 @@ import cv2
 import glob
 import csv
 
+from data_loading.triplet_builder import TripletBuilder
+from struct2depth.shards import ShardWriter
+
 # Segmentation mask generation
 # from .gen_masks_kitti import MaskGenerator
 # from .alignment import align
@@ -78,6 +81,8 @@ def main():
     OUTPUT_IMAGE_DIR = '/mnt/test_data/processed_images'
     OUTPUT_SEG_MASK_DIR = '/mnt/test_data/processed_seg_masks'
     OUTPUT_INTRINSICS_DIR = '/mnt/test_data/processed_intrinsics'
+    OUTPUT_SHARD_DIR = '/mnt/test_data/processed_shards'
+    OUTPUT_FORMAT = 'png'  # 'png' or 'shards', see struct2depth/shards.py
     CALIB_FILE = 'kinect_camera_intrinsics.csv'
     OPTIMIZE = True
     REPETITIONS = 5
@@ -98,69 +103,36 @@ def main():
     if not os.path.exists(OUTPUT_INTRINSICS_DIR):
         os.mkdir(OUTPUT_INTRINSICS_DIR)
 
+    shard_writer = ShardWriter(OUTPUT_SHARD_DIR) if OUTPUT_FORMAT == 'shards' else None
+
     # Get camera intrinsics
     camera_mat = get_camera_intrinsics(CALIB_FILE)
 
     # Retrieve image file names and sort them
     files = sorted(glob.glob(INPUT_DIR + '/*.png'))
-    for i in range(SEQ_LENGTH, len(files) + 1, STEPSIZE):
-        imgnum = str(ct).zfill(10)
-
-        big_img = np.zeros(shape=(HEIGHT, WIDTH * SEQ_LENGTH, 3))
-        wct = 0
-
-        # Define list of seg_mask images
-        seg_list = []
-
-        for j in range(i - SEQ_LENGTH, i):  # Collect frames for this sample.
-            img = cv2.imread(files[j])
-            ORIGINAL_HEIGHT, ORIGINAL_WIDTH, _ = img.shape
-
-            zoom_x = WIDTH / ORIGINAL_WIDTH
-            zoom_y = HEIGHT / ORIGINAL_HEIGHT
 
-            # Adjust intrinsics.
-            calib_current = camera_mat.copy()
-            calib_current[0, 0] *= zoom_x
-            calib_current[0, 2] *= zoom_x
-            calib_current[1, 1] *= zoom_y
-            calib_current[1, 2] *= zoom_y
-
-            calib_representation = ','.join([str(c) for c in calib_current.flatten()])
-
-            img = cv2.resize(img, (WIDTH, HEIGHT))
-            big_img[:, wct * WIDTH:(wct + 1) * WIDTH] = img
-            wct += 1
-
-            # Generate seg_mask and add to list
-            # seg_list.append(mask_generator.generate_seg_img(img))
-            # mask_generator.visualize()
-
-        # Align seg_masks
-        # seg_list[0], seg_list[1], seg_list[2] = align(seg_list[0], seg_list[1], seg_list[2])
-        big_seg_img = np.zeros(shape=(HEIGHT, WIDTH * SEQ_LENGTH, 3))
-
-        # Create seg_mask triplet
-        # for k in range(0, 3):
-        #     big_seg_img[:, k * WIDTH:(k + 1) * WIDTH] = seg_list[k]
+    # Each frame is decoded and resized once and reused by the triplets it belongs to
+    builder = TripletBuilder(camera_mat, seq_length=SEQ_LENGTH, stepsize=STEPSIZE, width=WIDTH, height=HEIGHT)
+    for triplet in builder.build(files):
+        # Generate seg_mask and align seg_masks
+        # See data_loading/gen_data_kitti.py, seg masks are passed to builder.add with align_fn=align
 
         # Write triplet, seg_mask triplet, and camera intrinsics to files
         # Write multiple times if planning on testing online refinement
-        if OPTIMIZE:
-            for k in range(REPETITIONS):
-                cv2.imwrite(OUTPUT_IMAGE_DIR + '/' + str(ct) + '.png', big_img)
-                cv2.imwrite(OUTPUT_SEG_MASK_DIR + '/' + str(ct) + '-fseg.png', big_seg_img)
-                f = open(OUTPUT_INTRINSICS_DIR + '/' + str(ct) + '_cam.txt', 'w')
-                f.write(calib_representation)
-                f.close()
+        for k in range(REPETITIONS if OPTIMIZE else 1):
+            if shard_writer is not None:
+                shard_writer.write(triplet.image, triplet.seg_image, triplet.intrinsics, bgr=True)
                 ct += 1
-        else:
-            cv2.imwrite(OUTPUT_IMAGE_DIR + '/' + str(ct) + '.png', big_img)
-            cv2.imwrite(OUTPUT_SEG_MASK_DIR + '/' + str(ct) + '-fseg.png', big_seg_img)
+                continue
+            cv2.imwrite(OUTPUT_IMAGE_DIR + '/' + str(ct) + '.png', triplet.image)
+            cv2.imwrite(OUTPUT_SEG_MASK_DIR + '/' + str(ct) + '-fseg.png', triplet.seg_image)
             f = open(OUTPUT_INTRINSICS_DIR + '/' + str(ct) + '_cam.txt', 'w')
-            f.write(calib_representation)
+            f.write(triplet.calib_representation)
             f.close()
             ct += 1
 
+    if shard_writer is not None:
+        shard_writer.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -9,9 +9,10 @@ import numpy as np
 import cv2
 
 from isaac_app import create_isaac_app, start_isaac_app, create_sample_bridge
+from struct2depth.frame_selector import FrameSelector
+from struct2depth.odometry import OdometryReader
 from struct2depth.process_image import ImageProcessor
 import time
-import csv
 
 # Op names.
 COLOR_IMAGE_NAME = 'rgb_image'
@@ -22,7 +23,10 @@ SEQ_LENGTH = 3
 STEPSIZE = 1
 WIDTH = 416
 HEIGHT = 128
-TIME_DELAY = 0.4  # seconds
+TIME_DELAY = 0.4  # seconds between images at the threshold speeds
+SPEED_THRESHOLD = 0.25
+ANGULAR_SPEED_THRESHOLD = 0.25
+POLL_INTERVAL = 0.01  # seconds
 ITERATIONS = 5
 
 OUTPUT_DIR = 'synth_images'
@@ -43,61 +47,44 @@ bridge = create_sample_bridge(isaac_app)
 # Start the app
 start_isaac_app(isaac_app)
 
-img_processor = ImageProcessor()
+img_processor = ImageProcessor(reuse_buffers=True)
+
+# Robot odometry history published by the DifferentialBaseState codelet
+odometry = OdometryReader()
+
+# Pick triplet members by robot motion instead of sleeping TIME_DELAY between samples
+selector = FrameSelector.from_time_delay(SEQ_LENGTH, TIME_DELAY, SPEED_THRESHOLD, ANGULAR_SPEED_THRESHOLD)
 
 count = 0
 gct = 0
 while True:
     # Retrieve rgb images from isaac sim
-    while True:
-        if bridge.get_sample_count() >= buffer_size:
-            break
-        time.sleep(TIME_DELAY)
-        print("waiting for samples: {}".format(bridge.get_sample_count()))
-
-    # Retrieve differential base speed from file
-    with open('/mnt/isaac_2019_2/apps/carter_sim_struct2depth/differential_base_speed/speed.csv') as speed_file:
-        csv_reader = csv.reader(speed_file, delimiter=',')
-        for row in csv_reader:
-            if len(row)==2:
-                try:
-                    float(row[0])
-                    speed = float(row[0])
-                except ValueError:
-                    speed = 0
-                try:
-                    float(row[0])
-                    angular_speed = float(row[1])
-                except ValueError:
-                    angular_speed = 0
-
-    # Only save image if the robot is moving or rotating above a threshold speed
-    # Images below these thresholds do not have a great enough disparity for the network to learn depth.
-    if speed > 0.25 or angular_speed > 0.25:
-        images = bridge.acquire_samples(sample_num)
+    if bridge.get_sample_count() < buffer_size:
+        time.sleep(POLL_INTERVAL)
+        continue
 
-        while np.shape(images)[0] < SEQ_LENGTH:
-            time.sleep(TIME_DELAY)
-            images = np.concatenate((images, bridge.acquire_samples(sample_num)))
+    # The sample has no capture timestamp, take the time it became available before acquiring it
+    acqtime = time.time()
+    images = bridge.acquire_samples(sample_num)
 
+    # Retrieve differential base speed and add the image to the current triplet
+    state = odometry.state_at(acqtime)
+    triplet = selector.add(images[0][0], state)
+
+    # Only save triplets whose images are far enough apart
+    # Images below these thresholds do not have a great enough disparity for the network to learn depth.
+    if triplet is not None:
         # Create wide image and segmentation triplets
-        image_seq = []
-        seg_seq = []
         intrinsics = "208, 0, 208, 0, 113.778, 64, 0, 0, 1"
-        for i in range(0, np.shape(images)[0] - 2):
-            big_img, big_seg_img = img_processor.process_image(np.array([images[i][0],
-                                                                         images[i + 1][0],
-                                                                         images[i + 2][0]]))
-
-            # Save to directory
-            for j in range(ITERATIONS):
-                # cv2.imwrite('/mnt/test_images/office_sim/images/{}.png'.format(count), np.uint8(big_img))
-                # cv2.imwrite('/mnt/test_images/office_sim/seg_masks/{}-fseg.png'.format(count), big_seg_img)
-                f = open('/mnt/sim_data/sim_data_inner/{}_cam.txt'.format(count), 'w')
-                f.write(intrinsics)
-                f.close()
-                count += 1
-
-            print('saved images: {}'.format(count))
-
-            # count += 1
+        big_img, big_seg_img = img_processor.process_image(triplet)
+
+        # Save to directory
+        for j in range(ITERATIONS):
+            # cv2.imwrite('/mnt/test_images/office_sim/images/{}.png'.format(count), np.uint8(big_img))
+            # cv2.imwrite('/mnt/test_images/office_sim/seg_masks/{}-fseg.png'.format(count), big_seg_img)
+            f = open('/mnt/sim_data/sim_data_inner/{}_cam.txt'.format(count), 'w')
+            f.write(intrinsics)
+            f.close()
+            count += 1
+
+        print('saved images: {}'.format(count))
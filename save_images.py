@@ -9,9 +9,10 @@ import numpy as np
 import cv2
 
 from isaac_app import create_isaac_app, start_isaac_app
+from struct2depth.frame_selector import FrameSelector
+from struct2depth.odometry import OdometryReader
 from struct2depth.process_image import ImageProcessor
 import time
-import csv
 
 # Root directory of the Isaac
 ROOT_DIR = os.path.abspath("/mnt/isaac_2019_2")
@@ -29,7 +30,10 @@ SEQ_LENGTH = 3
 STEPSIZE = 1
 WIDTH = 416
 HEIGHT = 128
-TIME_DELAY = 0.4  # seconds
+TIME_DELAY = 0.4  # seconds between images at the threshold speeds
+SPEED_THRESHOLD = 0.25
+ANGULAR_SPEED_THRESHOLD = 0.25
+POLL_INTERVAL = 0.01  # seconds
 
 OUTPUT_DIR = 'synth_images'
 
@@ -52,54 +56,43 @@ start_isaac_app(isaac_app)
 
 img_processor = ImageProcessor()
 
+# Robot odometry history published by the DifferentialBaseState codelet
+odometry = OdometryReader()
+
+# Save a frame whenever the robot has moved as far as it would in TIME_DELAY at the threshold speeds
+selector = FrameSelector.from_time_delay(1, TIME_DELAY, SPEED_THRESHOLD, ANGULAR_SPEED_THRESHOLD)
+
 gct = 0
 while True:
     # Retrieve rgb images from isaac sim
-    while True:
-        if bridge.get_sample_count() >= buffer_size:
-            break
-        time.sleep(TIME_DELAY)
-        print("waiting for samples: {}".format(bridge.get_sample_count()))
-
-    # Retrieve differential base speed from file
-    with open('/mnt/isaac_2019_2/apps/carter_sim_struct2depth/differential_base_speed/speed.csv') as speed_file:
-        csv_reader = csv.reader(speed_file, delimiter=',')
-        for row in csv_reader:
-            if len(row) == 2:
-                try:
-                    float(row[0])
-                    speed = float(row[0])
-                except ValueError:
-                    speed = 0
-                try:
-                    float(row[0])
-                    angular_speed = float(row[1])
-                except ValueError:
-                    angular_speed = 0
-
-    # Only save image if the robot is moving or rotating above a threshold speed
-    # Images below these thresholds do not have a great enough disparity for the network to learn depth.
-    if speed > 0 or angular_speed > 0:
-        images = bridge.acquire_samples(sample_num)
+    if bridge.get_sample_count() < buffer_size:
+        time.sleep(POLL_INTERVAL)
+        continue
 
+    # The sample has no capture timestamp, take the time it became available before acquiring it
+    acqtime = time.time()
+    images = bridge.acquire_samples(sample_num)
+
+    # Retrieve differential base speed and only save images that are far enough apart
+    # Images below these thresholds do not have a great enough disparity for the network to learn depth.
+    state = odometry.state_at(acqtime)
+    selected = selector.add(images[0][0], state)
+    if selected is not None:
         # Create wide image and segmentation triplets
         intrinsics = "208, 0, 208, 0, 113.778, 64, 0, 0, 1"
-        for i in range(sample_num):
-
-            img = cv2.resize(images[i][0], (WIDTH, HEIGHT))
 
-            # Create segmentation mask
-            # seg_img = img_processor.create_mask(img)
-            seg_img = np.zeros(shape=(HEIGHT, WIDTH, 3))
+        img = cv2.resize(selected[0], (WIDTH, HEIGHT))
 
-            # Save to directory
-            cv2.imwrite('/mnt/test_data/office_sim/{}.png'.format(gct), np.uint8(img))
-            # cv2.imwrite('/mnt/test_data/warehouse_sim/seg_masks/{}-fseg.png'.format(gct), seg_img)
-            # f = open('/mnt/test_images/office_sim/intrinsics/{}.csv'.format(gct), 'w')
-            # f.write(intrinsics)
-            # f.close()
+        # Create segmentation mask
+        # seg_img = img_processor.create_mask(img)
+        seg_img = np.zeros(shape=(HEIGHT, WIDTH, 3))
 
-            print('Saved images: {}'.format(gct))
-            gct += 1
+        # Save to directory
+        cv2.imwrite('/mnt/test_data/office_sim/{}.png'.format(gct), np.uint8(img))
+        # cv2.imwrite('/mnt/test_data/warehouse_sim/seg_masks/{}-fseg.png'.format(gct), seg_img)
+        # f = open('/mnt/test_images/office_sim/intrinsics/{}.csv'.format(gct), 'w')
+        # f.write(intrinsics)
+        # f.close()
 
-    time.sleep(TIME_DELAY)
+        print('Saved images: {}'.format(gct))
+        gct += 1
@@ -0,0 +1,93 @@
+
+"""Tests for the instance alignment against the per-pair reference implementation."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl.testing import absltest
+import numpy as np
+
+import alignment
+
+
+# The original implementation, which compared every pair of segment masks with compute_overlap.
+def reference_align(seg_img1, seg_img2, seg_img3, threshold_same=0.3):
+    res_img1 = np.zeros_like(seg_img1)
+    res_img2 = np.zeros_like(seg_img2)
+    res_img3 = np.zeros_like(seg_img3)
+    remaining_objects2 = list(np.unique(seg_img2.flatten()))
+    remaining_objects3 = list(np.unique(seg_img3.flatten()))
+    for seg_id in np.unique(seg_img1):
+        max_overlap2 = float('-inf')
+        max_segid2 = -1
+        for seg_id2 in remaining_objects2:
+            overlap = alignment.compute_overlap(seg_img1 == seg_id, seg_img2 == seg_id2)
+            if overlap > max_overlap2:
+                max_overlap2 = overlap
+                max_segid2 = seg_id2
+        if max_overlap2 > threshold_same:
+            max_overlap3 = float('-inf')
+            max_segid3 = -1
+            for seg_id3 in remaining_objects3:
+                overlap = alignment.compute_overlap(seg_img2 == max_segid2, seg_img3 == seg_id3)
+                if overlap > max_overlap3:
+                    max_overlap3 = overlap
+                    max_segid3 = seg_id3
+            if max_overlap3 > threshold_same:
+                res_img1[seg_img1 == seg_id] = seg_id
+                res_img2[seg_img2 == max_segid2] = seg_id
+                res_img3[seg_img3 == max_segid3] = seg_id
+                remaining_objects2.remove(max_segid2)
+                remaining_objects3.remove(max_segid3)
+    return res_img1, res_img2, res_img3
+
+
+# Triplet of seg masks with num_objects rectangles moving right, with random IDs per frame.
+def moving_rectangles(rng, num_objects, height=32, width=64, shift=3):
+    corners = rng.randint(0, [height - 8, width - 16], size=(num_objects, 2))
+    sizes = rng.randint([3, 4], [8, 16], size=(num_objects, 2))
+    frames = []
+    for k in range(3):
+        seg_img = np.zeros((height, width, 3), dtype=np.uint8)
+        ids = rng.permutation(255)[:num_objects] + 1
+        for seg_id, (y, x), (h, w) in zip(ids, corners, sizes):
+            seg_img[y:y + h, x + k * shift:x + k * shift + w] = seg_id
+        frames.append(seg_img)
+    return frames
+
+
+class AlignmentTest(absltest.TestCase):
+
+    def test_compute_overlaps_matches_compute_overlap(self):
+        rng = np.random.RandomState(0)
+        seg_img1, seg_img2, _ = moving_rectangles(rng, 10)
+        ids1, labels1 = np.unique(seg_img1, return_inverse=True)
+        ids2, labels2 = np.unique(seg_img2, return_inverse=True)
+        overlaps = alignment.compute_overlaps(labels1.ravel(), labels2.ravel(), len(ids1), len(ids2))
+        self.assertEqual(overlaps.shape, (len(ids1), len(ids2)))
+        for i1, seg_id1 in enumerate(ids1):
+            for i2, seg_id2 in enumerate(ids2):
+                self.assertAlmostEqual(overlaps[i1, i2],
+                                       alignment.compute_overlap(seg_img1 == seg_id1, seg_img2 == seg_id2))
+
+    def test_align_matches_reference(self):
+        rng = np.random.RandomState(0)
+        for num_objects in [0, 1, 5, 20]:
+            frames = moving_rectangles(rng, num_objects)
+            for result, expected in zip(alignment.align(*frames), reference_align(*frames)):
+                np.testing.assert_array_equal(result, expected)
+
+    def test_align_removes_unmatched_objects(self):
+        seg_img1 = np.zeros((8, 8, 3), dtype=np.uint8)
+        seg_img2 = np.zeros_like(seg_img1)
+        seg_img3 = np.zeros_like(seg_img1)
+        seg_img1[:4, :4] = 7
+        seg_img2[:4, :4] = 9
+        seg_img3[4:, 4:] = 5  # Disappeared from the last frame
+        for result in alignment.align(seg_img1, seg_img2, seg_img3):
+            self.assertFalse(result.any())
+
+
+if __name__ == '__main__':
+    absltest.main()
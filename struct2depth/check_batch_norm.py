@@ -0,0 +1,118 @@
+
+"""Regression check between training-mode and inference-mode batch norm in the depth test graph.
+
+Runs the same checkpoint twice, once computing batch statistics from every input batch and once
+with the stored moving statistics, and reports how much the depth predictions and timings differ.
+"""
+
+# Example usage:
+#
+# python check_batch_norm.py \
+#    --model_ckpt ~/struct2depth/model/model-199160 \
+#    --input_dir ~/struct2depth/triplets \
+#    --num_frames 50
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import os
+import sys
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+import tensorflow as tf
+
+ROOT_DIR = os.path.abspath("/mnt/isaac_2019_2/apps/carter_sim_struct2depth/struct2depth")
+sys.path.append(ROOT_DIR)
+import model
+import nets
+import util
+
+flags.DEFINE_string('model_ckpt', None, 'Model checkpoint to check.')
+flags.DEFINE_string('input_dir', None, 'Directory with images to run on. Random images are used if not set.')
+flags.DEFINE_string('file_extension', 'png', 'Image data file extension of files in input_dir.')
+flags.DEFINE_integer('num_frames', 50, 'Number of frames to compare.')
+flags.DEFINE_integer('img_height', 128, 'Input frame height.')
+flags.DEFINE_integer('img_width', 416, 'Input frame width.')
+flags.DEFINE_enum('architecture', nets.RESNET, nets.ARCHITECTURES,
+                  'Defines the architecture to use for the depth prediction network.')
+flags.DEFINE_boolean('imagenet_norm', True, 'Whether to normalize the input images channel-wise.')
+flags.DEFINE_bool('use_skip', True, 'Whether to use skip connections in the encoder-decoder architecture.')
+flags.DEFINE_float('max_relative_error', 0.05, 'Mean relative depth difference above which the '
+                                               'check fails.')
+
+FLAGS = flags.FLAGS
+
+flags.mark_flag_as_required('model_ckpt')
+
+
+def _load_frames():
+    """Returns a list of [1, H, W, 3] float images in the range 0-1."""
+    if FLAGS.input_dir is None:
+        rng = np.random.RandomState(0)
+        return [rng.uniform(size=(1, FLAGS.img_height, FLAGS.img_width, 3)).astype(np.float32)
+                for _ in range(FLAGS.num_frames)]
+    im_files = sorted(glob.glob(os.path.join(FLAGS.input_dir, '*.' + FLAGS.file_extension)))
+    im_files = [f for f in im_files if '-seg' not in f and '-fseg' not in f][:FLAGS.num_frames]
+    if not im_files:
+        raise ValueError('No images found in %s.' % FLAGS.input_dir)
+    return [np.expand_dims(util.load_image(f, resize=(FLAGS.img_width, FLAGS.img_height)), axis=0)
+            for f in im_files]
+
+
+def run_depth(frames, inference_batch_norm):
+    """Returns the depth predictions and the latency histogram of one batch norm mode."""
+    name = 'inference_bn' if inference_batch_norm else 'training_bn'
+    with tf.Graph().as_default():
+        inference_model = model.Model(is_training=False,
+                                      batch_size=1,
+                                      img_height=FLAGS.img_height,
+                                      img_width=FLAGS.img_width,
+                                      architecture=FLAGS.architecture,
+                                      imagenet_norm=FLAGS.imagenet_norm,
+                                      use_skip=FLAGS.use_skip,
+                                      joint_encoder=False,
+                                      inference_batch_norm=inference_batch_norm)
+        vars_to_restore = util.get_vars_to_save_and_restore(FLAGS.model_ckpt)
+        saver = tf.train.Saver(vars_to_restore)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            saver.restore(sess, FLAGS.model_ckpt)
+            inference_model.inference_depth(frames[0], sess)  # Warm up
+            latency = util.LatencyHistogram(name)
+            depths = []
+            for frame in frames:
+                with latency.measure():
+                    depths.append(inference_model.inference_depth(frame, sess))
+    return depths, latency
+
+
+def main(_):
+    frames = _load_frames()
+    training_depths, training_latency = run_depth(frames, inference_batch_norm=False)
+    inference_depths, inference_latency = run_depth(frames, inference_batch_norm=True)
+
+    abs_diff = np.array([np.mean(np.abs(a - b)) for a, b in zip(training_depths, inference_depths)])
+    rel_diff = np.array([np.mean(np.abs(a - b) / a) for a, b in zip(training_depths, inference_depths)])
+    logging.info('Compared %d frames.', len(frames))
+    logging.info('Mean absolute depth difference: %.4f (max over frames %.4f)',
+                 abs_diff.mean(), abs_diff.max())
+    logging.info('Mean relative depth difference: %.4f (max over frames %.4f)',
+                 rel_diff.mean(), rel_diff.max())
+    logging.info(training_latency.summary())
+    logging.info(inference_latency.summary())
+    logging.info('Speedup: %.2fx', training_latency.mean() / max(inference_latency.mean(), 1e-6))
+
+    if rel_diff.mean() > FLAGS.max_relative_error:
+        logging.error('Inference-mode batch norm deviates by more than %.3f. The moving statistics '
+                      'of this checkpoint may not be trained, use --noinference_batch_norm.',
+                      FLAGS.max_relative_error)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,133 @@
+
+"""Memory mapped cache of a decoded saved-images dataset.
+
+Online refinement and overfit experiments train many epochs on a few thousand triplets. Instead of decoding
+every png again each epoch, the triplets and seg masks are decoded once into uint8 .npy arrays, together
+with a float32 array of the camera matrices, and read back through memory maps. Reads are slices of the
+maps, so nothing is decoded or copied before the data reaches TensorFlow.
+
+The cache is keyed by a fingerprint of the names, sizes and modification times of the source files and of
+the decoded image size. If the source directory changes, the cache is rebuilt the next time it is opened.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+FINGERPRINT_FILE = 'fingerprint.txt'  # Written last, so a cache without it is incomplete
+IMAGES_FILE = 'images.npy'
+SEG_MASKS_FILE = 'seg_masks.npy'
+INTRINSICS_FILE = 'intrinsics.npy'
+CACHE_VERSION = 2  # Part of the fingerprint, increased whenever the decoding changes
+
+
+def list_saved_images(data_dir):
+    """Returns the paired triplet, seg mask and intrinsics paths in data_dir, e.g. 1.png, 1-fseg.png, 1_cam.csv.
+
+    The seg mask and intrinsics paths are derived from the name of each triplet. Numbered triplets are
+    sorted by number. Raises ValueError if a triplet lacks its seg mask or intrinsics.
+    """
+    def sort_key(path):
+        stem = os.path.basename(path)[:-len('.png')]
+        return (0, int(stem), stem) if stem.isdigit() else (1, 0, stem)
+
+    image_paths = sorted((f for f in glob.glob(data_dir + '/*.png') if not f.endswith('-fseg.png')),
+                         key=sort_key)
+    seg_paths = []
+    intrinsics_paths = []
+    for path in image_paths:
+        stem = path[:-len('.png')]
+        seg_path = stem + '-fseg.png'
+        intrinsics_path = stem + '_cam.csv'
+        for paired_path in [seg_path, intrinsics_path]:
+            if not os.path.exists(paired_path):
+                raise ValueError('Missing {} for triplet {}.'.format(paired_path, path))
+        seg_paths.append(seg_path)
+        intrinsics_paths.append(intrinsics_path)
+    return image_paths, seg_paths, intrinsics_paths
+
+
+def fingerprint(paths, height, width):
+    sha = hashlib.sha1('{} {}x{}'.format(CACHE_VERSION, height, width).encode())
+    for path in paths:
+        stat = os.stat(path)
+        sha.update('\n{} {} {}'.format(os.path.basename(path), stat.st_size, stat.st_mtime_ns).encode())
+    return sha.hexdigest()
+
+
+class DatasetCache(object):
+    """Decoded triplets of data_dir at height x width, cached in cache_dir.
+
+    Opening builds the cache if it is missing or its fingerprint does not match the source files.
+    """
+
+    def __init__(self, data_dir, cache_dir, height, width):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.height = height
+        self.width = width
+
+        paths = list_saved_images(data_dir)
+        key = fingerprint([path for group in paths for path in group], height, width)
+        if self.read_fingerprint() != key:
+            self.build(*paths)
+            with open(os.path.join(cache_dir, FINGERPRINT_FILE), 'w') as f:
+                f.write(key)
+
+        self.images = np.load(os.path.join(cache_dir, IMAGES_FILE), mmap_mode='r')
+        self.seg_masks = np.load(os.path.join(cache_dir, SEG_MASKS_FILE), mmap_mode='r')
+        self.intrinsics = np.load(os.path.join(cache_dir, INTRINSICS_FILE))
+
+    def read_fingerprint(self):
+        path = os.path.join(self.cache_dir, FINGERPRINT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read().strip()
+
+    # Decodes every triplet and seg mask into the memory mapped arrays.
+    def build(self, image_paths, seg_paths, intrinsics_paths):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        fingerprint_path = os.path.join(self.cache_dir, FINGERPRINT_FILE)
+        if os.path.exists(fingerprint_path):
+            os.remove(fingerprint_path)
+
+        shape = (len(image_paths), self.height, self.width, 3)
+        images = np.lib.format.open_memmap(os.path.join(self.cache_dir, IMAGES_FILE), mode='w+',
+                                           dtype=np.uint8, shape=shape)
+        seg_masks = np.lib.format.open_memmap(os.path.join(self.cache_dir, SEG_MASKS_FILE), mode='w+',
+                                              dtype=np.uint8, shape=shape)
+        for i, (image_path, seg_path) in enumerate(zip(image_paths, seg_paths)):
+            images[i] = self.load(image_path)
+            seg_masks[i] = self.load(seg_path, cv2.INTER_NEAREST)
+        images.flush()
+        seg_masks.flush()
+        del images, seg_masks
+
+        intrinsics = np.zeros((len(intrinsics_paths), 3, 3), dtype=np.float32)
+        for i, path in enumerate(intrinsics_paths):
+            intrinsics[i] = np.loadtxt(path, delimiter=',', dtype=np.float32).reshape(3, 3)
+        np.save(os.path.join(self.cache_dir, INTRINSICS_FILE), intrinsics)
+
+    # Decodes a png as RGB at the cache size. Seg masks are resized with INTER_NEAREST, so instance ids
+    # are not blended at mask boundaries.
+    def load(self, path, interpolation=cv2.INTER_LINEAR):
+        image = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+        if image.shape[:2] != (self.height, self.width):
+            image = cv2.resize(image, (self.width, self.height), interpolation=interpolation)
+        return image
+
+    def __len__(self):
+        return len(self.images)
+
+    def read(self, index):
+        """Returns the image triplet, seg mask triplet and camera matrix of triplet index."""
+        return self.images[index], self.seg_masks[index], self.intrinsics[index]
@@ -0,0 +1,94 @@
+
+"""Tests for the decoded dataset cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+
+from absl.testing import absltest
+import cv2
+import numpy as np
+
+import dataset_cache
+
+HEIGHT = 4
+WIDTH = 12
+
+
+class DatasetCacheTest(absltest.TestCase):
+
+    def setUp(self):
+        super(DatasetCacheTest, self).setUp()
+        self.data_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.data_dir, 'cache')
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.rng = np.random.RandomState(0)
+
+    # Saves a triplet like save_image_triplets.py and returns its RGB image, seg mask and camera matrix.
+    def save_triplet(self, name, height=HEIGHT, width=WIDTH):
+        image = self.rng.randint(0, 256, size=(height, width, 3)).astype(np.uint8)
+        seg_image = np.zeros((height, width, 3), dtype=np.uint8)
+        seg_image[:height // 2 + 1, :width // 2 + 1] = self.rng.randint(1, 256)
+        intrinsics = self.rng.rand(3, 3).astype(np.float32)
+        cv2.imwrite(os.path.join(self.data_dir, name + '.png'), image[:, :, ::-1])
+        cv2.imwrite(os.path.join(self.data_dir, name + '-fseg.png'), seg_image[:, :, ::-1])
+        np.savetxt(os.path.join(self.data_dir, name + '_cam.csv'), intrinsics.reshape(1, 9), delimiter=',')
+        return image, seg_image, intrinsics
+
+    def test_list_saved_images_sorts_by_number(self):
+        for name in ['10', '2', '1']:
+            self.save_triplet(name)
+        image_paths, seg_paths, intrinsics_paths = dataset_cache.list_saved_images(self.data_dir)
+        self.assertEqual([os.path.basename(path) for path in image_paths], ['1.png', '2.png', '10.png'])
+        self.assertEqual([os.path.basename(path) for path in seg_paths],
+                         ['1-fseg.png', '2-fseg.png', '10-fseg.png'])
+        self.assertEqual([os.path.basename(path) for path in intrinsics_paths],
+                         ['1_cam.csv', '2_cam.csv', '10_cam.csv'])
+
+    def test_list_saved_images_missing_seg_mask_raises(self):
+        self.save_triplet('0')
+        self.save_triplet('1')
+        os.remove(os.path.join(self.data_dir, '1-fseg.png'))
+        with self.assertRaisesRegex(ValueError, '1-fseg.png'):
+            dataset_cache.list_saved_images(self.data_dir)
+
+    def test_round_trip(self):
+        triplets = [self.save_triplet(str(i)) for i in range(3)]
+        cache = dataset_cache.DatasetCache(self.data_dir, self.cache_dir, HEIGHT, WIDTH)
+        self.assertLen(cache, 3)
+        for i, (image, seg_image, intrinsics) in enumerate(triplets):
+            read_image, read_seg_image, read_intrinsics = cache.read(i)
+            np.testing.assert_array_equal(read_image, image)
+            np.testing.assert_array_equal(read_seg_image, seg_image)
+            np.testing.assert_allclose(read_intrinsics, intrinsics)
+
+    def test_reopening_reuses_cache(self):
+        self.save_triplet('0')
+        dataset_cache.DatasetCache(self.data_dir, self.cache_dir, HEIGHT, WIDTH)
+        images_path = os.path.join(self.cache_dir, dataset_cache.IMAGES_FILE)
+        mtime = os.stat(images_path).st_mtime_ns
+        dataset_cache.DatasetCache(self.data_dir, self.cache_dir, HEIGHT, WIDTH)
+        self.assertEqual(os.stat(images_path).st_mtime_ns, mtime)
+
+    def test_changed_source_rebuilds_cache(self):
+        self.save_triplet('0')
+        dataset_cache.DatasetCache(self.data_dir, self.cache_dir, HEIGHT, WIDTH)
+        image, _, _ = self.save_triplet('1')
+        cache = dataset_cache.DatasetCache(self.data_dir, self.cache_dir, HEIGHT, WIDTH)
+        self.assertLen(cache, 2)
+        np.testing.assert_array_equal(cache.read(1)[0], image)
+
+    def test_seg_masks_are_not_blended(self):
+        _, seg_image, _ = self.save_triplet('0', height=2 * HEIGHT, width=2 * WIDTH)
+        cache = dataset_cache.DatasetCache(self.data_dir, self.cache_dir, HEIGHT, WIDTH)
+        _, read_seg_image, _ = cache.read(0)
+        self.assertEqual(read_seg_image.shape, (HEIGHT, WIDTH, 3))
+        np.testing.assert_array_equal(np.unique(read_seg_image), np.unique(seg_image))
+
+
+if __name__ == '__main__':
+    absltest.main()
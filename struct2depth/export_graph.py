@@ -0,0 +1,194 @@
+
+"""Exports a frozen, constant-folded inference graph of a trained struct2depth model."""
+
+# Example usage:
+#
+# python export_graph.py \
+#    --model_ckpt ~/struct2depth/model/model-199160 \
+#    --output_graph ~/struct2depth/model/model-199160.pb \
+#    --benchmark_frames 100
+#
+# Load the result with frozen_model.FrozenModel, or pass it to inference.py with
+# --frozen_graph.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import sys
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+ROOT_DIR = os.path.abspath("/mnt/isaac_2019_2/apps/carter_sim_struct2depth/struct2depth")
+sys.path.append(ROOT_DIR)
+import frozen_model
+import model
+import nets
+import util
+
+gfile = tf.gfile
+
+# Graph transforms applied after freezing. Batch norm is folded into the preceding convolution
+# weights, which requires the moving statistics (--inference_batch_norm).
+TRANSFORMS = [
+    'remove_nodes(op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+    'fold_constants(ignore_errors=true)',
+    'sort_by_execution_order',
+]
+
+flags.DEFINE_string('model_ckpt', None, 'Model checkpoint to export.')
+flags.DEFINE_string('output_graph', None, 'Path of the frozen graph to write. Tensor names are '
+                                          'written to the same path with a .json suffix.')
+flags.DEFINE_integer('batch_size', 1, 'The size of a sample batch of the depth network.')
+flags.DEFINE_integer('img_height', 128, 'Input frame height.')
+flags.DEFINE_integer('img_width', 416, 'Input frame width.')
+flags.DEFINE_integer('seq_length', 3, 'Number of frames in sequence.')
+flags.DEFINE_enum('architecture', nets.RESNET, nets.ARCHITECTURES,
+                  'Defines the architecture to use for the depth prediction network.')
+flags.DEFINE_boolean('imagenet_norm', True, 'Whether to normalize the input images channel-wise.')
+flags.DEFINE_bool('use_skip', True, 'Whether to use skip connections in the encoder-decoder architecture.')
+flags.DEFINE_bool('joint_encoder', False, 'Whether the depth and egomotion networks share an encoder.')
+flags.DEFINE_bool('inference_batch_norm', True, 'Whether batch norm uses the stored moving statistics. '
+                                                 'Required for batch norm to be folded into the convolutions.')
+flags.DEFINE_bool('handle_motion', False, 'Whether to export the object motion network as well.')
+flags.DEFINE_integer('benchmark_frames', 0, 'If > 0, compares startup and per-frame time of the '
+                                            'checkpoint and the frozen graph on this many frames.')
+
+FLAGS = flags.FLAGS
+
+flags.mark_flag_as_required('model_ckpt')
+flags.mark_flag_as_required('output_graph')
+
+
+def _model_kwargs():
+    return dict(is_training=False,
+                batch_size=FLAGS.batch_size,
+                img_height=FLAGS.img_height,
+                img_width=FLAGS.img_width,
+                seq_length=FLAGS.seq_length,
+                architecture=FLAGS.architecture,
+                imagenet_norm=FLAGS.imagenet_norm,
+                use_skip=FLAGS.use_skip,
+                joint_encoder=FLAGS.joint_encoder,
+                handle_motion=FLAGS.handle_motion,
+                inference_batch_norm=FLAGS.inference_batch_norm)
+
+
+def _node_name(tensor_name):
+    return tensor_name.split(':')[0]
+
+
+def _restore_model(model_ckpt):
+    """Builds the test graphs in the default graph and restores the checkpoint."""
+    inference_model = model.Model(**_model_kwargs())
+    vars_to_restore = util.get_vars_to_save_and_restore(model_ckpt)
+    saver = tf.train.Saver(vars_to_restore)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    saver.restore(sess, model_ckpt)
+    return inference_model, sess
+
+
+def export_graph(model_ckpt, output_graph):
+    """Freezes the test graphs of a checkpoint and writes them to output_graph."""
+    with tf.Graph().as_default() as graph:
+        inference_model, sess = _restore_model(model_ckpt)
+        inputs = {'depth': inference_model.input_image.name,
+                  'depth_uint8': inference_model.input_image_uint8.name,
+                  'egomotion': inference_model.input_image_stack.name,
+                  'egomotion_normalized': inference_model.input_image_stack_normalized.name}
+        outputs = {'depth': inference_model.est_depth.name,
+                   'depth_net_input': inference_model.depth_net_input.name,
+                   'egomotion': inference_model.est_egomotion.name}
+        if FLAGS.joint_encoder:
+            inputs['live_camera_index'] = inference_model.live_camera_index.name
+            inputs['live_cached_bottlenecks'] = inference_model.live_cached_bottlenecks.name
+            outputs['live_bottleneck'] = inference_model.live_bottleneck.name
+            outputs['egomotion_live'] = inference_model.est_egomotion_live.name
+        if FLAGS.handle_motion:
+            inputs['objectmotion'] = inference_model.input_image_stack_om.name
+            outputs['objectmotion'] = inference_model.est_objectmotion.name
+        input_nodes = [_node_name(name) for name in inputs.values()]
+        output_nodes = [_node_name(name) for name in outputs.values()]
+
+        # Replaces variables with constants and prunes everything the outputs do not depend on
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            sess, graph.as_graph_def(), output_nodes)
+        sess.close()
+    logging.info('Frozen graph has %d nodes.', len(graph_def.node))
+
+    graph_def = TransformGraph(graph_def, input_nodes, output_nodes, TRANSFORMS)
+    logging.info('Transformed graph has %d nodes.', len(graph_def.node))
+
+    with gfile.GFile(output_graph, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    metadata = {'inputs': inputs,
+                'outputs': outputs,
+                'batch_size': FLAGS.batch_size,
+                'img_height': FLAGS.img_height,
+                'img_width': FLAGS.img_width,
+                'seq_length': FLAGS.seq_length,
+                'model_ckpt': model_ckpt}
+    with gfile.Open(output_graph + frozen_model.METADATA_SUFFIX, 'w') as f:
+        json.dump(metadata, f, indent=2, sort_keys=True)
+    logging.info('Frozen graph written to %s.', output_graph)
+
+
+def _benchmark_frames(name, inference_model, sess, num_frames):
+    """Times the depth network on random frames. Returns (mean wall ms, mean CPU ms)."""
+    inputs = np.random.uniform(size=(FLAGS.batch_size, FLAGS.img_height, FLAGS.img_width, 3))
+    inference_model.inference_depth(inputs, sess)  # Warm up
+    latency = util.LatencyHistogram(name)
+    cpu_start = time.process_time()
+    for _ in range(num_frames):
+        with latency.measure():
+            inference_model.inference_depth(inputs, sess)
+    cpu_ms = (time.process_time() - cpu_start) * 1000.0 / num_frames
+    logging.info(latency.summary())
+    return latency.mean(), cpu_ms
+
+
+def benchmark(model_ckpt, frozen_graph, num_frames):
+    """Compares startup and per-frame time of the checkpoint and the frozen graph."""
+    results = {}
+
+    with tf.Graph().as_default():
+        start, cpu_start = time.time(), time.process_time()
+        inference_model, sess = _restore_model(model_ckpt)
+        startup = (time.time() - start, time.process_time() - cpu_start)
+        results['checkpoint'] = startup + _benchmark_frames('checkpoint', inference_model, sess, num_frames)
+        sess.close()
+
+    start, cpu_start = time.time(), time.process_time()
+    inference_model = frozen_model.FrozenModel(frozen_graph)
+    sess = inference_model.session()
+    startup = (time.time() - start, time.process_time() - cpu_start)
+    results['frozen'] = startup + _benchmark_frames('frozen', inference_model, sess, num_frames)
+    sess.close()
+
+    logging.info('%-10s %12s %12s %14s %14s', 'path', 'startup [s]', 'startup CPU',
+                 'frame [ms]', 'frame CPU [ms]')
+    for name in ['checkpoint', 'frozen']:
+        logging.info('%-10s %12.2f %12.2f %14.2f %14.2f', name, *results[name])
+    return results
+
+
+def main(_):
+    export_graph(FLAGS.model_ckpt, FLAGS.output_graph)
+    if FLAGS.benchmark_frames > 0:
+        benchmark(FLAGS.model_ckpt, FLAGS.output_graph, FLAGS.benchmark_frames)
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,71 @@
+
+"""Selects training sequences from a stream of camera frames by robot motion.
+
+Frames are spaced by the distance and rotation the differential base travelled since the previous
+selected frame, taken from its odometry history (see odometry.py), instead of by a fixed time delay.
+Frames taken while the robot barely moves are skipped, so sequences have enough disparity to learn depth,
+and no wall time is spent sleeping when the robot moves fast.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Maximum time between two frames of the same sequence, in seconds. Longer gaps mean the robot stopped,
+# so the sequence is no longer consecutive and is discarded.
+MAX_INTERVAL = 2.0
+
+
+class FrameSelector(object):
+    """Buffers timestamped frames with odometry and returns sequences of seq_length frames.
+
+    A frame is selected once the robot has moved min_translation meters or turned min_rotation radians
+    since the previous selected frame.
+    """
+
+    def __init__(self, seq_length=3, min_translation=0.1, min_rotation=0.1, max_interval=MAX_INTERVAL):
+        self.seq_length = seq_length
+        self.min_translation = min_translation
+        self.min_rotation = min_rotation
+        self.max_interval = max_interval
+        self.members = []  # Selected frames of the sequence in progress
+        self.last_member = None  # Odometry of the last selected frame
+        self.skipped = 0
+        self.discarded_sequences = 0
+
+    # Selector matching a fixed time delay at the given threshold speeds, as used by the previous
+    # time-based sampling.
+    @classmethod
+    def from_time_delay(cls, seq_length, time_delay, speed_threshold, angular_speed_threshold):
+        return cls(seq_length,
+                   min_translation=speed_threshold * time_delay,
+                   min_rotation=angular_speed_threshold * time_delay)
+
+    # Adds a frame with the odometry.Odometry at its timestamp. Returns a list of seq_length frames once
+    # a sequence is complete, otherwise None.
+    def add(self, frame, state):
+        if self.members and state.timestamp - self.last_member.timestamp > self.max_interval:
+            self.members = []
+            self.discarded_sequences += 1
+
+        # The odometry history restarts from zero with the codelet
+        if self.last_member is not None and state.distance < self.last_member.distance:
+            self.last_member = None
+
+        if self.last_member is None:
+            selected = state.speed != 0 or state.angular_speed != 0
+        else:
+            selected = (state.distance - self.last_member.distance >= self.min_translation or
+                        state.rotation - self.last_member.rotation >= self.min_rotation)
+        if not selected:
+            self.skipped += 1
+            return None
+
+        self.members.append(frame)
+        self.last_member = state
+        if len(self.members) < self.seq_length:
+            return None
+
+        sequence = self.members
+        self.members = []
+        return sequence
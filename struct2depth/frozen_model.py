@@ -0,0 +1,105 @@
+
+"""Loads a frozen inference graph written by export_graph.py.
+
+FrozenModel offers the same inference_* interface as model.Model, but does not rebuild the
+network from Python or restore a checkpoint, which makes startup much cheaper.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+
+from absl import logging
+import tensorflow as tf
+
+gfile = tf.gfile
+
+# Tensor names are stored next to the graph in <graph>.json
+METADATA_SUFFIX = '.json'
+
+
+class FrozenModel(object):
+    """Frozen depth, egomotion and (optionally) object motion networks."""
+
+    def __init__(self, graph_path):
+        with gfile.Open(graph_path + METADATA_SUFFIX, 'r') as f:
+            self.metadata = json.load(f)
+        graph_def = tf.GraphDef()
+        with gfile.GFile(graph_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+        self.batch_size = self.metadata['batch_size']
+        self.img_height = self.metadata['img_height']
+        self.img_width = self.metadata['img_width']
+        self.seq_length = self.metadata['seq_length']
+        self.input_image = self._tensor('inputs', 'depth')
+        self.input_image_uint8 = self._tensor('inputs', 'depth_uint8')
+        self.est_depth = self._tensor('outputs', 'depth')
+        self.depth_net_input = self._tensor('outputs', 'depth_net_input')
+        self.input_image_stack = self._tensor('inputs', 'egomotion')
+        self.input_image_stack_normalized = self._tensor('inputs', 'egomotion_normalized')
+        self.est_egomotion = self._tensor('outputs', 'egomotion')
+        self.live_camera_index = self._tensor('inputs', 'live_camera_index')
+        self.live_cached_bottlenecks = self._tensor('inputs', 'live_cached_bottlenecks')
+        self.live_bottleneck = self._tensor('outputs', 'live_bottleneck')
+        self.est_egomotion_live = self._tensor('outputs', 'egomotion_live')
+        self.input_image_stack_om = self._tensor('inputs', 'objectmotion')
+        self.est_objectmotion = self._tensor('outputs', 'objectmotion')
+        logging.info('Loaded frozen graph %s with %d nodes.', graph_path, len(graph_def.node))
+
+    def _tensor(self, kind, key):
+        name = self.metadata[kind].get(key)
+        if name is None:
+            return None
+        return self.graph.get_tensor_by_name(name)
+
+    def session(self, config=None):
+        """Returns a session for the frozen graph. No variables need to be restored."""
+        return tf.Session(graph=self.graph, config=config)
+
+    def inference_depth(self, inputs, sess):
+        return sess.run(self.est_depth, feed_dict={self.input_image: inputs})
+
+    def inference_depth_uint8(self, inputs, sess):
+        """Runs depth on raw uint8 frames of shape [B, h, w, 3], resized in-graph."""
+        return sess.run(self.est_depth, feed_dict={self.input_image_uint8: inputs})
+
+    def inference_depth_uint8_normalized(self, inputs, sess):
+        """Like inference_depth_uint8, but also returns the resized and normalized frames."""
+        return sess.run([self.est_depth, self.depth_net_input],
+                        feed_dict={self.input_image_uint8: inputs})
+
+    def inference_depth_uint8_bottleneck(self, inputs, camera_index, sess):
+        """Runs depth on raw uint8 frames and returns the bottleneck of frame camera_index."""
+        return sess.run([self.est_depth, self.live_bottleneck],
+                        feed_dict={self.input_image_uint8: inputs,
+                                   self.live_camera_index: camera_index})
+
+    def inference_depth_egomotion_live(self, inputs, cached_bottlenecks, camera_index, sess):
+        """Runs depth and the egomotion of frame camera_index on cached embeddings."""
+        return sess.run([self.est_depth, self.est_egomotion_live, self.live_bottleneck],
+                        feed_dict={self.input_image_uint8: inputs,
+                                   self.live_cached_bottlenecks: cached_bottlenecks,
+                                   self.live_camera_index: camera_index})
+
+    def inference_egomotion(self, inputs, sess):
+        return sess.run(
+            self.est_egomotion, feed_dict={self.input_image_stack: inputs})
+
+    def inference_egomotion_normalized(self, inputs, sess):
+        """Runs egomotion on frames that are already resized and normalized."""
+        return sess.run(
+            self.est_egomotion, feed_dict={self.input_image_stack_normalized: inputs})
+
+    def inference_objectmotion(self, inputs, sess):
+        if self.est_objectmotion is None:
+            raise ValueError('The frozen graph was exported without object motion, '
+                             're-export with --handle_motion.')
+        return sess.run(
+            self.est_objectmotion, feed_dict={self.input_image_stack_om: inputs})
@@ -44,7 +44,9 @@ sys.path.append(ROOT_DIR)
 import model
 import numpy as np
 import fnmatch
+import frozen_model
 import nets
+import quantized_model
 import util
 
 gfile = tf.gfile
@@ -77,6 +79,9 @@ flags.DEFINE_bool('egomotion', False, 'Determines if the egomotion prediction '
                                       'sequence, and sorting them alphabetically establishes the '
                                       'right temporal order.')
 flags.DEFINE_string('model_ckpt', None, 'Model checkpoint to evaluate.')
+flags.DEFINE_string('frozen_graph', None, 'Frozen graph written by export_graph.py. If set, it is '
+                                          'used instead of model_ckpt and the model flags are taken '
+                                          'from the export.')
 flags.DEFINE_string('input_dir', None, 'Directory containing image files to '
                                        'evaluate. This crawls recursively for images in the '
                                        'directory, mirroring relative subdirectory structures '
@@ -103,6 +108,13 @@ flags.DEFINE_bool('joint_encoder', False, 'Whether to share parameters '
                                           'encoder architecture. The egomotion network is then '
                                           'operating only on the hidden representation provided by the '
                                           'joint encoder.')
+flags.DEFINE_string('quantized_model', None, 'Output prefix of quantize.py. If set, the quantized '
+                                             'TFLite networks are run on CPU instead of model_ckpt.')
+flags.DEFINE_enum('quantize_mode', quantized_model.QUANTIZE_INT8, quantized_model.QUANTIZE_MODES,
+                  'Which quantized networks to use with --quantized_model.')
+flags.DEFINE_bool('inference_batch_norm', True, 'Whether batch norm uses the moving statistics '
+                                                 'stored in the checkpoint. If disabled, statistics are '
+                                                 'computed from every input batch like during training.')
 flags.DEFINE_bool('shuffle', False, 'Whether to shuffle the order in which '
                                     'images are processed.')
 flags.DEFINE_bool('flip', False, 'Whether images should be flipped as well as '
@@ -150,22 +162,46 @@ def _run_inference(output_dir=None,
                    flip_for_depth=False,
                    inference_mode=INFERENCE_MODE_SINGLE,
                    inference_crop=INFERENCE_CROP_NONE,
-                   use_masks=False):
+                   use_masks=False,
+                   frozen_graph=None,
+                   inference_batch_norm=True,
+                   quantized_prefix=None,
+                   quantize_mode=quantized_model.QUANTIZE_INT8):
     """Runs inference. Refer to flags in inference.py for details."""
-    inference_model = model.Model(is_training=False,
-                                  batch_size=batch_size,
-                                  img_height=img_height,
-                                  img_width=img_width,
-                                  seq_length=seq_length,
-                                  architecture=architecture,
-                                  imagenet_norm=imagenet_norm,
-                                  use_skip=use_skip,
-                                  joint_encoder=joint_encoder)
-    vars_to_restore = util.get_vars_to_save_and_restore(model_ckpt)
-    saver = tf.train.Saver(vars_to_restore)
-    sv = tf.train.Supervisor(logdir='/tmp/', saver=None)
-    with sv.managed_session() as sess:
-        saver.restore(sess, model_ckpt)
+    if quantized_prefix is not None:
+        inference_model = quantized_model.QuantizedModel(quantized_prefix, quantize_mode)
+        batch_size = inference_model.batch_size
+        img_height = inference_model.img_height
+        img_width = inference_model.img_width
+        if inference_model.seq_length is not None:
+            seq_length = inference_model.seq_length
+        session = inference_model.session()
+    elif frozen_graph is not None:
+        # The network and its weights are already in the graph, nothing to build or restore.
+        inference_model = frozen_model.FrozenModel(frozen_graph)
+        batch_size = inference_model.batch_size
+        img_height = inference_model.img_height
+        img_width = inference_model.img_width
+        seq_length = inference_model.seq_length
+        session = inference_model.session()
+    else:
+        inference_model = model.Model(is_training=False,
+                                      batch_size=batch_size,
+                                      img_height=img_height,
+                                      img_width=img_width,
+                                      seq_length=seq_length,
+                                      architecture=architecture,
+                                      imagenet_norm=imagenet_norm,
+                                      use_skip=use_skip,
+                                      joint_encoder=joint_encoder,
+                                      inference_batch_norm=inference_batch_norm)
+        vars_to_restore = util.get_vars_to_save_and_restore(model_ckpt)
+        saver = tf.train.Saver(vars_to_restore)
+        sv = tf.train.Supervisor(logdir='/tmp/', saver=None)
+        session = sv.managed_session()
+    with session as sess:
+        if frozen_graph is None and quantized_prefix is None:
+            saver.restore(sess, model_ckpt)
         if not gfile.Exists(output_dir):
             gfile.MakeDirs(output_dir)
         logging.info('Predictions will be saved in %s.', output_dir)
@@ -235,8 +271,9 @@ def _run_inference(output_dir=None,
         # Run egomotion network.
         if egomotion:
             if inference_mode == INFERENCE_MODE_SINGLE:
-                # Run regular egomotion inference loop.
-                input_image_seq = []
+                # Run regular egomotion inference loop. Every image is loaded once and shifted
+                # through the window.
+                window = util.FrameWindow(seq_length)
                 input_seg_seq = []
                 current_sequence_dir = None
                 current_output_handle = None
@@ -252,9 +289,9 @@ def _run_inference(output_dir=None,
                         current_sequence_dir = sequence_dir
                         logging.info('Writing egomotion sequence to %s.', output_filepath)
                         current_output_handle = gfile.Open(output_filepath, 'w')
-                        input_image_seq = []
-                    im = util.load_image(im_files[i], resize=(img_width, img_height))
-                    input_image_seq.append(im)
+                        window.reset()
+                        input_seg_seq = []
+                    window.push(util.load_image(im_files[i], resize=(img_width, img_height)))
                     if use_masks:
                         im_seg_path = im_files[i].replace('.%s' % file_extension,
                                                           '-seg.%s' % file_extension)
@@ -266,15 +303,13 @@ def _run_inference(output_dir=None,
                                                              resize=(img_width, img_height),
                                                              interpolation='nn'))
 
-                    if len(input_image_seq) < seq_length:  # Buffer not filled yet.
-                        continue
-                    if len(input_image_seq) > seq_length:  # Remove oldest entry.
-                        del input_image_seq[0]
-                        if use_masks:
+                        if len(input_seg_seq) > seq_length:  # Remove oldest entry.
                             del input_seg_seq[0]
 
-                    input_image_stack = np.concatenate(input_image_seq, axis=2)
-                    input_image_stack = np.expand_dims(input_image_stack, axis=0)
+                    if not window.full():  # Buffer not filled yet.
+                        continue
+
+                    input_image_stack = window.stack
                     if use_masks:
                         input_image_stack = mask_image_stack(input_image_stack,
                                                              input_seg_seq)
@@ -418,7 +453,11 @@ def main(_):
                        flip_for_depth=FLAGS.flip,
                        inference_mode=FLAGS.inference_mode,
                        inference_crop=FLAGS.inference_crop,
-                       use_masks=FLAGS.use_masks)
+                       use_masks=FLAGS.use_masks,
+                       frozen_graph=FLAGS.frozen_graph,
+                       inference_batch_norm=FLAGS.inference_batch_norm,
+                       quantized_prefix=FLAGS.quantized_model,
+                       quantize_mode=FLAGS.quantize_mode)
 
 
 def run_inference_experiment():
@@ -486,7 +525,8 @@ def run_inference_experiment():
                                flip_for_depth=FLAGS.flip,
                                inference_mode=FLAGS.inference_mode,
                                inference_crop=FLAGS.inference_crop,
-                               use_masks=FLAGS.use_masks)
+                               use_masks=FLAGS.use_masks,
+                               inference_batch_norm=FLAGS.inference_batch_norm)
 
 
 if __name__ == '__main__':
@@ -83,7 +83,9 @@ class Model(object):
                  speed_threshold=0.25,
                  angular_speed_threshold=0.25,
                  optimize=False,
-                 num_steps=0):
+                 num_steps=0,
+                 inference_batch_norm=True,
+                 cache_dir=None):
         self.data_dir = data_dir
         self.using_saved_images = using_saved_images
         self.file_extension = file_extension
@@ -124,6 +126,8 @@ class Model(object):
         self.angular_speed_threshold = angular_speed_threshold
         self.optimize = optimize
         self.repetitions = num_steps
+        self.inference_batch_norm = inference_batch_norm
+        self.cache_dir = cache_dir
 
         logging.info('data_dir: %s', data_dir)
         logging.info('using_saved_images: %s', using_saved_images)
@@ -158,6 +162,8 @@ class Model(object):
         logging.info('handle_motion: %s', handle_motion)
         logging.info('equal_weighting: %s', equal_weighting)
         logging.info('train_global_scale_var: %s', train_global_scale_var)
+        logging.info('inference_batch_norm: %s', inference_batch_norm)
+        logging.info('cache_dir: %s', cache_dir)
 
         if self.size_constraint_weight > 0 or not is_training:
             self.global_scale_var = tf.Variable(
@@ -183,7 +189,8 @@ class Model(object):
                                                              self.shuffle,
                                                              self.isaac_app,
                                                              self.optimize,
-                                                             self.repetitions)
+                                                             self.repetitions,
+                                                             self.cache_dir)
             else:
                 # Read data directly from Isaac Sim.
                 self.reader = reader.DataReader(self.batch_size,
@@ -208,6 +215,8 @@ class Model(object):
         else:
             self.build_depth_test_graph()
             self.build_egomotion_test_graph()
+            if self.joint_encoder:
+                self.build_joint_live_graph()
             if self.handle_motion:
                 self.build_objectmotion_test_graph()
 
@@ -829,18 +838,33 @@ class Model(object):
     def build_depth_test_graph(self):
         """Builds depth model reading from placeholders."""
         with tf.variable_scope('depth_prediction'):
-            input_image = tf.placeholder(
-                tf.float32, [self.batch_size, self.img_height, self.img_width, 3],
+            # Raw uint8 frames of any resolution can be fed directly; scaling to 0-1 and resizing
+            # happen in-graph. Feeding raw_input instead bypasses this path.
+            input_image_uint8 = tf.placeholder_with_default(
+                tf.zeros([self.batch_size, self.img_height, self.img_width, 3], dtype=tf.uint8),
+                [self.batch_size, None, None, 3],
+                name='raw_input_uint8')
+            resized_image = tf.image.resize_bilinear(
+                tf.cast(input_image_uint8, tf.float32) / 255.0, [self.img_height, self.img_width])
+            input_image = tf.placeholder_with_default(
+                resized_image, [self.batch_size, self.img_height, self.img_width, 3],
                 name='raw_input')
+            # Keep a handle on the unnormalized input so that feeding it still applies ImageNet norm.
+            net_input = input_image
             if self.imagenet_norm:
-                input_image = (input_image - reader.IMAGENET_MEAN) / reader.IMAGENET_SD
-            est_disp, _ = nets.disp_net(architecture=self.architecture,
-                                        image=input_image,
-                                        use_skip=self.use_skip,
-                                        weight_reg=self.weight_reg,
-                                        is_training=True)
+                net_input = (input_image - reader.IMAGENET_MEAN) / reader.IMAGENET_SD
+            # With inference_batch_norm, batch norm uses the stored moving statistics and runs
+            # as a fused op instead of computing statistics of every input batch.
+            est_disp, bottleneck = nets.disp_net(architecture=self.architecture,
+                                                 image=net_input,
+                                                 use_skip=self.use_skip,
+                                                 weight_reg=self.weight_reg,
+                                                 is_training=not self.inference_batch_norm)
         est_depth = 1.0 / est_disp[0]
+        self.input_image_uint8 = input_image_uint8
         self.input_image = input_image
+        self.depth_net_input = net_input
+        self.depth_bottleneck = bottleneck
         self.est_depth = est_depth
 
     def build_egomotion_test_graph(self):
@@ -851,12 +875,19 @@ class Model(object):
             name='raw_input')
         input_bottleneck_stack = None
 
+        # Keep a handle on the unnormalized input so that feeding it still applies ImageNet norm.
+        # Frames that are already normalized, e.g. by the depth graph, can be fed to
+        # normalized_input instead.
+        normalized_stack = input_image_stack
         if self.imagenet_norm:
             im_mean = tf.tile(
                 tf.constant(reader.IMAGENET_MEAN), multiples=[self.seq_length])
             im_sd = tf.tile(
                 tf.constant(reader.IMAGENET_SD), multiples=[self.seq_length])
-            input_image_stack = (input_image_stack - im_mean) / im_sd
+            normalized_stack = (input_image_stack - im_mean) / im_sd
+        normalized_stack = tf.placeholder_with_default(
+            normalized_stack, [1, self.img_height, self.img_width, self.seq_length * 3],
+            name='normalized_input')
 
         if self.joint_encoder:
             # Pre-compute embeddings here.
@@ -864,25 +895,53 @@ class Model(object):
                 input_bottleneck_stack = []
                 encoder_selected = nets.encoder(self.architecture)
                 for i in range(self.seq_length):
-                    input_image = input_image_stack[:, :, :, i * 3:(i + 1) * 3]
+                    input_image = normalized_stack[:, :, :, i * 3:(i + 1) * 3]
                     tf.get_variable_scope().reuse_variables()
                     embedding, _ = encoder_selected(
                         target_image=input_image,
                         weight_reg=self.weight_reg,
-                        is_training=True)
+                        is_training=not self.inference_batch_norm)
                     input_bottleneck_stack.append(embedding)
                 input_bottleneck_stack = tf.concat(input_bottleneck_stack, axis=3)
 
         with tf.variable_scope('egomotion_prediction'):
             est_egomotion = nets.egomotion_net(
-                image_stack=input_image_stack,
+                image_stack=normalized_stack,
                 disp_bottleneck_stack=input_bottleneck_stack,
                 joint_encoder=self.joint_encoder,
                 seq_length=self.seq_length,
                 weight_reg=self.weight_reg)
         self.input_image_stack = input_image_stack
+        self.input_image_stack_normalized = normalized_stack
         self.est_egomotion = est_egomotion
 
+    def build_joint_live_graph(self):
+        """Builds egomotion on top of the depth graph for streaming inference.
+
+        The bottleneck of one frame of the depth batch is concatenated with the
+        embeddings of the previous seq_length - 1 frames, which are fed back from a
+        cache. Depth and egomotion then run in one pass and every frame is encoded
+        exactly once.
+        """
+        camera_index = tf.placeholder_with_default(0, [], name='live_camera_index')
+        bottleneck = tf.gather(self.depth_bottleneck, [camera_index])
+        _, height, width, channels = self.depth_bottleneck.get_shape().as_list()
+        cached_bottlenecks = tf.placeholder(
+            tf.float32, [1, height, width, channels * (self.seq_length - 1)],
+            name='cached_bottlenecks')
+        bottleneck_stack = tf.concat([cached_bottlenecks, bottleneck], axis=3)
+        with tf.variable_scope('egomotion_prediction', reuse=True):
+            est_egomotion = nets.egomotion_net(
+                image_stack=None,
+                disp_bottleneck_stack=bottleneck_stack,
+                joint_encoder=True,
+                seq_length=self.seq_length,
+                weight_reg=self.weight_reg)
+        self.live_camera_index = camera_index
+        self.live_bottleneck = bottleneck
+        self.live_cached_bottlenecks = cached_bottlenecks
+        self.est_egomotion_live = est_egomotion
+
     def build_objectmotion_test_graph(self):
         """Builds egomotion model reading from placeholders."""
         input_image_stack_om = tf.placeholder(
@@ -890,16 +949,18 @@ class Model(object):
             [1, self.img_height, self.img_width, self.seq_length * 3],
             name='raw_input')
 
+        # Keep a handle on the unnormalized input so that feeding it still applies ImageNet norm.
+        normalized_stack_om = input_image_stack_om
         if self.imagenet_norm:
             im_mean = tf.tile(
                 tf.constant(reader.IMAGENET_MEAN), multiples=[self.seq_length])
             im_sd = tf.tile(
                 tf.constant(reader.IMAGENET_SD), multiples=[self.seq_length])
-            input_image_stack_om = (input_image_stack_om - im_mean) / im_sd
+            normalized_stack_om = (input_image_stack_om - im_mean) / im_sd
 
         with tf.variable_scope('objectmotion_prediction'):
             est_objectmotion = nets.objectmotion_net(
-                image_stack=input_image_stack_om,
+                image_stack=normalized_stack_om,
                 disp_bottleneck_stack=None,
                 joint_encoder=self.joint_encoder,
                 seq_length=self.seq_length,
@@ -910,10 +971,41 @@ class Model(object):
     def inference_depth(self, inputs, sess):
         return sess.run(self.est_depth, feed_dict={self.input_image: inputs})
 
+    def inference_depth_uint8(self, inputs, sess):
+        """Runs depth on raw uint8 frames of shape [B, h, w, 3], resized in-graph."""
+        return sess.run(self.est_depth, feed_dict={self.input_image_uint8: inputs})
+
+    def inference_depth_uint8_normalized(self, inputs, sess):
+        """Like inference_depth_uint8, but also returns the resized and normalized frames."""
+        return sess.run([self.est_depth, self.depth_net_input],
+                        feed_dict={self.input_image_uint8: inputs})
+
+    def inference_depth_uint8_bottleneck(self, inputs, camera_index, sess):
+        """Runs depth on raw uint8 frames and returns the bottleneck of frame camera_index."""
+        return sess.run([self.est_depth, self.live_bottleneck],
+                        feed_dict={self.input_image_uint8: inputs,
+                                   self.live_camera_index: camera_index})
+
+    def inference_depth_egomotion_live(self, inputs, cached_bottlenecks, camera_index, sess):
+        """Runs depth and the egomotion of frame camera_index on cached embeddings.
+
+        Returns depth, egomotion and the new bottleneck of that frame, which has to
+        be added to the cache for the next frames.
+        """
+        return sess.run([self.est_depth, self.est_egomotion_live, self.live_bottleneck],
+                        feed_dict={self.input_image_uint8: inputs,
+                                   self.live_cached_bottlenecks: cached_bottlenecks,
+                                   self.live_camera_index: camera_index})
+
     def inference_egomotion(self, inputs, sess):
         return sess.run(
             self.est_egomotion, feed_dict={self.input_image_stack: inputs})
 
+    def inference_egomotion_normalized(self, inputs, sess):
+        """Runs egomotion on frames that are already resized and normalized."""
+        return sess.run(
+            self.est_egomotion, feed_dict={self.input_image_stack_normalized: inputs})
+
     def inference_objectmotion(self, inputs, sess):
         return sess.run(
             self.est_objectmotion, feed_dict={self.input_image_stack_om: inputs})
@@ -0,0 +1,214 @@
+
+"""Shared-memory odometry history of the differential base.
+
+The DifferentialBaseState codelet appends every odometry message to a fixed-size ring of records in a
+memory mapped file in /dev/shm. Besides the speeds, each record holds the pose integrated from them and
+the distance and rotation travelled in total, so consumers can ask what the motion of the robot was when a
+frame was captured, or how far it moved between two frames, without polling at message rate. Timestamps
+in the ring are increasing, so lookups are a binary search.
+
+The ring is guarded by a seqlock: the writer makes the sequence counter odd while it updates the ring and
+even again afterwards, and readers retry until they see the same even counter before and after reading,
+so they never return a torn record.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import math
+import mmap
+import os
+import struct
+import tempfile
+
+from absl import logging
+import numpy as np
+
+# Shared memory is used when available, otherwise the ring lives in the temp directory
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+ODOMETRY_FILE = os.path.join(SHM_DIR, 'carter_sim_struct2depth_odometry')
+
+# Number of records kept, about 40 seconds of odometry at 100 Hz
+CAPACITY = 4096
+
+# File layout: sequence counter and number of records written so far, then the ring of records
+HEADER_FORMAT = '<QQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+Odometry = collections.namedtuple('Odometry', ['timestamp', 'speed', 'angular_speed',
+                                               'x', 'y', 'heading', 'distance', 'rotation'])
+RECORD_SIZE = len(Odometry._fields)
+TIMESTAMP = Odometry._fields.index('timestamp')
+HEADING = Odometry._fields.index('heading')
+
+# A lookup more than this many seconds after the latest record means the writer stopped publishing
+STALE_AFTER = 1.0
+
+# Reported before the codelet published anything
+STANDING_STILL = Odometry(*([0.0] * RECORD_SIZE))
+
+
+def _file_size(capacity):
+    return HEADER_SIZE + capacity * RECORD_SIZE * 8
+
+
+class OdometryWriter(object):
+    """Integrates odometry messages and appends them to the ring. There must only be one writer."""
+
+    def __init__(self, path=ODOMETRY_FILE, capacity=CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, _file_size(capacity))
+            self.buffer = mmap.mmap(fd, _file_size(capacity))
+        finally:
+            os.close(fd)
+        self.records = np.frombuffer(self.buffer, dtype=np.float64, offset=HEADER_SIZE).reshape(capacity,
+                                                                                               RECORD_SIZE)
+        # A restarted writer starts a new history
+        self.sequence = struct.unpack_from(HEADER_FORMAT, self.buffer, 0)[0] & ~1
+        self.count = 0
+        self.last = None
+        struct.pack_into(HEADER_FORMAT, self.buffer, 0, self.sequence, self.count)
+
+    # Appends the speeds at timestamp and the pose integrated since the previous message.
+    def write(self, timestamp, speed, angular_speed):
+        if self.last is None:
+            x, y, heading, distance, rotation = 0.0, 0.0, 0.0, 0.0, 0.0
+        else:
+            dt = max(timestamp - self.last.timestamp, 0.0)
+            x = self.last.x + speed * math.cos(self.last.heading) * dt
+            y = self.last.y + speed * math.sin(self.last.heading) * dt
+            heading = _wrap(self.last.heading + angular_speed * dt)
+            distance = self.last.distance + abs(speed) * dt
+            rotation = self.last.rotation + abs(angular_speed) * dt
+        self.last = Odometry(timestamp, speed, angular_speed, x, y, heading, distance, rotation)
+
+        struct.pack_into(HEADER_FORMAT, self.buffer, 0, self.sequence + 1, self.count)  # Odd: in progress
+        self.records[self.count % self.capacity] = self.last
+        self.count += 1
+        self.sequence += 2
+        struct.pack_into(HEADER_FORMAT, self.buffer, 0, self.sequence, self.count)
+
+    def close(self):
+        self.records = None
+        self.buffer.close()
+
+
+class OdometryReader(object):
+    """Reads the odometry history. Until the writer created it, the robot stands still."""
+
+    def __init__(self, path=ODOMETRY_FILE, max_retries=1000):
+        self.path = path
+        self.max_retries = max_retries
+        self.buffer = None
+        self.records = None
+        self.sequence = 0  # Sequence counter of the last read, increases with every update
+        self.last = STANDING_STILL
+        self.warned = False  # Whether the current gap in the history was already reported
+
+    def _open(self):
+        # The writer may not have created or sized the file yet
+        if (self.buffer is None and os.path.exists(self.path) and
+                os.path.getsize(self.path) >= _file_size(1)):
+            with open(self.path, 'rb') as f:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            capacity = (len(self.buffer) - HEADER_SIZE) // (RECORD_SIZE * 8)
+            self.records = np.frombuffer(self.buffer, dtype=np.float64, offset=HEADER_SIZE,
+                                         count=capacity * RECORD_SIZE).reshape(capacity, RECORD_SIZE)
+        return self.buffer is not None
+
+    # Runs read_fn(count) between two reads of an unchanged, even sequence counter and returns its result.
+    # Returns default if the writer kept updating or has not written yet.
+    def _consistent(self, read_fn, default):
+        if not self._open():
+            return default
+        for _ in range(self.max_retries):
+            sequence, count = struct.unpack_from(HEADER_FORMAT, self.buffer, 0)
+            if sequence & 1:
+                continue
+            result = read_fn(count) if count > 0 else default
+            if struct.unpack_from(HEADER_FORMAT, self.buffer, 0)[0] == sequence:
+                self.sequence = sequence
+                return result
+        return default
+
+    # Returns the latest Odometry. If the writer keeps updating while reading, the previous state is kept.
+    def read(self):
+        def latest(count):
+            return Odometry(*self.records[(count - 1) % len(self.records)].tolist())
+
+        self.last = self._consistent(latest, self.last)
+        return self.last
+
+    # Returns the Odometry at timestamp, interpolated between the two closest records. Timestamps after
+    # the latest record return the latest one. Returns None if timestamp is older than the history.
+    def lookup(self, timestamp):
+        return self._consistent(lambda count: self._lookup(timestamp, count), None)
+
+    def _lookup(self, timestamp, count):
+        capacity = len(self.records)
+        times = self.records[:, TIMESTAMP]
+        # The ring holds two sorted runs, the older one starts at the oldest record
+        oldest = count % capacity if count > capacity else 0
+        size = min(count, capacity)
+        if timestamp < times[oldest]:
+            return None
+        if oldest > 0 and timestamp >= times[0]:
+            i = np.searchsorted(times[:oldest], timestamp, side='right') - 1 + (capacity - oldest)
+        else:
+            i = np.searchsorted(times[oldest:min(oldest + size, capacity)], timestamp, side='right') - 1
+        before = self.records[(oldest + i) % capacity]
+        if i == size - 1:
+            return Odometry(*before.tolist())
+
+        after = self.records[(oldest + i + 1) % capacity]
+        dt = after[TIMESTAMP] - before[TIMESTAMP]
+        w = (timestamp - before[TIMESTAMP]) / dt if dt > 0 else 0.0
+        state = before + w * (after - before)
+        state[HEADING] = _wrap(before[HEADING] + w * _wrap(after[HEADING] - before[HEADING]))
+        state[TIMESTAMP] = timestamp
+        return Odometry(*state.tolist())
+
+    # Like lookup, but reports a standing robot if there is no history at timestamp. Warns once per gap if
+    # the history is missing or the latest record is more than STALE_AFTER older than timestamp.
+    def state_at(self, timestamp):
+        state = self.lookup(timestamp)
+        if state is None:
+            self._warn('No odometry history at %.3f in %s, is the DifferentialBaseState codelet running? '
+                       'Assuming the robot stands still.', timestamp, self.path)
+            return STANDING_STILL
+        if timestamp - state.timestamp > STALE_AFTER:
+            self._warn('Latest odometry in %s is %.1f s older than the frame at %.3f, is the '
+                       'DifferentialBaseState codelet running?', self.path, timestamp - state.timestamp,
+                       timestamp)
+        else:
+            self.warned = False
+        return state
+
+    def _warn(self, *args):
+        if not self.warned:
+            logging.warning(*args)
+            self.warned = True
+
+    # Returns the distance and rotation travelled between two timestamps, or None if either is older than
+    # the history.
+    def motion_between(self, start, end):
+        first = self.lookup(start)
+        second = self.lookup(end)
+        if first is None or second is None:
+            return None
+        return second.distance - first.distance, second.rotation - first.rotation
+
+    def close(self):
+        if self.buffer is not None:
+            self.records = None
+            self.buffer.close()
+            self.buffer = None
+
+
+def _wrap(angle):
+    return math.atan2(math.sin(angle), math.cos(angle))
@@ -0,0 +1,107 @@
+
+"""Tests for the shared-memory odometry history."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import os
+import shutil
+import tempfile
+
+from absl.testing import absltest
+
+import odometry
+
+
+class OdometryTest(absltest.TestCase):
+
+    def setUp(self):
+        super(OdometryTest, self).setUp()
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.path = os.path.join(temp_dir, 'odometry')
+        self.reader = odometry.OdometryReader(self.path)
+        self.addCleanup(self.reader.close)
+
+    # Writes one record per second from t = 0 while driving at 1 m/s and turning at angular_speed.
+    def write(self, num_records, capacity=odometry.CAPACITY, angular_speed=0.0):
+        writer = odometry.OdometryWriter(self.path, capacity)
+        self.addCleanup(writer.close)
+        for t in range(num_records):
+            writer.write(float(t), 1.0, angular_speed)
+        return writer
+
+    def test_no_writer_stands_still(self):
+        self.assertIsNone(self.reader.lookup(1.0))
+        self.assertEqual(self.reader.state_at(1.0), odometry.STANDING_STILL)
+        self.assertEqual(self.reader.read(), odometry.STANDING_STILL)
+
+    def test_read_returns_latest(self):
+        self.write(5)
+        state = self.reader.read()
+        self.assertEqual(state.timestamp, 4.0)
+        self.assertAlmostEqual(state.distance, 4.0)
+
+    def test_lookup_interpolates(self):
+        self.write(5)
+        state = self.reader.lookup(2.25)
+        self.assertEqual(state.timestamp, 2.25)
+        self.assertAlmostEqual(state.distance, 2.25)
+        self.assertAlmostEqual(state.x, 2.25)
+
+    def test_lookup_interpolates_heading_across_wrap(self):
+        self.write(4, angular_speed=3.0)
+        # Heading is 3 after one second and wraps to 6 - 2 pi after two
+        state = self.reader.lookup(1.5)
+        self.assertAlmostEqual(state.heading, odometry._wrap(4.5))
+        self.assertAlmostEqual(state.rotation, 4.5)
+
+    def test_lookup_after_latest_returns_latest(self):
+        self.write(5)
+        self.assertEqual(self.reader.lookup(10.0).timestamp, 4.0)
+
+    def test_lookup_older_than_history(self):
+        self.write(20, capacity=8)
+        self.assertIsNone(self.reader.lookup(11.5))
+        self.assertEqual(self.reader.state_at(11.5), odometry.STANDING_STILL)
+
+    def test_lookup_across_ring_wrap(self):
+        self.write(20, capacity=8)
+        for t in [12.0, 14.5, 15.5, 16.0, 18.75, 19.0]:
+            state = self.reader.lookup(t)
+            self.assertEqual(state.timestamp, t)
+            self.assertAlmostEqual(state.distance, t)
+
+    def test_motion_between(self):
+        self.write(10, angular_speed=0.5)
+        distance, rotation = self.reader.motion_between(2.0, 5.5)
+        self.assertAlmostEqual(distance, 3.5)
+        self.assertAlmostEqual(rotation, 1.75)
+        self.assertIsNone(self.reader.motion_between(-1.0, 5.0))
+
+    def test_state_at_warns_once_per_gap(self):
+        self.write(5)
+        with self.assertLogs(level='WARNING') as logs:
+            self.reader.state_at(4.0 + 2 * odometry.STALE_AFTER)
+            self.reader.state_at(4.0 + 3 * odometry.STALE_AFTER)
+        self.assertLen(logs.output, 1)
+        self.reader.state_at(3.5)
+        self.assertFalse(self.reader.warned)
+
+    def test_restarted_writer_starts_new_history(self):
+        self.write(10)
+        self.reader.read()
+        sequence = self.reader.sequence
+        self.write(3)
+        state = self.reader.read()
+        self.assertEqual(state.timestamp, 2.0)
+        self.assertGreater(self.reader.sequence, sequence)
+
+    def test_wrap(self):
+        self.assertAlmostEqual(odometry._wrap(3 * math.pi / 2), -math.pi / 2)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -1,6 +1,9 @@
 
 """ Takes 3 images in a sequence and creates one big image with all 3 aligned. """
 
+import time
+
+from absl import logging
 import numpy as np
 import cv2
 import tensorflow as tf
@@ -14,25 +17,42 @@ SEQ_LENGTH = 3
 WIDTH = 416
 HEIGHT = 128
 
+# Camera resolution in bridge_config/carter_full_config.json
+NATIVE_WIDTH = 960
+NATIVE_HEIGHT = 540
+
 class ImageProcessor:
-    def __init__(self):
-        bla = 0
+    # reuse_buffers: return the same output arrays on every call. Only safe if the caller is done with a
+    # triplet before requesting the next one.
+    def __init__(self, reuse_buffers=False):
+        self.reuse_buffers = reuse_buffers
+        self.triplet_buffer = None
         # self.mask_generator = MaskGenerator()
 
-
-    def create_triplet(self, images):
-        ORIGINAL_HEIGHT, ORIGINAL_WIDTH, _, = images[0].shape
-
-        big_img = np.zeros(shape=(HEIGHT, WIDTH*SEQ_LENGTH, 3))
-        wct = 0
-
-        for img in images:
-
-            if img.shape is not (HEIGHT, WIDTH):
+        # Seg masks are all zeros until the mask generator is enabled, so one read-only canvas is shared
+        self.empty_seg_triplet = np.zeros(shape=(HEIGHT, WIDTH*SEQ_LENGTH, 3), dtype=np.uint8)
+        self.empty_seg_triplet.flags.writeable = False
+
+    # Returns a uint8 output array for a triplet, either out, the reused buffer, or a new array.
+    def get_triplet_buffer(self, out=None):
+        if out is not None:
+            return out
+        if not self.reuse_buffers:
+            return np.empty(shape=(HEIGHT, WIDTH*SEQ_LENGTH, 3), dtype=np.uint8)
+        if self.triplet_buffer is None:
+            self.triplet_buffer = np.empty(shape=(HEIGHT, WIDTH*SEQ_LENGTH, 3), dtype=np.uint8)
+        return self.triplet_buffer
+
+    # Composes the images side by side into a [HEIGHT, WIDTH * SEQ_LENGTH, 3] uint8 image. Images are only
+    # resized if they do not have the network size already.
+    def create_triplet(self, images, out=None):
+        big_img = self.get_triplet_buffer(out)
+
+        for wct, img in enumerate(images):
+            if img.shape[:2] != (HEIGHT, WIDTH):
                 img = cv2.resize(img, (WIDTH, HEIGHT))
 
             big_img[:, wct * WIDTH:(wct + 1) * WIDTH] = img
-            wct += 1
 
         return big_img
 
@@ -53,14 +73,33 @@ class ImageProcessor:
 
         # Align seg_masks
         # seg_list[0], seg_list[1], seg_list[2] = align(seg_list[0], seg_list[1], seg_list[2])
-        big_seg_img = np.zeros(shape=(HEIGHT, WIDTH*SEQ_LENGTH, 3))
 
         # Create seg_mask triplet
+        # big_seg_img = np.empty(shape=(HEIGHT, WIDTH*SEQ_LENGTH, 3), dtype=np.uint8)
         # for k in range(0, 3):
         #     big_seg_img[:, k * WIDTH:(k + 1) * WIDTH] = seg_list[k]
 
-        return big_seg_img
+        return self.empty_seg_triplet
 
 
     def process_image(self, images):
         return self.create_triplet(images), self.create_mask_triplet(images)
+
+
+# Times create_triplet on random frames of the network size and of the native camera size.
+def benchmark(iterations=200):
+    for reuse_buffers in [False, True]:
+        img_processor = ImageProcessor(reuse_buffers=reuse_buffers)
+        for height, width in [(HEIGHT, WIDTH), (NATIVE_HEIGHT, NATIVE_WIDTH)]:
+            images = [np.random.randint(0, 256, size=(height, width, 3), dtype=np.uint8)
+                      for _ in range(SEQ_LENGTH)]
+            start = time.time()
+            for _ in range(iterations):
+                img_processor.process_image(images)
+            logging.info('%dx%d input, reuse_buffers=%s: %.3f ms per triplet',
+                         width, height, reuse_buffers, (time.time() - start) / iterations * 1000)
+
+
+if __name__ == '__main__':
+    logging.set_verbosity(logging.INFO)
+    benchmark()
@@ -0,0 +1,186 @@
+
+"""Post-training quantization of a frozen struct2depth graph for CPU inference.
+
+Converts the depth and egomotion networks of a graph written by export_graph.py to TensorFlow
+Lite with float16 or int8 weights. Int8 activations are calibrated on saved image triplets.
+Afterwards the float32 graph and every quantized model are evaluated on held-out triplets with
+depth_evaluation_utils.compute_errors, so accuracy can be traded against latency.
+"""
+
+# Example usage:
+#
+# python quantize.py \
+#    --frozen_graph ~/struct2depth/model/model-199160.pb \
+#    --triplet_dir ~/struct2depth/triplets \
+#    --output_prefix ~/struct2depth/model/model-199160 \
+#    --modes float16,int8
+#
+# Ground truth depth can be given with --gt_dir, otherwise the float32 predictions are used as the
+# reference. Ground truth is read as 16-bit depth PNGs divided by --gt_depth_scale, or as metric .npy
+# arrays, and is evaluated at its own resolution with zero pixels treated as invalid.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import os
+import sys
+
+from absl import app
+from absl import flags
+from absl import logging
+import cv2
+import numpy as np
+import tensorflow as tf
+
+ROOT_DIR = os.path.abspath("/mnt/isaac_2019_2/apps/carter_sim_struct2depth/struct2depth")
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.dirname(ROOT_DIR))
+import frozen_model
+import quantized_model
+import util
+from depth_evaluation_utils import compute_errors
+
+gfile = tf.gfile
+
+ERROR_NAMES = ['abs_rel', 'sq_rel', 'rmse', 'rmse_log', 'a1', 'a2', 'a3']
+
+flags.DEFINE_string('frozen_graph', None, 'Frozen graph written by export_graph.py.')
+flags.DEFINE_string('triplet_dir', None, 'Directory of saved image triplets used for calibration '
+                                         'and evaluation.')
+flags.DEFINE_string('output_prefix', None, 'Prefix of the written .tflite files.')
+flags.DEFINE_list('modes', quantized_model.QUANTIZE_MODES, 'Quantization modes to convert and evaluate.')
+flags.DEFINE_bool('egomotion', True, 'Whether to convert the egomotion network as well.')
+flags.DEFINE_integer('num_calibration', 100, 'Number of triplets used to calibrate int8 activations.')
+flags.DEFINE_integer('num_eval', 100, 'Number of held-out triplets used for the accuracy report.')
+flags.DEFINE_string('gt_dir', None, 'Optional ground truth depth images, paired with the evaluation '
+                                    'triplets in sorted order.')
+flags.DEFINE_float('gt_depth_scale', 256.0, 'Ground truth PNG values per meter, 256 for KITTI depth maps.')
+flags.DEFINE_float('min_depth', 1e-3, 'Threshold for minimum depth.')
+flags.DEFINE_float('max_depth', 80, 'Threshold for maximum depth.')
+flags.DEFINE_integer('num_threads', None, 'Number of CPU threads of the TFLite interpreter.')
+
+FLAGS = flags.FLAGS
+
+flags.mark_flag_as_required('frozen_graph')
+flags.mark_flag_as_required('triplet_dir')
+flags.mark_flag_as_required('output_prefix')
+
+
+def load_triplets(triplet_dir, img_height, img_width):
+    """Returns sorted triplets as [1, H, W, 9] float images in the range 0-1."""
+    files = sorted(f for f in glob.glob(os.path.join(triplet_dir, '*.png')) if '-fseg' not in f)
+    triplets = []
+    for f in files:
+        im = util.load_image(f, resize=(img_width * 3, img_height))
+        triplets.append(np.concatenate(
+            [im[:, :img_width], im[:, img_width:img_width * 2], im[:, img_width * 2:]], axis=2)[None])
+    return triplets
+
+
+def _middle_frame(triplet):
+    return triplet[:, :, :, 3:6]
+
+
+def convert(frozen_graph, metadata, network, mode, calibration):
+    """Converts one network of the frozen graph. Returns the TFLite flatbuffer."""
+    input_name = metadata['inputs'][network].split(':')[0]
+    output_name = metadata['outputs'][network].split(':')[0]
+    if network == 'depth':
+        shape = [metadata['batch_size'], metadata['img_height'], metadata['img_width'], 3]
+    else:
+        shape = [1, metadata['img_height'], metadata['img_width'], metadata['seq_length'] * 3]
+    converter = tf.lite.TFLiteConverter.from_frozen_graph(
+        frozen_graph, [input_name], [output_name], input_shapes={input_name: shape})
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == quantized_model.QUANTIZE_FLOAT16:
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == quantized_model.QUANTIZE_INT8:
+        def representative_dataset():
+            for triplet in calibration:
+                sample = _middle_frame(triplet) if network == 'depth' else triplet
+                yield [np.repeat(sample, shape[0], axis=0).astype(np.float32)]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def load_gt_depth(path):
+    """Returns a ground truth depth map in meters at its original resolution."""
+    if path.endswith('.npy'):
+        return np.load(path).astype(np.float32)
+    # Keep 16-bit values; the default imread would convert them to 8-bit color
+    return cv2.imread(path, cv2.IMREAD_ANYDEPTH).astype(np.float32) / FLAGS.gt_depth_scale
+
+
+def _errors(gt, pred):
+    """compute_errors on valid pixels, with median scaling as in eval_depth_orig.py. The prediction is
+    resized to the ground truth resolution, so invalid ground truth pixels are never interpolated."""
+    gt = np.squeeze(gt)
+    pred = np.squeeze(pred)
+    if pred.shape != gt.shape:
+        pred = cv2.resize(pred, (gt.shape[1], gt.shape[0]))
+    mask = np.logical_and(gt > FLAGS.min_depth, gt < FLAGS.max_depth)
+    pred = pred * np.median(gt[mask]) / np.median(pred[mask])
+    pred = np.clip(pred, FLAGS.min_depth, FLAGS.max_depth)
+    return np.array(compute_errors(gt[mask], pred[mask]))
+
+
+def evaluate(name, inference_fn, frames, references):
+    """Returns mean errors against the references and the latency histogram."""
+    latency = util.LatencyHistogram(name)
+    errors = []
+    for frame, reference in zip(frames, references):
+        with latency.measure():
+            depth = inference_fn(frame)
+        errors.append(_errors(reference, depth[:1]))
+    return np.mean(errors, axis=0), latency
+
+
+def main(_):
+    float_model = frozen_model.FrozenModel(FLAGS.frozen_graph)
+    triplets = load_triplets(FLAGS.triplet_dir, float_model.img_height, float_model.img_width)
+    if len(triplets) < 2:
+        raise ValueError('Need at least two triplets in %s.' % FLAGS.triplet_dir)
+    num_calibration = min(FLAGS.num_calibration, len(triplets) // 2)
+    calibration = triplets[:num_calibration]
+    eval_frames = [np.repeat(_middle_frame(triplet), float_model.batch_size, axis=0)
+                   for triplet in triplets[num_calibration:num_calibration + FLAGS.num_eval]]
+    logging.info('Calibrating on %d triplets, evaluating on %d.', len(calibration), len(eval_frames))
+
+    networks = ['depth', 'egomotion'] if FLAGS.egomotion else ['depth']
+    for mode in FLAGS.modes:
+        for network in networks:
+            tflite_model = convert(FLAGS.frozen_graph, float_model.metadata, network, mode, calibration)
+            suffix = (quantized_model.DEPTH_SUFFIX if network == 'depth'
+                      else quantized_model.EGOMOTION_SUFFIX)
+            path = FLAGS.output_prefix + suffix.format(mode)
+            with gfile.GFile(path, 'wb') as f:
+                f.write(tflite_model)
+            logging.info('Wrote %s (%.1f MB).', path, len(tflite_model) / 1e6)
+
+    # Accuracy report
+    with float_model.session() as sess:
+        float_depths = [float_model.inference_depth(frame, sess) for frame in eval_frames]
+        if FLAGS.gt_dir is not None:
+            gt_files = sorted(glob.glob(os.path.join(FLAGS.gt_dir, '*')))[num_calibration:]
+            references = [load_gt_depth(f) for f in gt_files[:len(eval_frames)]]
+        else:
+            references = [depth[:1] for depth in float_depths]
+        results = [('float32',) + evaluate('float32', lambda x: float_model.inference_depth(x, sess),
+                                           eval_frames, references)]
+    for mode in FLAGS.modes:
+        model = quantized_model.QuantizedModel(FLAGS.output_prefix, mode, FLAGS.num_threads)
+        results.append((mode,) + evaluate(mode, model.inference_depth, eval_frames, references))
+
+    logging.info('Reference: %s', 'ground truth' if FLAGS.gt_dir is not None else 'float32 predictions')
+    logging.info(('{:>10}' * (len(ERROR_NAMES) + 3)).format('mode', *(ERROR_NAMES + ['mean ms', 'p90 ms'])))
+    for mode, errors, latency in results:
+        logging.info('{:>10}'.format(mode) + ''.join('{:10.4f}'.format(e) for e in errors) +
+                     '{:10.2f}{:10.2f}'.format(latency.mean(), latency.percentile(90)))
+
+
+if __name__ == '__main__':
+    app.run(main)
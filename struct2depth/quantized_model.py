@@ -0,0 +1,93 @@
+
+"""Runs the TensorFlow Lite depth and egomotion networks written by quantize.py.
+
+QuantizedModel offers the same inference_* interface as model.Model, so it can replace it on
+CPU-only robots. The sess arguments are accepted for compatibility and ignored.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import os
+
+from absl import logging
+import numpy as np
+import tensorflow as tf
+
+# Files written by quantize.py for an output prefix and a quantization mode
+DEPTH_SUFFIX = '.depth.{}.tflite'
+EGOMOTION_SUFFIX = '.egomotion.{}.tflite'
+
+QUANTIZE_FLOAT16 = 'float16'  # Float16 weights, float32 compute
+QUANTIZE_INT8 = 'int8'  # Int8 weights and activations, calibrated on saved triplets
+QUANTIZE_MODES = [QUANTIZE_FLOAT16, QUANTIZE_INT8]
+
+
+class _Interpreter(object):
+    """A TFLite interpreter with a single input and output."""
+
+    def __init__(self, path, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(model_path=path)
+        if num_threads is not None and hasattr(self.interpreter, 'set_num_threads'):
+            self.interpreter.set_num_threads(num_threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        logging.info('Loaded %s with input %s %s.', path, self.input['shape'], self.input['dtype'].__name__)
+
+    def run(self, inputs):
+        inputs = np.asarray(inputs)
+        if self.input['dtype'] != np.float32:
+            # Fully quantized input, map the float image onto the quantized range
+            scale, zero_point = self.input['quantization']
+            inputs = np.round(inputs / scale + zero_point)
+            info = np.iinfo(self.input['dtype'])
+            inputs = np.clip(inputs, info.min, info.max)
+        self.interpreter.set_tensor(self.input['index'], inputs.astype(self.input['dtype']))
+        self.interpreter.invoke()
+        outputs = self.interpreter.get_tensor(self.output['index'])
+        if self.output['dtype'] != np.float32:
+            scale, zero_point = self.output['quantization']
+            outputs = (outputs.astype(np.float32) - zero_point) * scale
+        return outputs
+
+
+class QuantizedModel(object):
+    """Quantized depth and (optionally) egomotion networks."""
+
+    def __init__(self, prefix, mode=QUANTIZE_INT8, num_threads=None):
+        if mode not in QUANTIZE_MODES:
+            raise ValueError('Unknown quantization mode: {}'.format(mode))
+        self.mode = mode
+        self.depth = _Interpreter(prefix + DEPTH_SUFFIX.format(mode), num_threads)
+        self.egomotion = None
+        if os.path.exists(prefix + EGOMOTION_SUFFIX.format(mode)):
+            self.egomotion = _Interpreter(prefix + EGOMOTION_SUFFIX.format(mode), num_threads)
+        self.batch_size, self.img_height, self.img_width, _ = self.depth.input['shape']
+        # The egomotion network takes the frames of a sequence stacked along the channels
+        self.seq_length = None
+        if self.egomotion is not None:
+            self.seq_length = self.egomotion.input['shape'][3] // 3
+
+    def session(self, config=None):
+        """TFLite needs no session. Returned for interface compatibility with model.Model users."""
+        del config
+        return contextlib.closing(_NoSession())
+
+    def inference_depth(self, inputs, sess=None):
+        del sess
+        return self.depth.run(inputs)
+
+    def inference_egomotion(self, inputs, sess=None):
+        del sess
+        if self.egomotion is None:
+            raise ValueError('No quantized egomotion network found for mode %s.' % self.mode)
+        return self.egomotion.run(inputs)
+
+
+class _NoSession(object):
+
+    def close(self):
+        pass
@@ -26,12 +26,14 @@ from __future__ import print_function
 from absl import logging
 import tensorflow as tf
 import numpy as np
-import csv
+import queue
+import threading
 import time
 
 # Struct2depth imports
 import util
-# from isaac_app import create_sample_bridge
+from frame_selector import FrameSelector
+from odometry import OdometryReader
 from process_image import ImageProcessor
 
 # Automatically parallelize tf.mapping function to maximize efficiency
@@ -55,6 +57,9 @@ FLIP_RANDOM = 'random'  # Always perform random flipping of input images.
 FLIP_ALWAYS = 'always'  # Always flip image input, used for test augmentation.
 FLIP_NONE = 'none'  # Always disables flipping.
 
+# Number of batches of triplets the background collector buffers ahead of training
+TRIPLET_BUFFER_BATCHES = 2
+
 
 class DataReader(object):
     """Reads stored sequences which are produced by dataset/gen_data.py."""
@@ -83,6 +88,7 @@ class DataReader(object):
         self.img_width = img_width
         self.seq_length = seq_length
         self.seq_width = self.img_width * self.seq_length
+        self.batch_shape = (self.batch_size, self.img_height, self.seq_width, 3)
         self.num_scales = num_scales
         self.file_extension = file_extension
         self.random_scale_crop = random_scale_crop
@@ -93,33 +99,13 @@ class DataReader(object):
         self.isaac_app = isaac_app
         self.time_delay = time_delay
         self.sample_numbers = num_isaac_samples
-        self.speed = 0
         self.speed_threshold = speed_threshold
-        self.angular_speed = 0
         self.angular_speed_threshold = angular_speed_threshold
+        self.odometry = OdometryReader()
         self.steps_per_epoch = 1000
         self.optimize = optimize
         self.repetitions = repetitions
 
-    # Retrieve current robot linear and angular speed from Isaac Sim
-    # Since robot state can only be passed in real time through the Isaac SDK messaging system to other codelets,
-    # instead the robot speed is saved to a .csv file.
-    def update_speed(self):
-        with open('/mnt/isaac_2019_2/apps/carter_sim_struct2depth/differential_base_speed/speed.csv') as speed_file:
-            csv_reader = csv.reader(speed_file, delimiter=',')
-            for row in csv_reader:
-                if len(row) == 2:
-                    try:
-                        float(row[0])
-                        self.speed = float(row[0])
-                    except ValueError:
-                        self.speed = 0 # speed is not currently readable
-                    try:
-                        float(row[1])
-                        self.angular_speed = float(row[1])
-                    except ValueError:
-                        self.angular_speed = 0 # angular speed is not currently readable
-
     # Check if Isaac Sim bridge has samples
     def has_samples(self, bridge):
         return bridge.get_sample_count() >= self.sample_numbers
@@ -130,72 +116,55 @@ class DataReader(object):
     def get_generator(self, bridge, img_processor):
 
         def _generator(self):
-            # Infinitely generate training images
-            while True:
-                # Arrays to hold image batches
-                image_batch = np.zeros((0, self.img_height, self.img_width * self.seq_length, 3))
-                seg_mask_batch = np.zeros((0, self.img_height, self.img_width * self.seq_length, 3))
-
-                images = []
-
-                # Check the current robot speed.
-                self.update_speed()
-
-                # Only collect samples if robot is moving faster than a specified speed threshold
-                if self.speed > self.speed_threshold or self.angular_speed > self.angular_speed_threshold:
-
-                    # Retrieve a total of (batch_size * seq_length) images
-                    for i in range(self.batch_size * self.seq_length):
-
-                        # Wait until we get enough samples from Isaac
-                        while not self.has_samples(bridge):
-                            time.sleep(self.time_delay)
-
-                        # Acquire image
-                        new_image = bridge.acquire_samples(self.sample_numbers)
-
-                        # Add image to list
-                        images.append(np.squeeze(new_image))
-
-                        # Wait to increase disparity between images
-                        time.sleep(self.time_delay)
-
-                        # TODO: Turn seg mask generator into an Isaac node
-                        # Create wide image and segmentation triplets
-                        if (i + 1) % self.seq_length == 0:
-                            image_seq, seg_mask_seq = img_processor.process_image([images[i - 2],
-                                                                                   images[i - 1],
-                                                                                   images[i]])
-
-                            if self.optimize:
-                                repetitions = self.repetitions
-                            else:
-                                repetitions = 1
-                            for j in range(repetitions):
-                                # Add to total image lists; add repetitions if performing online refinement
-                                image_batch = np.append(image_batch, np.expand_dims(image_seq, axis=0), axis=0)
-                                seg_mask_batch = np.append(seg_mask_batch, np.expand_dims(seg_mask_seq, axis=0), axis=0)
-
-                    # TODO: Retrieve camera mat from Isaac instead of manually input
-                    intrinsics = np.array([[208., 0., 208.], [0., 113.778, 64.], [0., 0., 1.]])  # Scaled properly
-                    intrinsics_batch = np.repeat(intrinsics[None, :],
-                                                 repeats=self.batch_size if not self.optimize else self.repetitions,
-                                                 axis=0)  # Create batch
-
-                    if not self.optimize:
-                        # Shuffle batch elements to reduce overfitting
-                        np.random.seed(2)
-                        np.random.shuffle(image_batch)
-                        np.random.shuffle(seg_mask_batch)
-                        np.random.shuffle(intrinsics_batch)
-
-                    # Yield batches
-                    yield {COLOR_IMAGE: np.array(image_batch),
-                           SEG_MASK: np.array(seg_mask_batch),
+            # TODO: Retrieve camera mat from Isaac instead of manually input
+            intrinsics = np.array([[208., 0., 208.], [0., 113.778, 64.], [0., 0., 1.]])  # Scaled properly
+            intrinsics_batch = np.repeat(intrinsics[None, :], repeats=self.batch_size, axis=0).astype(np.float32)
+
+            # Start collecting triplets from Isaac in the background
+            collector = SampleCollector(self, bridge, img_processor,
+                                        capacity=self.batch_size * TRIPLET_BUFFER_BATCHES)
+            collector.start()
+
+            try:
+                # Infinitely generate training images
+                while True:
+                    # Batch buffers are filled in place. A new pair is allocated for every batch, since
+                    # from_generator may hand the memory of a yielded array to TensorFlow without copying.
+                    image_batch = np.empty(self.batch_shape, dtype=np.uint8)
+                    seg_mask_batch = np.empty(self.batch_shape, dtype=np.uint8)
+
+                    # Shuffle batch elements to reduce overfitting. Images and seg masks share one order.
+                    if self.optimize:
+                        order = np.arange(self.batch_size)
+                    else:
+                        order = np.random.permutation(self.batch_size)
+
+                    # Drain batch_size ready triplets
+                    for index in order:
+                        image_batch[index], seg_mask_batch[index] = collector.get()
+
+                    if collector.dropped:
+                        logging.log_every_n(logging.INFO, 'Dropped %d stale triplets so far.', 100,
+                                            collector.dropped)
+
+                    # Yield batches. Repetitions for online refinement are added in the graph.
+                    yield {COLOR_IMAGE: image_batch,
+                           SEG_MASK: seg_mask_batch,
                            INTRINSICS: intrinsics_batch}
+            finally:
+                collector.stop()
 
         return lambda: _generator(self)
 
+    # Repeats every triplet of a batch self.repetitions times in a row for online refinement.
+    def repeat_samples(self, sample):
+        def repeat(x):
+            shape = x.shape.as_list()
+            x = tf.tile(tf.expand_dims(x, 1), [1, self.repetitions] + [1] * (len(shape) - 1))
+            return tf.reshape(x, [shape[0] * self.repetitions] + shape[1:])
+
+        return {key: repeat(value) for key, value in sample.items()}
+
     def get_dataset(self, bridge, img_processor):
         """Create a tf.data dataset which yields batches of samples for training.
 
@@ -205,27 +174,30 @@ class DataReader(object):
       Returns:
         A tf.data dataset which yields batches of training examples.
       """
-        if self.optimize:
-            dataset_size = self.repetitions
-        else:
-            dataset_size = self.batch_size
-
         dataset = tf.data.Dataset.from_generator(
             self.get_generator(bridge, img_processor), {
-                COLOR_IMAGE: tf.float32,
+                COLOR_IMAGE: tf.uint8,
                 SEG_MASK: tf.uint8,
                 INTRINSICS: tf.float32,
             }, {
-                COLOR_IMAGE: (dataset_size, self.img_height, self.seq_width, 3),
-                SEG_MASK: (dataset_size, self.img_height, self.seq_width, 3),
-                INTRINSICS: (dataset_size, 3, 3),
+                COLOR_IMAGE: self.batch_shape,
+                SEG_MASK: self.batch_shape,
+                INTRINSICS: (self.batch_size, 3, 3),
             })
 
+        # Online refinement trains on each triplet multiple times
+        if self.optimize:
+            dataset = dataset.map(self.repeat_samples)
+
         return dataset
 
-    # Load data from Isaac Sim into a TensorFlow Dataset generator
+    # Load data from Isaac Sim into a TensorFlow Dataset generator.
+    # All five tensors come from a single dataset and iterator, so every simulator batch is consumed
+    # exactly once and images, seg masks, and intrinsics always belong to the same batch.
     def read_data(self):
         with tf.name_scope('data_loading'):
+            # Only needed when training from the simulation, so Isaac is not required to import the reader
+            from isaac_app import create_sample_bridge
 
             # Startup the sample accumulator bridge to get Isaac Sim data
             bridge = create_sample_bridge(self.isaac_app)
@@ -234,85 +206,19 @@ class DataReader(object):
             img_processor = ImageProcessor()
             logging.info("Image Processor created")
 
-            # Create a Dataset and iterator from Isaac generator
+            # Create a Dataset from the Isaac generator
             isaac_dataset = self.get_dataset(bridge, img_processor)
-
-            # Split dataset into image, seg mask, and intrinsics datasets
-            isaac_subsets = split_datasets(isaac_dataset)
-            image_ds = isaac_subsets[COLOR_IMAGE]
-            seg_ds = isaac_subsets[SEG_MASK]
-            intrinsics_ds = isaac_subsets[INTRINSICS]
-
-            logging.info("Image dataset dimensions: {}".format(image_ds))
-            logging.info("Seg mask dataset dimensions: {}".format(seg_ds))
-            logging.info("Intrinsics dataset dimensions: {}".format(intrinsics_ds))
+            logging.info("Isaac dataset dimensions: {}".format(isaac_dataset.output_shapes))
 
         with tf.name_scope('preprocessing'):
+            dataset = isaac_dataset.map(self.preprocess, num_parallel_calls=AUTOTUNE)
 
-            # Scale image values from 0-255 to 0-1.
-            image_ds = image_ds.map(lambda x: x / 255.0, num_parallel_calls=AUTOTUNE)
-
-            # Randomly augment colorspace
-            if self.random_color:
-                with tf.name_scope('image_augmentation'):
-                    image_ds = image_ds.map(self.augment_image_colorspace, num_parallel_calls=AUTOTUNE)
-                logging.info("Image successfully augmented")
-
-            # Unpack triplets; each tensor is unpacked into a stack of three images
-            image_stack_ds = image_ds.map(self.unpack_images, num_parallel_calls=AUTOTUNE)
-            seg_stack_ds = seg_ds.map(self.unpack_images, num_parallel_calls=AUTOTUNE)
-            logging.info("Images unpacked")
-
-            # Randomly flip images
-            if self.flipping_mode != FLIP_NONE:
-                random_flipping = (self.flipping_mode == FLIP_RANDOM)
-                with tf.name_scope('image_augmentation_flip'):
-                    # Create image flipper
-                    flipper = Flipper(image_width=self.img_width, batch_size=self.batch_size,
-                                      randomized=random_flipping)
-
-                    # Flip images, seg masks, and intrinsics randomly or completely, depending on random_flipping
-                    image_stack_ds = image_stack_ds.map(flipper.flip_images, num_parallel_calls=AUTOTUNE)
-                    seg_stack_ds = seg_stack_ds.map(flipper.flip_images, num_parallel_calls=AUTOTUNE)
-                    intrinsics_ds = intrinsics_ds.map(flipper.flip_intrinsics, num_parallel_calls=AUTOTUNE)
-
-                    logging.info("Images flipped and intrinsics adjusted")
-
-            # TODO: Make this functional
-            # Randomly scale and crop images
-            if self.random_scale_crop:
-                with tf.name_scope('image_augmentation_scale_crop'):
-                    # Create image cropper
-                    cropper = Cropper(image_width=self.img_width, image_height=self.img_height)
-
-                    # Crop images, seg masks, and intrinsics
-                    image_stack_ds = image_stack_ds.map(cropper.scale_and_crop_image, num_parallel_calls=AUTOTUNE)
-                    seg_stack_ds = seg_stack_ds.map(cropper.scale_and_crop_image, num_parallel_calls=AUTOTUNE)
-                    intrinsics_ds = intrinsics_ds.map(cropper.scale_and_crop_intrinsics, num_parallel_calls=AUTOTUNE)
-
-                    logging.info("Images scaled and cropped")
-
-            # Adjust camera intrinsics to the correct scale and compute the inverse
-            with tf.name_scope('multi_scale_intrinsics'):
-                intrinsics_ds = intrinsics_ds.map(self.get_multi_scale_intrinsics, num_parallel_calls=AUTOTUNE)
-                intrinsics_inv = intrinsics_ds.map(lambda x: tf.matrix_inverse(x), num_parallel_calls=AUTOTUNE)
-
-                logging.info("Multi scale intrinsics received")
-
-            # Normalize images by the Imagenet standard
-            if self.imagenet_norm:
-                image_stack_norm = image_stack_ds.map(self.normalize_by_imagenet, num_parallel_calls=AUTOTUNE)
-                logging.info("Imagenet norm used")
-            else:
-                image_stack_norm = image_stack_ds
-                logging.info("Imagenet norm not used")
-
-        # Create iterators over datasets
-        image_it = image_stack_ds.make_one_shot_iterator().get_next()
-        image_norm_it = image_stack_norm.make_one_shot_iterator().get_next()
-        seg_it = seg_stack_ds.make_one_shot_iterator().get_next()
-        intrinsics_it = intrinsics_ds.make_one_shot_iterator().get_next()
-        intrinsics_inv_it = intrinsics_inv.make_one_shot_iterator().get_next()
+            # Prepare the next batch while the current one is trained on
+            dataset = dataset.prefetch(1)
+
+        # Create a single iterator over the dataset
+        image_it, image_norm_it, seg_it, intrinsics_it, intrinsics_inv_it = \
+            dataset.make_one_shot_iterator().get_next()
 
         logging.info("Dataset successfuly processed")
         logging.info("Final image dimensions: {}".format(image_it))
@@ -327,6 +233,61 @@ class DataReader(object):
                 intrinsics_it,
                 intrinsics_inv_it)
 
+    # Pre-processes one batch from the generator. Returns the image stack, normalized image stack,
+    # seg mask stack, multi scale intrinsics and their inverse.
+    def preprocess(self, sample):
+        image = sample[COLOR_IMAGE]
+        seg = sample[SEG_MASK]
+        intrinsics = sample[INTRINSICS]
+
+        # Scale image values from 0-255 to 0-1.
+        image = tf.cast(image, dtype=tf.float32) / 255.0
+
+        # Randomly augment colorspace
+        if self.random_color:
+            with tf.name_scope('image_augmentation'):
+                image = self.augment_image_colorspace(image)
+
+        # Unpack triplets; each tensor is unpacked into a stack of three images
+        image_stack = self.unpack_images(image)
+        seg_stack = self.unpack_images(seg)
+
+        # Randomly flip images
+        if self.flipping_mode != FLIP_NONE:
+            random_flipping = (self.flipping_mode == FLIP_RANDOM)
+            with tf.name_scope('image_augmentation_flip'):
+                # Create image flipper
+                flipper = Flipper(image_width=self.img_width, batch_size=self.batch_size,
+                                  randomized=random_flipping)
+
+                # Flip images, seg masks, and intrinsics together
+                image_stack, seg_stack, intrinsics = flipper.flip(image_stack, seg_stack, intrinsics)
+
+        # TODO: Make this functional
+        # Randomly scale and crop images
+        if self.random_scale_crop:
+            with tf.name_scope('image_augmentation_scale_crop'):
+                # Create image cropper
+                cropper = Cropper(image_width=self.img_width, image_height=self.img_height)
+
+                # Crop images, seg masks, and intrinsics
+                image_stack = cropper.scale_and_crop_image(image_stack)
+                seg_stack = cropper.scale_and_crop_image(seg_stack)
+                intrinsics = cropper.scale_and_crop_intrinsics(intrinsics)
+
+        # Adjust camera intrinsics to the correct scale and compute the inverse
+        with tf.name_scope('multi_scale_intrinsics'):
+            intrinsics = self.get_multi_scale_intrinsics(intrinsics)
+            intrinsics_inv = tf.matrix_inverse(intrinsics)
+
+        # Normalize images by the Imagenet standard
+        if self.imagenet_norm:
+            image_stack_norm = self.normalize_by_imagenet(image_stack)
+        else:
+            image_stack_norm = image_stack
+
+        return image_stack, image_stack_norm, seg_stack, intrinsics, intrinsics_inv
+
     # Unpack image triplet from [h, w * seq_length, 3] -> [h, w, 3 * seq_length] image stack.
     def unpack_images(self, image_seq):
         with tf.name_scope('unpack_images'):
@@ -408,6 +369,80 @@ class DataReader(object):
         return (image_stack - im_mean) / im_sd
 
 
+# Background thread that continuously pulls frames from the Isaac SampleAccumulator bridge and turns them
+# into image and seg mask triplets. Triplet members are picked by the motion of the robot since the previous
+# member, which keeps a high disparity between images (see frame_selector.FrameSelector). Triplets are
+# kept in a bounded buffer; when training falls behind, the oldest triplet is dropped.
+class SampleCollector(threading.Thread):
+    def __init__(self, reader, bridge, img_processor, capacity, poll_interval=0.01):
+        super(SampleCollector, self).__init__(name='isaac_sample_collector')
+        self.daemon = True
+        self.reader = reader
+        self.bridge = bridge
+        self.img_processor = img_processor
+        self.triplets = queue.Queue(maxsize=capacity)
+        self.poll_interval = poll_interval
+        self.dropped = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            self.collect()
+        except Exception:
+            logging.exception('Isaac sample collector failed')
+
+    def collect(self):
+        # The same spacing as a time_delay sleep at the threshold speeds, but measured in robot motion
+        selector = FrameSelector.from_time_delay(self.reader.seq_length, self.reader.time_delay,
+                                                 self.reader.speed_threshold,
+                                                 self.reader.angular_speed_threshold)
+        while not self.stopped.is_set():
+            # Wait until we get enough samples from Isaac
+            if not self.reader.has_samples(self.bridge):
+                time.sleep(self.poll_interval)
+                continue
+
+            # Acquire image and look up the robot motion at the time it was taken. Since robot state can
+            # only be passed in real time through the Isaac SDK messaging system to other codelets, the
+            # DifferentialBaseState codelet publishes its odometry history into shared memory. The
+            # SampleAccumulator has no capture timestamp, so the time the sample became available is
+            # taken before acquiring it.
+            acqtime = time.time()
+            new_image = self.bridge.acquire_samples(self.reader.sample_numbers)
+            state = self.reader.odometry.state_at(acqtime)
+            images = selector.add(np.squeeze(new_image), state)
+
+            # TODO: Turn seg mask generator into an Isaac node
+            # Create wide image and segmentation triplets
+            if images is not None:
+                self.put(self.img_processor.process_image(images))
+
+    # Adds a triplet, evicting the oldest one if the buffer is full.
+    def put(self, triplet):
+        while True:
+            try:
+                self.triplets.put_nowait(triplet)
+                return
+            except queue.Full:
+                try:
+                    self.triplets.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    # Returns the oldest ready (image_seq, seg_mask_seq) triplet, blocking until one is available.
+    def get(self):
+        while True:
+            try:
+                return self.triplets.get(timeout=0.1)
+            except queue.Empty:
+                if not self.is_alive():
+                    raise RuntimeError('Isaac sample collector is not running.')
+
+    def stop(self):
+        self.stopped.set()
+
+
 # Class for flipping images, seg masks, and intrinsics
 # Provides greater variety in training dataset to avoid overfitting
 class Flipper:
@@ -419,41 +454,25 @@ class Flipper:
         self.batch_size = batch_size
         self.img_width = image_width  # Assumes all input images are the same size
 
-    # Randomly flips the image horizontally.
-    def flip_images(self, image_stack):
-
-        if self.randomized:
-            # Generate random number. Seed provided to ensure that image,
-            # seg mask, and intrinsics are paired
-            prob = tf.random_uniform(shape=[], minval=0.0, maxval=1.0,
-                                     dtype=tf.float32, seed=2)
-            predicate = tf.less(prob, 0.5)
-        else:
-            predicate = tf.less(0.0, 0.5)
-
-        return tf.cond(predicate,
-                       lambda: tf.image.flip_left_right(image_stack),
-                       lambda: image_stack)
-
-    # Randomly flips intrinsics.
-    def flip_intrinsics(self, intrinsics):
-
+    # Flips image stack, seg mask stack, and intrinsics of a batch together, based on a single random draw.
+    def flip(self, image_stack, seg_stack, intrinsics):
         if self.randomized:
-            # Generate random probability. Seed provided to ensure that image,
-            # seg mask, and intrinsics are paired
-            prob = tf.random_uniform(shape=[], minval=0.0, maxval=1.0,
-                                     dtype=tf.float32, seed=2)
-            predicate = tf.less(prob, 0.5)
+            predicate = tf.less(tf.random_uniform(shape=[], minval=0.0, maxval=1.0, dtype=tf.float32), 0.5)
         else:
             predicate = tf.less(0.0, 0.5)
 
-        intrinsics_flipped = tf.map_fn(lambda x: tf.cond(predicate,
-                                                         lambda: make_intrinsics_matrix(x[0, 0], x[1, 1],
-                                                                                        self.img_width - x[0, 2],
-                                                                                        x[1, 2]),
-                                                         lambda: x), intrinsics)
-
-        return intrinsics_flipped
+        image_stack = tf.cond(predicate,
+                              lambda: tf.image.flip_left_right(image_stack),
+                              lambda: image_stack)
+        seg_stack = tf.cond(predicate,
+                            lambda: tf.image.flip_left_right(seg_stack),
+                            lambda: seg_stack)
+        intrinsics = tf.cond(predicate,
+                             lambda: tf.map_fn(lambda x: make_intrinsics_matrix(x[0, 0], x[1, 1],
+                                                                                self.img_width - x[0, 2],
+                                                                                x[1, 2]), intrinsics),
+                             lambda: intrinsics)
+        return image_stack, seg_stack, intrinsics
 
 
 # Class for cropping images. First scales them to provide a greater area
@@ -536,13 +555,3 @@ def make_intrinsics_matrix(fx, fy, cx, cy):
     r3 = tf.constant([0., 0., 1.])
     intrinsics = tf.stack([r1, r2, r3])
     return intrinsics
-
-
-# Helper function for splitting tf datasets into sub-datasets.
-def split_datasets(dataset):
-    subsets = {}
-    names = list(dataset.output_shapes.keys())
-    for name in names:
-        subsets[name] = dataset.map(lambda x: x[name])
-
-    return subsets
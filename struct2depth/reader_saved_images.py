@@ -22,6 +22,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
 import os
 import sys
 from absl import logging
@@ -31,6 +32,8 @@ import cv2
 import matplotlib.pyplot as plt
 import glob
 
+import dataset_cache
+import shards
 import util
 # from struct2depth.process_image import ImageProcessor
 from process_image import ImageProcessor
@@ -61,10 +64,10 @@ INTRINSICS_INV = 'camera_matrix_inverse'
 IMAGE_NORM = 'imagenet_norm'
 
 
-def load_and_preprocess_image(path):
+def load_and_preprocess_image(path, height=128, width=1248):
     image = tf.io.read_file(path)
     image = tf.image.decode_png(image, channels=3)
-    image = tf.image.resize(image, [128, 1248])
+    image = tf.image.resize(image, [height, width])
     return image
 
 
@@ -97,7 +100,8 @@ class DataReader(object):
                  shuffle,
                  isaac_app=None,
                  optimize=False,
-                 repetitions=0):
+                 repetitions=0,
+                 cache_dir=None):
         self.data_dir = data_dir
         self.batch_size = batch_size
         self.img_height = img_height
@@ -114,6 +118,7 @@ class DataReader(object):
         self.steps_per_epoch = 0 # Updated once image paths are loaded
         self.optimize = optimize
         self.repetition = repetitions
+        self.cache_dir = cache_dir  # Decode png files once into a memory mapped cache here if given
 
     def sort_paths(self, paths, root_dir, extension):
         training_steps = []
@@ -129,141 +134,48 @@ class DataReader(object):
 
         return sorted_paths
 
+    # Provides images and camera intrinsics. Image triplets, seg masks, and intrinsics are zipped into a
+    # single dataset, so every triplet is decoded once and stays paired with its seg mask and intrinsics.
+    # Reads binary shards instead of png files if data_dir holds any, see shards.py. Otherwise reads the png
+    # files through a memory mapped cache if cache_dir is set, see dataset_cache.py.
     def read_data(self):
-        """Provides images and camera intrinsics."""
         with tf.name_scope('data_loading'):
 
             if self.data_dir.endswith('/'):
-                self.data_dir = self.image_dir[:-1]
+                self.data_dir = self.data_dir[:-1]
 
-            all_image_paths = [f for f in sorted(glob.glob(self.data_dir + '/*.png')) if not 'fseg' in f]
-            all_image_paths_seg = sorted(glob.glob(self.data_dir + '/*-fseg.png'))
-            all_image_paths_intrinsics = sorted(glob.glob(self.data_dir + '/*_cam.csv'))
+            if shards.find_shard_dirs(self.data_dir):
+                dataset, num_triplets = self.read_shards()
+            elif self.cache_dir is not None:
+                dataset, num_triplets = self.read_cache()
+            else:
+                dataset, num_triplets = self.read_png_files()
+
+            # Update steps per epoch. Online refinement uses each triplet multiple times.
+            num_samples = num_triplets * (self.repetition if self.optimize else 1)
+            self.steps_per_epoch = int(num_samples) / self.batch_size
 
-            # Add multiple iterations of each path if performing online refinement
-            all_image_paths_optimized = []
-            all_image_paths_seg_optimized = []
-            all_image_paths_intrinsics_optimized = []
+            # Add multiple iterations of each triplet if performing online refinement. Repetitions
+            # reuse the decoded triplet and are augmented independently.
             if self.optimize:
-                for i in range(len(all_image_paths)):
-                    for j in range(self.repetition):
-                        all_image_paths_optimized.append(all_image_paths[i])
-                        all_image_paths_seg_optimized.append(all_image_paths_seg[i])
-                        all_image_paths_intrinsics_optimized.append(all_image_paths_intrinsics[i])
-
-                all_image_paths = all_image_paths_optimized
-                all_image_paths_seg = all_image_paths_seg_optimized
-                all_image_paths_intrinsics = all_image_paths_intrinsics_optimized
-
-            # Update steps per epoch
-            self.steps_per_epoch = int(len(all_image_paths)) / self.batch_size
-
-            # Raw image triplets
-            path_ds = tf.data.Dataset.from_tensor_slices(all_image_paths)
-            image_ds = path_ds.map(load_and_preprocess_image, num_parallel_calls=AUTOTUNE)
-
-            # Seg masks
-            path_ds_seg = tf.data.Dataset.from_tensor_slices(all_image_paths_seg)
-            seg_ds = path_ds_seg.map(load_and_preprocess_image, num_parallel_calls=AUTOTUNE)
-            seg_ds = seg_ds.map(lambda x: tf.cast(x, dtype=tf.uint8), num_parallel_calls=AUTOTUNE)  # Must be uint8
-
-            # Camera intrinsics
-            record_defaults = [tf.float32] * 9
-            intrinsics_ds = tf.data.experimental.CsvDataset(all_image_paths_intrinsics,
-                                                            record_defaults)  # Dataset of .csv lines
-            intrinsics_ds = intrinsics_ds.map(lambda *x: tf.convert_to_tensor(x))  # Convert to tensors
-            intrinsics_ds = intrinsics_ds.map(lambda x: tf.reshape(x, [3, 3]))
+                dataset = dataset.flat_map(
+                    lambda *x: tf.data.Dataset.from_tensors(x).repeat(self.repetition))
 
             logging.info("Datasets loaded")
-            logging.info("Image dataset dimensions: {}".format(image_ds))
-            logging.info("Seg mask dataset dimensions: {}".format(seg_ds))
-            logging.info("Intrinsics dataset dimensions: {}".format(intrinsics_ds))
+            logging.info("Dataset dimensions: {}".format(dataset.output_shapes))
 
         with tf.name_scope('preprocessing'):
+            dataset = dataset.map(self.preprocess, num_parallel_calls=AUTOTUNE)
 
-            # Scale image values from 0-255 to 0-1
-            image_ds = image_ds.map(lambda x: x / 255.0, num_parallel_calls=AUTOTUNE)
-
-            # Randomly augment colorspace
-            if self.random_color:
-                with tf.name_scope('image_augmentation'):
-                    image_ds = image_ds.map(self.augment_image_colorspace, num_parallel_calls=AUTOTUNE)
-                logging.info("Image successfully augmented")
-
-            # Unpack triplets; each tensor is unpacked into a stack of three images
-            image_stack_ds = image_ds.map(self.unpack_images, num_parallel_calls=AUTOTUNE)
-            seg_stack_ds = seg_ds.map(self.unpack_images, num_parallel_calls=AUTOTUNE)
-            logging.info("Images unpacked")
-
-            # Randomly flip images
-            if self.flipping_mode != FLIP_NONE:
-                random_flipping = (self.flipping_mode == FLIP_RANDOM)
-                with tf.name_scope('image_augmentation_flip'):
-                    # Create image flipper
-                    flipper = Flipper(image_width=self.img_width, randomized=random_flipping)
-
-                    # Flip images, seg masks, and intrinsics randomly or completely, depending on random_flipping
-                    image_stack_ds = image_stack_ds.map(flipper.flip_images, num_parallel_calls=AUTOTUNE)
-                    seg_stack_ds = seg_stack_ds.map(flipper.flip_images, num_parallel_calls=AUTOTUNE)
-                    intrinsics_ds = intrinsics_ds.map(flipper.flip_intrinsics, num_parallel_calls=AUTOTUNE)
-
-                    logging.info("Images flipped and intrinsics adjusted")
-
-            # Randomly scale and crop images
-            if self.random_scale_crop:
-                with tf.name_scope('image_augmentation_scale_crop'):
-                    # Create image cropper
-                    cropper = Cropper(image_width=self.img_width, image_height=self.img_height)
-
-                    # Crop images, seg masks, and intrinsics
-                    image_stack_ds = image_stack_ds.map(cropper.scale_and_crop_image, num_parallel_calls=AUTOTUNE)
-                    seg_stack_ds = seg_stack_ds.map(cropper.scale_and_crop_image, num_parallel_calls=AUTOTUNE)
-                    intrinsics_ds = intrinsics_ds.map(cropper.scale_and_crop_intrinsics, num_parallel_calls=AUTOTUNE)
-
-                    logging.info("Images scaled and cropped")
-
-            # Adjust camera intrinsics to the correct scale and compute the inverse
-            with tf.name_scope('multi_scale_intrinsics'):
-                intrinsics_ds = intrinsics_ds.map(self.get_multi_scale_intrinsics, num_parallel_calls=AUTOTUNE)
-                intrinsics_inv = intrinsics_ds.map(lambda x: tf.matrix_inverse(x), num_parallel_calls=AUTOTUNE)
-
-                logging.info("Multi scale intrinsics received")
-
-            # Normalize images by the Imagenet standard
-            if self.imagenet_norm:
-                image_stack_norm = image_stack_ds.map(self.normalize_by_imagenet, num_parallel_calls=AUTOTUNE)
-                logging.info("Imagenet norm used")
-            else:
-                image_stack_norm = image_stack_ds
-                logging.info("Imagenet norm not used")
-
-        # Shuffle and batch datasets
         with tf.name_scope('batching'):
-            if self.shuffle:
-                image_stack_ds = image_stack_ds.shuffle(buffer_size=1500, seed=2).batch(self.batch_size,
-                                                                                        drop_remainder=True).repeat()
-                image_stack_norm = image_stack_norm.shuffle(buffer_size=1500, seed=2).batch(self.batch_size,
-                                                                                            drop_remainder=True).repeat()
-                seg_stack_ds = seg_stack_ds.shuffle(buffer_size=1500, seed=2).batch(self.batch_size,
-                                                                                    drop_remainder=True).repeat()
-                intrinsics_ds = intrinsics_ds.shuffle(buffer_size=1500, seed=2).batch(self.batch_size,
-                                                                                      drop_remainder=True).repeat()
-                intrinsics_inv = intrinsics_inv.shuffle(buffer_size=1500, seed=2).batch(self.batch_size,
-                                                                                        drop_remainder=True).repeat()
+            dataset = dataset.batch(self.batch_size, drop_remainder=self.shuffle)
 
-            else:
-                image_stack_ds = image_stack_ds.batch(self.batch_size)
-                image_stack_norm = image_stack_norm.batch(self.batch_size)
-                seg_stack_ds = seg_stack_ds.batch(self.batch_size)
-                intrinsics_ds = intrinsics_ds.batch(self.batch_size)
-                intrinsics_inv = intrinsics_inv.batch(self.batch_size)
-
-        # Create iterators over datasets
-        image_it = image_stack_ds.make_one_shot_iterator().get_next()
-        image_norm_it = image_stack_norm.make_one_shot_iterator().get_next()
-        seg_it = seg_stack_ds.make_one_shot_iterator().get_next()
-        intrinsics_it = intrinsics_ds.make_one_shot_iterator().get_next()
-        intrinsics_inv_it = intrinsics_inv.make_one_shot_iterator().get_next()
+            # Prepare the next batch while the current one is trained on
+            dataset = dataset.prefetch(1)
+
+        # Create a single iterator over the dataset
+        image_it, image_norm_it, seg_it, intrinsics_it, intrinsics_inv_it = \
+            dataset.make_one_shot_iterator().get_next()
 
         logging.info("Dataset successfuly processed")
         logging.info("Final image dimensions: {}".format(image_it))
@@ -278,6 +190,137 @@ class DataReader(object):
                 intrinsics_it,
                 intrinsics_inv_it)
 
+    # Returns the dataset of decoded triplets, seg masks, and intrinsics stored as png and csv files, and
+    # the number of triplets.
+    def read_png_files(self):
+        all_image_paths, all_image_paths_seg, all_image_paths_intrinsics = \
+            dataset_cache.list_saved_images(self.data_dir)
+
+        # Camera intrinsics are tiny, so they are read once here instead of in the pipeline
+        all_intrinsics = np.stack([np.loadtxt(f, delimiter=',', dtype=np.float32).reshape(3, 3)
+                                   for f in all_image_paths_intrinsics])
+
+        dataset = tf.data.Dataset.from_tensor_slices((all_image_paths, all_image_paths_seg, all_intrinsics))
+
+        # Shuffle paths rather than decoded images, which keeps the shuffle buffer small
+        if self.shuffle:
+            dataset = dataset.shuffle(buffer_size=len(all_image_paths)).repeat()
+
+        return dataset.map(self.load_triplet, num_parallel_calls=AUTOTUNE), len(all_image_paths)
+
+    # Returns the dataset of triplets, seg masks, and intrinsics stored in shards, and the number of
+    # triplets. Records are read from the memory mapped shards by index, so there is one file open per
+    # shard instead of three per triplet.
+    def read_shards(self):
+        self.shard_reader = shards.ShardReader(self.data_dir)
+        num_triplets = len(self.shard_reader)
+        dataset = tf.data.Dataset.range(num_triplets)
+
+        # Shuffle record indices rather than decoded images, which keeps the shuffle buffer small
+        if self.shuffle:
+            dataset = dataset.shuffle(buffer_size=num_triplets).repeat()
+
+        return dataset.map(self.load_shard_record, num_parallel_calls=AUTOTUNE), num_triplets
+
+    # Returns the dataset of triplets, seg masks, and intrinsics of the png files, decoded once into a
+    # memory mapped cache, and the number of triplets. Epochs read slices of the cache instead of decoding.
+    def read_cache(self):
+        self.cache = dataset_cache.DatasetCache(self.data_dir, self.cache_dir, self.img_height,
+                                                self.img_width * self.seq_length)
+        num_triplets = len(self.cache)
+        dataset = tf.data.Dataset.range(num_triplets)
+
+        # Shuffle triplet indices rather than decoded images, which keeps the shuffle buffer small
+        if self.shuffle:
+            dataset = dataset.shuffle(buffer_size=num_triplets).repeat()
+
+        return dataset.map(self.load_cached_record, num_parallel_calls=AUTOTUNE), num_triplets
+
+    # Measures the throughput of the whole input pipeline in images/sec per CPU core, in a graph of its own.
+    def measure_throughput(self, num_batches=20):
+        with tf.Graph().as_default():
+            batches_per_second = util.measure_batches_per_second(self.read_data(), num_batches)
+        images_per_second_per_core = batches_per_second * self.batch_size / multiprocessing.cpu_count()
+        logging.info("Input pipeline: %.2f images/sec per core on %d cores.",
+                     images_per_second_per_core, multiprocessing.cpu_count())
+        return images_per_second_per_core
+
+    # Decodes one image triplet and its seg mask.
+    def load_triplet(self, path, seg_path, intrinsics):
+        image = load_and_preprocess_image(path, self.img_height, self.img_width * self.seq_length)
+        seg = load_and_preprocess_image(seg_path, self.img_height, self.img_width * self.seq_length)
+        seg = tf.cast(seg, dtype=tf.uint8)  # Must be uint8
+        return image, seg, intrinsics
+
+    # Reads one record of the shards.
+    def load_shard_record(self, index):
+        image, seg, intrinsics = tf.py_func(self.shard_reader.read, [index], [tf.uint8, tf.uint8, tf.float32],
+                                            stateful=False)
+        image.set_shape([None, None, 3])
+        seg.set_shape([None, None, 3])
+        intrinsics.set_shape([3, 3])
+
+        # Resized to the network input size like the png triplets
+        image = tf.image.resize(image, [self.img_height, self.img_width * self.seq_length])
+        seg = tf.cast(tf.image.resize(seg, [self.img_height, self.img_width * self.seq_length]), dtype=tf.uint8)
+        return image, seg, intrinsics
+
+    # Reads one triplet of the cache. The cache is already at the network input size.
+    def load_cached_record(self, index):
+        image, seg, intrinsics = tf.py_func(self.cache.read, [index], [tf.uint8, tf.uint8, tf.float32],
+                                            stateful=False)
+        image.set_shape([self.img_height, self.img_width * self.seq_length, 3])
+        seg.set_shape([self.img_height, self.img_width * self.seq_length, 3])
+        intrinsics.set_shape([3, 3])
+        return tf.cast(image, dtype=tf.float32), seg, intrinsics
+
+    # Pre-processes one decoded triplet. Returns the image stack, normalized image stack,
+    # seg mask stack, multi scale intrinsics and their inverse.
+    def preprocess(self, image, seg, intrinsics):
+        # Scale image values from 0-255 to 0-1
+        image = image / 255.0
+
+        # Randomly augment colorspace
+        if self.random_color:
+            with tf.name_scope('image_augmentation'):
+                image = self.augment_image_colorspace(image)
+
+        # Unpack triplets; each tensor is unpacked into a stack of three images
+        image_stack = self.unpack_images(image)
+        seg_stack = self.unpack_images(seg)
+
+        # Randomly flip images
+        if self.flipping_mode != FLIP_NONE:
+            random_flipping = (self.flipping_mode == FLIP_RANDOM)
+            with tf.name_scope('image_augmentation_flip'):
+                # Create image flipper
+                flipper = Flipper(image_width=self.img_width, randomized=random_flipping)
+
+                # Flip images, seg masks, and intrinsics together
+                image_stack, seg_stack, intrinsics = flipper.flip(image_stack, seg_stack, intrinsics)
+
+        # Randomly scale and crop images
+        if self.random_scale_crop:
+            with tf.name_scope('image_augmentation_scale_crop'):
+                # Create image cropper
+                cropper = Cropper(image_width=self.img_width, image_height=self.img_height)
+
+                # Crop images, seg masks, and intrinsics together
+                image_stack, seg_stack, intrinsics = cropper.scale_and_crop(image_stack, seg_stack, intrinsics)
+
+        # Adjust camera intrinsics to the correct scale and compute the inverse
+        with tf.name_scope('multi_scale_intrinsics'):
+            intrinsics = self.get_multi_scale_intrinsics(intrinsics)
+            intrinsics_inv = tf.matrix_inverse(intrinsics)
+
+        # Normalize images by the Imagenet standard
+        if self.imagenet_norm:
+            image_stack_norm = self.normalize_by_imagenet(image_stack)
+        else:
+            image_stack_norm = image_stack
+
+        return image_stack, image_stack_norm, seg_stack, intrinsics, intrinsics_inv
+
     # Unpack image triplet from [h, w * seq_length, 3] -> [h, w, 3 * seq_length] image stack.
     def unpack_images(self, image_seq):
         with tf.name_scope('unpack_images'):
@@ -363,44 +406,25 @@ class Flipper:
         self.randomized = randomized
         self.img_width = image_width  # Assumes all input images are the same size
 
-    # Randomly flips the image horizontally.
-    def flip_images(self, image_stack):
-
+    # Flips image stack, seg mask stack, and intrinsics of a triplet together, based on a single random draw.
+    def flip(self, image_stack, seg_stack, intrinsics):
         if self.randomized:
-            # Generate random number. Seed provided to ensure that image,
-            # seg mask, and intrinsics are paired
-            prob = tf.random_uniform(shape=[], minval=0.0, maxval=1.0,
-                                     dtype=tf.float32, seed=2)
-            predicate = tf.less(prob, 0.5)
+            predicate = tf.less(tf.random_uniform(shape=[], minval=0.0, maxval=1.0, dtype=tf.float32), 0.5)
         else:
             predicate = tf.less(0.0, 0.5)
 
-        return tf.cond(predicate,
-                       lambda: tf.image.flip_left_right(image_stack),
-                       lambda: image_stack)
+        image_stack = tf.cond(predicate,
+                              lambda: tf.image.flip_left_right(image_stack),
+                              lambda: image_stack)
+        seg_stack = tf.cond(predicate,
+                            lambda: tf.image.flip_left_right(seg_stack),
+                            lambda: seg_stack)
+        intrinsics = tf.cond(predicate,
+                             lambda: make_intrinsics_matrix(intrinsics[0, 0], intrinsics[1, 1],
+                                                            self.img_width - intrinsics[0, 2], intrinsics[1, 2]),
+                             lambda: intrinsics)
+        return image_stack, seg_stack, intrinsics
 
-    # Randomly flips intrinsics.
-    def flip_intrinsics(self, intrinsics):
-
-        def flip(intrinsics, in_w):
-            fx = intrinsics[0, 0]
-            fy = intrinsics[1, 1]
-            cx = in_w - intrinsics[0, 2]
-            cy = intrinsics[1, 2]
-            return make_intrinsics_matrix(fx, fy, cx, cy)
-
-        if self.randomized:
-            # Generate random probability. Seed provided to ensure that image,
-            # seg mask, and intrinsics are paired
-            prob = tf.random_uniform(shape=[], minval=0.0, maxval=1.0,
-                                     dtype=tf.float32, seed=2)
-            predicate = tf.less(prob, 0.5)
-        else:
-            predicate = tf.less(0.0, 0.5)
-
-        return tf.cond(predicate,
-                       lambda: flip(intrinsics, self.img_width),
-                       lambda: intrinsics)
 
 
 # Class for cropping images. First scales them to provide a greater area
@@ -411,69 +435,33 @@ class Cropper:
                  image_height=128):
         self.orig_img_width = image_width
         self.orig_img_height = image_height
-        self.scaled_img_width = image_width  # New image width before cropping to original dimensions
-        self.scaled_img_height = image_height  # New image height before cropping to original dimensions
-
-    # Scale and crop image.
-    def scale_and_crop_image(self, im):
-        im = self.scale_images_randomly(im)
-        im = self.crop_images_randomly(im)
-        return im
-
-    # Scale image randomly. Seed used to match corresponding image, seg mask, and intrinsics.
-    # Scales to a random number with greater dimensions than the original.
-    def scale_images_randomly(self, im):
-        scaling = tf.random_uniform([2], 1, 1.15, seed=2)
-        x_scaling = scaling[0]
-        y_scaling = scaling[1]
-        self.scaled_img_height = tf.cast(self.orig_img_height * y_scaling, dtype=tf.int32)
-        self.scaled_img_width = tf.cast(self.orig_img_width * x_scaling, dtype=tf.int32)
-
-        # Add batch to resize the image area, then revert back
-        im = tf.expand_dims(im, 0)
-        im = tf.image.resize_area(im, [self.scaled_img_height, self.scaled_img_width])
-        return im[0]
-
-    # Crop image randomly. Outputs image with its original height and width.
-    def crop_images_randomly(self, im):
-        offset_y = tf.random_uniform([1], 0, self.scaled_img_height - self.orig_img_height + 1, dtype=tf.int32, seed=2)[
-            0]
-        offset_x = tf.random_uniform([1], 0, self.scaled_img_width - self.orig_img_width + 1, dtype=tf.int32, seed=2)[0]
-        im = tf.image.crop_to_bounding_box(im, offset_y, offset_x, self.orig_img_height, self.orig_img_width)
-        return im
-
-    # Scales and crops intrinsics, keeping them matched with their corresponding image stacks.
-    # Make sure to scale and crop images first, as the randomly scaled image widths and heights are needed to
-    # scale and crop intrinsics.
-    def scale_and_crop_intrinsics(self, intrinsics):
-        intrinsics = self.scale_intrinsics_randomly(intrinsics)
-        intrinsics = self.crop_intrinsics_randomly(intrinsics)
-        return intrinsics
-
-    # Scale intrinsics randomly. Seed used to match corresponding image, seg mask, and intrinsics.
-    def scale_intrinsics_randomly(self, intrinsics):
-        scaling = tf.random_uniform([2], 1, 1.15, seed=2)
+
+    # Scales and crops image stack, seg mask stack, and intrinsics of a triplet together, based on a
+    # single random draw of the scaling and crop offsets.
+    def scale_and_crop(self, image_stack, seg_stack, intrinsics):
+        scaling = tf.random_uniform([2], 1, 1.15)
         x_scaling = scaling[0]
         y_scaling = scaling[1]
+        scaled_img_height = tf.cast(self.orig_img_height * y_scaling, dtype=tf.int32)
+        scaled_img_width = tf.cast(self.orig_img_width * x_scaling, dtype=tf.int32)
+        offset_y = tf.random_uniform([], 0, scaled_img_height - self.orig_img_height + 1, dtype=tf.int32)
+        offset_x = tf.random_uniform([], 0, scaled_img_width - self.orig_img_width + 1, dtype=tf.int32)
+
+        def scale_and_crop_image(im):
+            # Add batch to resize the image area, then revert back
+            scaled = tf.image.resize_area(tf.expand_dims(im, 0), [scaled_img_height, scaled_img_width])[0]
+            cropped = tf.image.crop_to_bounding_box(scaled, offset_y, offset_x,
+                                                    self.orig_img_height, self.orig_img_width)
+            return tf.cast(cropped, dtype=im.dtype)
 
         fx = intrinsics[0, 0] * x_scaling
         fy = intrinsics[1, 1] * y_scaling
-        cx = intrinsics[0, 2] * x_scaling
-        cy = intrinsics[1, 2] * y_scaling
-        return make_intrinsics_matrix(fx, fy, cx, cy)
-
-    # Crop intrinsics randomly. It is assumed that the images has already been cropped, so that
-    # the scaled image height and width are already known and saved in class state.
-    def crop_intrinsics_randomly(self, intrinsics):
-        """Crops image and adjust intrinsics accordingly."""
-        offset_y = tf.random_uniform([1], 0, self.scaled_img_height - self.orig_img_height + 1, dtype=tf.int32, seed=2)[
-            0]
-        offset_x = tf.random_uniform([1], 0, self.scaled_img_width - self.orig_img_width + 1, dtype=tf.int32, seed=2)[0]
-        fx = intrinsics[0, 0]
-        fy = intrinsics[1, 1]
-        cx = intrinsics[0, 2] - tf.cast(offset_x, dtype=tf.float32)
-        cy = intrinsics[1, 2] - tf.cast(offset_y, dtype=tf.float32)
-        return make_intrinsics_matrix(fx, fy, cx, cy)
+        cx = intrinsics[0, 2] * x_scaling - tf.cast(offset_x, dtype=tf.float32)
+        cy = intrinsics[1, 2] * y_scaling - tf.cast(offset_y, dtype=tf.float32)
+        return (scale_and_crop_image(image_stack),
+                scale_and_crop_image(seg_stack),
+                make_intrinsics_matrix(fx, fy, cx, cy))
+
 
 
 # Creates a 3x3 intrinsics matrix from camera essentials.
@@ -0,0 +1,165 @@
+
+"""Sharded binary record format for training triplets.
+
+Instead of a triplet PNG, a seg mask PNG and an intrinsics text file per sample, records are appended to
+a few large shard files and located through a single index file. A record holds the uint8 image triplet,
+the seg mask triplet run-length encoded (seg masks are mostly zeros) and the float32 camera matrix.
+
+Record layout: HEADER, 9 float32 intrinsics, height * width * 3 image bytes, then num_runs uint32 run
+lengths and num_runs uint8 run values of the seg mask. The mask is stored with a single channel if all of
+its channels are equal. Images and masks are stored in RGB channel order, as tf.image.decode_png returns
+the png triplets.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+INDEX_FILE = 'index.txt'  # One "shard offset length" line per record
+SHARD_FILE = 'shard_{:05d}.bin'
+HEADER = struct.Struct('<iiiI')  # height, width, mask channels, number of mask runs
+SHARD_BYTES = 256 * 1024 * 1024
+
+
+def is_shard_dir(data_dir):
+    return os.path.exists(os.path.join(data_dir, INDEX_FILE))
+
+
+def encode_mask(mask):
+    """Run-length encodes a uint8 mask. Returns (channels, lengths, values)."""
+    channels = 1 if np.all(mask == mask[:, :, :1]) else mask.shape[2]
+    flat = np.ascontiguousarray(mask[:, :, :channels]).ravel()
+    starts = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+    lengths = np.diff(np.concatenate([starts, [flat.size]])).astype(np.uint32)
+    return channels, lengths, flat[starts].astype(np.uint8)
+
+
+def decode_mask(height, width, channels, lengths, values):
+    mask = np.repeat(values, lengths).reshape(height, width, channels)
+    return np.repeat(mask, 3, axis=2) if channels == 1 else mask
+
+
+class ShardWriter(object):
+    """Writes records to the shards in output_dir.
+
+    Shards of a previous run are replaced, so running a generator again does not duplicate its records.
+    With resume, records are appended after the existing ones instead.
+    """
+
+    def __init__(self, output_dir, shard_bytes=SHARD_BYTES, resume=False):
+        self.output_dir = output_dir
+        self.shard_bytes = shard_bytes
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        shard_files = [name for name in os.listdir(output_dir)
+                       if name.startswith('shard_') and name.endswith('.bin')]
+        if not resume:
+            for name in shard_files + [INDEX_FILE]:
+                if os.path.exists(os.path.join(output_dir, name)):
+                    os.remove(os.path.join(output_dir, name))
+            shard_files = []
+        self.shard = len(shard_files)
+        self.shard_file = None
+        self.index_file = open(os.path.join(output_dir, INDEX_FILE), 'a')
+
+    def next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard_file = open(os.path.join(self.output_dir, SHARD_FILE.format(self.shard)), 'ab')
+        self.shard += 1
+
+    def write(self, image, seg_image, intrinsics, bgr=False):
+        """Writes a [H, W, 3] uint8 image and seg mask triplet and its 3x3 camera matrix.
+
+        Set bgr for triplets decoded with cv2, they are converted to RGB.
+        """
+        if bgr:
+            image = image[:, :, ::-1]
+            seg_image = seg_image[:, :, ::-1]
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        intrinsics = np.ascontiguousarray(intrinsics, dtype=np.float32).reshape(9)
+        height, width, _ = image.shape
+        channels, lengths, values = encode_mask(np.asarray(seg_image, dtype=np.uint8))
+
+        record_bytes = HEADER.size + intrinsics.nbytes + image.nbytes + lengths.nbytes + values.nbytes
+        if self.shard_file is None or self.shard_file.tell() + record_bytes > self.shard_bytes:
+            self.next_shard()
+        offset = self.shard_file.tell()
+        self.shard_file.write(HEADER.pack(height, width, channels, len(lengths)))
+        for array in [intrinsics, image, lengths, values]:
+            self.shard_file.write(memoryview(array).cast('B'))
+        self.shard_file.flush()
+        self.index_file.write('{} {} {}\n'.format(self.shard - 1, offset, record_bytes))
+        self.index_file.flush()
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ShardReader(object):
+    """Random access to the records of a shard directory, or of all shard directories inside data_dir.
+
+    Shards are memory mapped, so reads are thread-safe.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dirs = find_shard_dirs(data_dir)
+        if not self.data_dirs:
+            raise ValueError('No shards found in {}.'.format(data_dir))
+        self.shard_maps = []  # Memory map of every shard
+        shards = []
+        offsets = []
+        for shard_dir in self.data_dirs:
+            index = np.loadtxt(os.path.join(shard_dir, INDEX_FILE), dtype=np.int64, ndmin=2)
+            if len(index) == 0:
+                continue
+            first_shard = len(self.shard_maps)
+            for shard in range(index[:, 0].max() + 1):
+                with open(os.path.join(shard_dir, SHARD_FILE.format(shard)), 'rb') as f:
+                    self.shard_maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            shards.append(index[:, 0] + first_shard)
+            offsets.append(index[:, 1])
+        self.shards = np.concatenate(shards) if shards else np.zeros(0, dtype=np.int64)
+        self.offsets = np.concatenate(offsets) if offsets else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read(self, index):
+        """Returns the image triplet, seg mask triplet and camera matrix of record index."""
+        buf = self.shard_maps[self.shards[index]]
+        offset = int(self.offsets[index])
+        height, width, channels, num_runs = HEADER.unpack_from(buf, offset)
+        offset += HEADER.size
+        intrinsics = np.frombuffer(buf, dtype=np.float32, count=9, offset=offset).reshape(3, 3)
+        offset += intrinsics.nbytes
+        image = np.frombuffer(buf, dtype=np.uint8, count=height * width * 3, offset=offset)
+        offset += image.nbytes
+        lengths = np.frombuffer(buf, dtype=np.uint32, count=num_runs, offset=offset)
+        offset += lengths.nbytes
+        values = np.frombuffer(buf, dtype=np.uint8, count=num_runs, offset=offset)
+        return (image.reshape(height, width, 3),
+                decode_mask(height, width, channels, lengths, values),
+                intrinsics)
+
+
+def find_shard_dirs(data_dir):
+    """Returns data_dir if it is a shard directory, otherwise its shard subdirectories, e.g. one per sequence."""
+    if is_shard_dir(data_dir):
+        return [data_dir]
+    return sorted(os.path.join(data_dir, name) for name in os.listdir(data_dir)
+                  if is_shard_dir(os.path.join(data_dir, name)))
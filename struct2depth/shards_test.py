@@ -0,0 +1,122 @@
+
+"""Tests for the shard record format."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+
+from absl.testing import absltest
+import numpy as np
+
+import shards
+
+
+def make_record(rng, height=4, width=12, num_objects=3, channels=3):
+    image = rng.randint(0, 256, size=(height, width, 3)).astype(np.uint8)
+    seg_image = np.zeros((height, width, 3), dtype=np.uint8)
+    for k in range(num_objects):
+        y, x = rng.randint(0, height - 1), rng.randint(0, width - 2)
+        seg_image[y:y + 2, x:x + 3] = k + 1
+    if channels == 3:
+        seg_image[:, :, 1] = 0  # Channels differ, so the mask is stored with all three
+    intrinsics = rng.rand(3, 3).astype(np.float32)
+    return image, seg_image, intrinsics
+
+
+class MaskEncodingTest(absltest.TestCase):
+
+    def test_round_trip_single_channel(self):
+        _, mask, _ = make_record(np.random.RandomState(0), channels=1)
+        channels, lengths, values = shards.encode_mask(mask)
+        self.assertEqual(channels, 1)
+        self.assertEqual(lengths.sum(), mask.shape[0] * mask.shape[1])
+        np.testing.assert_array_equal(shards.decode_mask(4, 12, channels, lengths, values), mask)
+
+    def test_round_trip_multi_channel(self):
+        _, mask, _ = make_record(np.random.RandomState(1), channels=3)
+        channels, lengths, values = shards.encode_mask(mask)
+        self.assertEqual(channels, 3)
+        np.testing.assert_array_equal(shards.decode_mask(4, 12, channels, lengths, values), mask)
+
+    def test_empty_mask_is_one_run(self):
+        channels, lengths, values = shards.encode_mask(np.zeros((4, 12, 3), dtype=np.uint8))
+        self.assertEqual(channels, 1)
+        np.testing.assert_array_equal(lengths, [48])
+        np.testing.assert_array_equal(values, [0])
+
+
+class ShardTest(absltest.TestCase):
+
+    def setUp(self):
+        super(ShardTest, self).setUp()
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+
+    def write(self, records, data_dir=None, **kwargs):
+        with shards.ShardWriter(data_dir or self.data_dir, **kwargs) as writer:
+            for image, seg_image, intrinsics in records:
+                writer.write(image, seg_image, intrinsics)
+
+    def assertRecordsEqual(self, reader, records):
+        self.assertLen(reader, len(records))
+        for i, (image, seg_image, intrinsics) in enumerate(records):
+            read_image, read_seg_image, read_intrinsics = reader.read(i)
+            np.testing.assert_array_equal(read_image, image)
+            np.testing.assert_array_equal(read_seg_image, seg_image)
+            np.testing.assert_array_equal(read_intrinsics, intrinsics)
+
+    def test_round_trip(self):
+        rng = np.random.RandomState(0)
+        records = [make_record(rng, channels=1 + 2 * (i % 2)) for i in range(5)]
+        self.write(records)
+        self.assertTrue(shards.is_shard_dir(self.data_dir))
+        self.assertRecordsEqual(shards.ShardReader(self.data_dir), records)
+
+    def test_records_span_several_shards(self):
+        rng = np.random.RandomState(0)
+        records = [make_record(rng) for _ in range(5)]
+        self.write(records, shard_bytes=400)
+        self.assertGreater(len([name for name in os.listdir(self.data_dir) if name.endswith('.bin')]), 1)
+        self.assertRecordsEqual(shards.ShardReader(self.data_dir), records)
+
+    def test_bgr_records_are_stored_as_rgb(self):
+        image, seg_image, intrinsics = make_record(np.random.RandomState(0))
+        with shards.ShardWriter(self.data_dir) as writer:
+            writer.write(image, seg_image, intrinsics, bgr=True)
+        read_image, read_seg_image, _ = shards.ShardReader(self.data_dir).read(0)
+        np.testing.assert_array_equal(read_image, image[:, :, ::-1])
+        np.testing.assert_array_equal(read_seg_image, seg_image[:, :, ::-1])
+
+    def test_rerun_replaces_records(self):
+        rng = np.random.RandomState(0)
+        self.write([make_record(rng) for _ in range(3)])
+        records = [make_record(rng) for _ in range(2)]
+        self.write(records)
+        self.assertRecordsEqual(shards.ShardReader(self.data_dir), records)
+
+    def test_resume_appends_records(self):
+        rng = np.random.RandomState(0)
+        records = [make_record(rng) for _ in range(3)]
+        self.write(records[:2], shard_bytes=400)
+        self.write(records[2:], shard_bytes=400, resume=True)
+        self.assertRecordsEqual(shards.ShardReader(self.data_dir), records)
+
+    def test_reads_all_shard_dirs(self):
+        rng = np.random.RandomState(0)
+        records = [make_record(rng) for _ in range(4)]
+        self.write(records[:3], data_dir=os.path.join(self.data_dir, 'seq_a'))
+        self.write(records[3:], data_dir=os.path.join(self.data_dir, 'seq_b'))
+        self.assertFalse(shards.is_shard_dir(self.data_dir))
+        self.assertRecordsEqual(shards.ShardReader(self.data_dir), records)
+
+    def test_no_shards_raises(self):
+        with self.assertRaises(ValueError):
+            shards.ShardReader(self.data_dir)
+
+
+if __name__ == '__main__':
+    absltest.main()
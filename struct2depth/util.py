@@ -20,9 +20,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import contextlib
 import locale
 import os
 import re
+import time
 from absl import logging
 import matplotlib
 matplotlib.use('Agg')
@@ -240,6 +242,125 @@ def format_number(n):
   return locale.format('%d', n, grouping=True)
 
 
+class LatencyHistogram(object):
+  """Log-spaced histogram of latencies, kept in milliseconds.
+
+  Cheap enough to record on every tick of a live codelet; percentiles are
+  resolved to the upper edge of the bucket they fall into.
+  """
+
+  def __init__(self, name, min_ms=0.1, max_ms=10000.0, num_buckets=50):
+    self.name = name
+    self.bounds = np.logspace(np.log10(min_ms), np.log10(max_ms), num_buckets)
+    self.counts = np.zeros(num_buckets + 1, dtype=np.int64)
+    self.count = 0
+    self.total_ms = 0.0
+    self.max_ms = 0.0
+
+  def record(self, seconds):
+    """Adds one sample given in seconds."""
+    ms = seconds * 1000.0
+    self.counts[np.searchsorted(self.bounds, ms)] += 1
+    self.count += 1
+    self.total_ms += ms
+    self.max_ms = max(self.max_ms, ms)
+
+  @contextlib.contextmanager
+  def measure(self):
+    """Records the wall time spent inside the with-block."""
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.record(time.time() - start)
+
+  def percentile(self, pc):
+    """Returns the upper bucket edge (ms) below which pc percent of samples lie."""
+    if self.count == 0:
+      return 0.0
+    rank = np.searchsorted(np.cumsum(self.counts), self.count * pc / 100.0)
+    if rank >= len(self.bounds):
+      return self.max_ms
+    return min(self.bounds[rank], self.max_ms)
+
+  def mean(self):
+    return self.total_ms / self.count if self.count else 0.0
+
+  def summary(self):
+    return ('%s: n=%d mean=%.2fms p50=%.2fms p90=%.2fms p99=%.2fms '
+            'max=%.2fms' % (self.name, self.count, self.mean(),
+                            self.percentile(50), self.percentile(90),
+                            self.percentile(99), self.max_ms))
+
+
+class FrameWindow(object):
+  """Sliding window of the last seq_length frames, stacked along channels.
+
+  New frames are shifted in at the end, so frames already in the window are
+  never loaded or preprocessed again.
+  """
+
+  def __init__(self, seq_length):
+    self.seq_length = seq_length
+    self.stack = None
+    self.count = 0
+
+  def push(self, frame):
+    """Adds a frame of shape [H, W, C] as the newest entry of the window."""
+    channels = frame.shape[-1]
+    shape = (1,) + frame.shape[:-1] + (channels * self.seq_length,)
+    if self.stack is None or self.stack.shape != shape:
+      self.stack = np.zeros(shape, dtype=np.float32)
+      self.count = 0
+    self.stack[..., :-channels] = self.stack[..., channels:]
+    self.stack[0, ..., -channels:] = frame
+    self.count = min(self.count + 1, self.seq_length)
+
+  def full(self):
+    return self.count == self.seq_length
+
+  def reset(self):
+    self.count = 0
+
+
+def euler_to_quaternion(rx, ry, rz):
+  """Converts egomotion rotation angles to a (w, x, y, z) quaternion.
+
+  Uses the same convention as project._euler2mat, R = Rx * Ry * Rz.
+  """
+  cx, sx = np.cos(rx / 2.0), np.sin(rx / 2.0)
+  cy, sy = np.cos(ry / 2.0), np.sin(ry / 2.0)
+  cz, sz = np.cos(rz / 2.0), np.sin(rz / 2.0)
+  return (cx * cy * cz - sx * sy * sz,
+          sx * cy * cz + cx * sy * sz,
+          cx * sy * cz - sx * cy * sz,
+          cx * cy * sz + sx * sy * cz)
+
+
+def measure_batches_per_second(fetches, num_batches=20, num_warmup=2):
+  """Measures input pipeline throughput.
+
+  Args:
+    fetches: Tensors of one batch, e.g. the tensors returned by a DataReader.
+    num_batches: Number of batches to time.
+    num_warmup: Number of batches run before timing starts, e.g. to fill
+        shuffle buffers.
+
+  Returns:
+    Batches per second.
+  """
+  with tf.Session() as sess:
+    for _ in range(num_warmup):
+      sess.run(fetches)
+    start = time.time()
+    for _ in range(num_batches):
+      sess.run(fetches)
+    batches_per_second = num_batches / (time.time() - start)
+  logging.info('Input pipeline: %.2f batches/sec over %d batches.',
+               batches_per_second, num_batches)
+  return batches_per_second
+
+
 def atoi(text):
   return int(text) if text.isdigit() else text
 
@@ -83,7 +83,8 @@ def load_training_parameters():
            config["handle_motion"], \
            config["master"], \
            config["shuffle"], \
-           config["max_ckpts_to_keep"]
+           config["max_ckpts_to_keep"], \
+           config.get("cache_dir")
 
 def load_isaac_parameters():
     with open(ISAAC_CONFIG_PATH) as f:
@@ -186,7 +187,8 @@ def main(_):
     handle_motion, \
     master, \
     shuffle, \
-    max_ckpts_to_keep = load_training_parameters()
+    max_ckpts_to_keep, \
+    cache_dir = load_training_parameters()
 
     # Load isaac sim parameters
     isaac_app_filename, \
@@ -242,7 +244,8 @@ def main(_):
                               time_delay=time_delay,
                               num_isaac_samples=num_isaac_samples,
                               speed_threshold=speed_threshold,
-                              angular_speed_threshold=angular_speed_threshold)
+                              angular_speed_threshold=angular_speed_threshold,
+                              cache_dir=cache_dir)
 
     # Perform training
     train(train_model, pretrained_ckpt, imagenet_ckpt, checkpoint_dir, train_steps,